@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+# Compare Jsonable serialization with the previous per-object
+# implementation on a deep object graph
+import decimal
+import json
+import timeit
+from datetime import date, datetime, time
+
+from runjs.backends.jsonable import Jsonable
+
+
+class LegacyJsonable(object):
+    """ Previous implementation: inspects the class on every iteration """
+    def __iter__(self):
+        merged = self.__class__.__dict__.copy()
+        merged.update(self.__dict__)
+        for attr, value in merged.items():
+            if attr.startswith('_'):
+                continue
+            if callable(getattr(self, attr)):
+                continue
+            yield attr, self.value_to_json(value)
+
+    @staticmethod
+    def value_to_json(value):
+        if isinstance(value, str):
+            return value
+        elif isinstance(value, (date, datetime, time)):
+            return value.isoformat()
+        elif type(value).__name__ in ('property', 'cached_property'):
+            return value.__get__(value, value.__class__)
+        elif isinstance(value, decimal.Decimal):
+            return str(value)
+        elif hasattr(value, '__iter__'):
+            if isinstance(value, (list, tuple)):
+                a = []
+                for subval in value:
+                    a.append(LegacyJsonable.value_to_json(subval))
+                return a
+            else:
+                dv = dict(value)
+                d = {}
+                for k in dv:
+                    d[k] = LegacyJsonable.value_to_json(dv[k])
+                return d
+        else:
+            return value
+
+
+def make_node_class(base):
+    class Node(base):
+        kind = 'node'
+        weight = 1.5
+
+        def __init__(self, depth, width):
+            self.depth = depth
+            self.tags = ['a', 'b', 'c']
+            self.meta = {'width': width, 'depth': depth}
+            self.children = [
+                Node(depth - 1, width) for _ in range(width)] if depth else []
+
+        @property
+        def visible(self):
+            return True
+
+        def method(self):
+            return None
+    return Node
+
+
+if __name__ == '__main__':
+    for depth, width in ((4, 4), (6, 3), (10, 2)):
+        new = make_node_class(Jsonable)(depth, width)
+        old = make_node_class(LegacyJsonable)(depth, width)
+        assert json.dumps(dict(new)) == json.dumps(dict(old))
+        number = 20
+        t_old = timeit.timeit(lambda: json.dumps(dict(old)), number=number)
+        t_new = timeit.timeit(lambda: json.dumps(dict(new)), number=number)
+        t_bytes = timeit.timeit(new.to_json_bytes, number=number)
+        print('depth=%-2d width=%d  legacy %.2fms  plan %.2fms  '
+              'to_json_bytes %.2fms  speedup x%.1f' % (
+                  depth, width, t_old / number * 1000,
+                  t_new / number * 1000, t_bytes / number * 1000,
+                  t_old / t_new))
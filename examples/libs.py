@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import base64
+
 from runjs import *
 
 js_code = '''
@@ -8,6 +10,12 @@ function decode_cbor() {
     var decoded = CBOR.decode(encoded);
     return decoded;
 }
+
+function decode_cbor_bytes(data) {
+    // bytes are passed as Uint8Array
+    return CBOR.decode(
+        data.buffer.slice(data.byteOffset, data.byteOffset + data.length));
+}
 '''
 
 js = JSRunWrapper.factory(
@@ -17,3 +25,6 @@ js = JSRunWrapper.factory(
 
 # Call JS functions
 print(js.run(func='decode_cbor'))
+print(js.run(
+    func='decode_cbor_bytes',
+    fargs=[base64.b64decode('jRgeGl9SAAQaAALMLBoAV++uGgA816oYZAEYGhgaGBsYPQYD')]))
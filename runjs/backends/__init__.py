@@ -1,5 +1,117 @@
 # -*- coding: utf-8 -*-
-from .nodejs_backend import *
-from .pyv8_backend import *
-from .pyduk_backend import *
-from .pyv8_new_backend import *
+"""
+Registry of the backends, a backend module (and its JS engine library)
+is imported only when the backend is requested:
+
+    get_backend('nodejs')  # or `from runjs.backends import NodeJSBackend`
+
+Third-party backends are registered by `register_backend()` or by
+the `runjs.backends` entry point group of their package:
+
+    entry_points={'runjs.backends': ['quickjs = mypkg.quickjs:QuickJSBackend']}
+"""
+import importlib
+import logging
+import threading
+
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+__all__ = ['NodeJSBackend', 'PyV8Backend', 'PydukBackend', 'PyV8NewBackend',
+           'AutoBackend', 'RemoteBackend', 'register_backend', 'get_backend',
+           'backend_names', 'ENTRY_POINT_GROUP', ]
+
+ENTRY_POINT_GROUP = 'runjs.backends'
+
+# name: backend class or 'module:Class' imported on the first request
+_backends = OrderedDict((
+    ('nodejs', 'runjs.backends.nodejs_backend:NodeJSBackend'),
+    ('pyv8', 'runjs.backends.pyv8_backend:PyV8Backend'),
+    ('pyduk', 'runjs.backends.pyduk_backend:PydukBackend'),
+    ('pyv8_new', 'runjs.backends.pyv8_new_backend:PyV8NewBackend'),
+    ('auto', 'runjs.backends.router:AutoBackend'),
+    ('remote', 'runjs.backends.remote_backend:RemoteBackend'),
+))
+
+# Class names of the built-in backends available as module attributes
+_class_names = {
+    'NodeJSBackend': 'nodejs',
+    'PyV8Backend': 'pyv8',
+    'PydukBackend': 'pyduk',
+    'PyV8NewBackend': 'pyv8_new',
+    'AutoBackend': 'auto',
+    'RemoteBackend': 'remote',
+}
+
+_lock = threading.RLock()
+_entry_points_loaded = False
+
+
+def register_backend(name, backend):
+    """
+    Register backend for `JSRunWrapper.factory(backend=name)`
+    :param str name: backend name
+    :param type|str backend: `AbstractBackend` subclass or its import
+        path 'module:Class' (imported on the first request)
+    """
+    with _lock:
+        _backends[name] = backend
+
+
+def get_backend(name):
+    """
+    Return backend class by name, its module is imported on the first call
+    :param str name: backend name
+    :rtype: type
+    :raise ValueError: unknown backend
+    """
+    with _lock:
+        if name not in _backends:
+            _load_entry_points()
+        try:
+            backend = _backends[name]
+        except KeyError:
+            raise ValueError('Invalid backend: %s' % name)
+        if isinstance(backend, str):
+            module_name, _, class_name = backend.partition(':')
+            backend = getattr(importlib.import_module(module_name), class_name)
+            _backends[name] = backend
+        return backend
+
+
+def backend_names():
+    """
+    Return names of the registered backends, modules are not imported
+    :rtype: list
+    """
+    with _lock:
+        _load_entry_points()
+        return list(_backends)
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:  # Python < 3.8
+        return
+    try:
+        eps = entry_points(group=ENTRY_POINT_GROUP)
+    except TypeError:  # Python < 3.10
+        eps = entry_points().get(ENTRY_POINT_GROUP, ())
+    for ep in eps:
+        # Built-in names are not overridden by installed packages
+        if ep.name not in _backends:
+            _backends[ep.name] = ep.value
+            logger.debug('Registered backend %s = %s', ep.name, ep.value)
+
+
+def __getattr__(name):
+    if name in _class_names:
+        return get_backend(_class_names[name])
+    raise AttributeError(
+        'module %r has no attribute %r' % (__name__, name))
@@ -1,15 +1,139 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
+import json
 import logging
 import os
 import os.path
 import shutil
-import tempfile
+import threading
+import time
 
 from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
 
-from .exceptions import ArgumentError
+from . import binary
+from .bundle import build_bundle
+from .exceptions import (
+    ArgumentError, JSException, JSRuntimeException, JSTimeoutError)
+from .libcache import library_cache
+from .metrics import call_metrics
+from .pipeline import Pipeline
+from .recycle import RecyclePolicy
+from .result_cache import ResultCache, result_cache as default_result_cache
+from .shared_data import DataHandle, shared_data
 
-__all__ = ['AbstractBackend', ]
+__all__ = ['AbstractBackend', 'deadline', 'call_with_deadline', ]
+
+logger = logging.getLogger(__name__)
+
+_MISSING = object()
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__) + '/../data')
+
+# Helper functions evaluated in the global scope of the engines
+with open(DATA_DIR + '/helpers.js') as helpers_file:
+    JS_HELPERS = helpers_file.read()
+
+# Max threads of the calls made by `call_with_deadline()`, an abandoned
+# call keeps its thread until the script ends
+MAX_CALL_THREADS = 16
+_call_threads = threading.BoundedSemaphore(MAX_CALL_THREADS)
+
+
+@contextmanager
+def deadline(timeout, interrupt):
+    """
+    Call `interrupt()` from a timer thread if the block does not finish
+        in `timeout` seconds, the block is then failed by `JSTimeoutError`
+    :param float timeout: seconds or `None` (no deadline)
+    :param callable interrupt: stops the running JS (kills the process,
+        terminates the engine)
+    :raise JSTimeoutError: the deadline has passed
+    """
+    if timeout is None:
+        yield
+        return
+    if timeout <= 0:
+        raise JSTimeoutError('The JS call timed out after %ss' % timeout)
+    expired = threading.Event()
+
+    def expire():
+        expired.set()
+        interrupt()
+
+    timer = threading.Timer(timeout, expire)
+    timer.daemon = True
+    timer.start()
+    try:
+        yield
+    except Exception as err:
+        if expired.is_set():
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from err
+        raise
+    finally:
+        timer.cancel()
+    if expired.is_set():
+        raise JSTimeoutError('The JS call timed out after %ss' % timeout)
+
+
+def _remaining(end):
+    """
+    Return seconds left until the `time.monotonic()` deadline or `None`
+    :raise JSTimeoutError: the deadline has passed
+    """
+    if end is None:
+        return None
+    remaining = end - time.monotonic()
+    if remaining <= 0:
+        raise JSTimeoutError('The JS calls timed out')
+    return remaining
+
+
+def call_with_deadline(timeout, call, *args):
+    """
+    Return `call(*args)` made in a daemon thread, the thread is abandoned
+        (and keeps running) if it does not finish in `timeout` seconds,
+        for engines which can not be interrupted. At most
+        `MAX_CALL_THREADS` threads run at once, a call waits for a free
+        one within its deadline
+    :param float timeout: seconds or `None` (no deadline)
+    :raise JSTimeoutError: the deadline has passed
+    """
+    if timeout is None:
+        return call(*args)
+    end = time.monotonic() + timeout
+    if not _call_threads.acquire(timeout=max(timeout, 0)):
+        logger.warning(
+            'No free thread for the JS call, %d calls are still running',
+            MAX_CALL_THREADS)
+        raise JSTimeoutError('The JS call timed out after %ss' % timeout)
+    future = Future()
+
+    def target():
+        future.set_running_or_notify_cancel()
+        try:
+            future.set_result(call(*args))
+        except BaseException as err:
+            future.set_exception(err)
+        finally:
+            _call_threads.release()
+
+    try:
+        threading.Thread(
+            target=target, name='runjs-call', daemon=True).start()
+    except Exception:
+        _call_threads.release()
+        raise
+    try:
+        return future.result(max(end - time.monotonic(), 0))
+    except FutureTimeoutError:
+        if future.done():
+            raise
+    raise JSTimeoutError('The JS call timed out after %ss' % timeout)
 
 
 class AbstractBackend(object):
@@ -17,8 +141,14 @@ class AbstractBackend(object):
     logger = logging.getLogger(__name__)
     can_precompile = False  # the backend can precompile
     can_run_str = False  # the backend can execute code from string
+    bundle_modules = False  # bundled libraries are run as Node.js modules
+    executor_max_workers = 4  # threads shared by `arun()` of all instances
+    _executor = None
+    _executor_lock = threading.Lock()
 
-    def __init__(self, js_code='', js_libs=[], js_libs_code={}):
+    def __init__(self, js_code='', js_libs=[], js_libs_code={},
+                 persistent=False, metrics=None, result_cache=None,
+                 timeout=None, bundle=False, recycle=None):
         """
         Create new JS wrapper
         :param str js_code: (optional) JS code for run
@@ -26,12 +156,52 @@ class AbstractBackend(object):
         :param dict js_libs_code: (optional) dict of JS libraries code
             `key` is library name (ex: library.js)
             `value` is source code
+        :param bool persistent: (optional) if true, then the libraries
+            and JS code are evaluated once in a warm engine context
+            which is reused by the next `run()` calls until `reset()`
+        :param MetricsSink metrics: (optional) receiver of phase timings
+            and sizes of `run()` calls, default is the sink set by
+            `metrics.set_metrics_sink()`
+        :param ResultCache result_cache: (optional) cache of the results
+            of `run(..., cache=True)` and of the functions registered by
+            `cache_function()`, default is the process-wide cache
+        :param float timeout: (optional) default deadline of `run()`
+            calls in seconds, `None` waits forever
+        :param bool bundle: (optional) if true, then the libraries are
+            joined into one bundle (see `bundle.build_bundle()`): identical
+            libraries are included once, comments and whitespace are
+            stripped, JS tracebacks point to the original files and lines
+        :param RecyclePolicy|dict recycle: (optional) when the long-lived
+            engines (workers, engine processes, the warm context) are
+            replaced by fresh ones (see `recycle.RecyclePolicy`)
         """
         self.js_code = js_code
-        self.js_libs = js_libs if js_libs else []
+        self.js_libs = list(js_libs) if js_libs else []
         self.js_libs_code = OrderedDict()
         self.js_libs_tmpdir = None
         self.js_global_vars = OrderedDict()
+        # Global variables are serialized once and re-sent to warm
+        # engines only when changed, every set/delete bumps the version
+        self.js_global_vars_json = {}  # name: serialized value
+        self.js_global_vars_serial = {}  # name: version of the last set
+        self.js_global_vars_deleted = {}  # name: version of the deletion
+        self.js_global_vars_version = 0
+        self.persistent = persistent
+        self.js_context = None  # warm engine context (persistent mode)
+        self.js_context_result = None  # result of loading the JS code
+        self.js_context_version = 0  # global vars version of the context
+        self.js_context_calls = 0  # calls served by the context
+        self.js_context_used = time.monotonic()  # time of the last call
+        self.js_context_executor = None  # `arun()` thread of the context
+        self.metrics = metrics
+        self.result_cache = result_cache
+        self.cached_functions = {}  # name: names of relevant globals
+        self.js_code_digest = None  # hash of the code and inline libs
+        self.js_libs_digests = {}  # (path, mtime, size): hash of the lib
+        self.js_global_vars_digests = {}  # names: (version, hash)
+        self.timeout = timeout
+        self.bundle = None  # Bundle of the libraries
+        self.recycle = RecyclePolicy.create(recycle)
 
         if not isinstance(self.js_libs, (list, tuple)):
             err = 'The `js_libs` argument must be list or tuple'
@@ -43,27 +213,35 @@ class AbstractBackend(object):
             self.logger.error(err)
             raise ArgumentError(err)
 
+        if bundle and (self.js_libs or js_libs_code):
+            try:
+                self.bundle = build_bundle(
+                    self.js_libs, js_libs_code, module=self.bundle_modules)
+            except OSError as e:
+                err = 'Can not read JS library file: %s' % e.filename
+                self.logger.error(err)
+                raise ArgumentError(err) from e
+            self.js_libs = []
+            js_libs_code = {self.bundle.name: self.bundle.code}
+
         if self.can_run_str:
             for lib_file in self.js_libs:
                 lib_file = os.path.abspath(lib_file)
-                if os.path.isfile(lib_file) and os.access(lib_file, os.R_OK):
-                    lib_code = open(lib_file).read()
-                    self.js_libs_code[os.path.basename(lib_file)] = lib_code
-                else:
+                try:
+                    lib_code = library_cache.read(lib_file)
+                except OSError:
                     self.logger.error(
                         'Can not read JS library file: %s' % lib_file)
+                else:
+                    self.js_libs_code[os.path.basename(lib_file)] = lib_code
 
             for js_lib, js_code in js_libs_code.items():
                 self.js_libs_code[js_lib] = js_code
         else:
-            # Write libs to files
-            self.js_libs_tmpdir = tempfile.mkdtemp()
+            # Libs are written to files shared by all instances
             for js_lib, js_code in js_libs_code.items():
-                js_lib_path = self.js_libs_tmpdir + '/' + js_lib
-                js_lib_file = open(js_lib_path, 'w')
-                js_lib_file.write(js_code)
-                js_lib_file.close()
-                self.js_libs.append(js_lib_path)
+                self.js_libs.append(
+                    library_cache.materialize(js_lib, js_code))
 
         if self.js_code:
             self.js_libs_code['main'] = self.js_code
@@ -74,7 +252,8 @@ class AbstractBackend(object):
 
     def set_global_vars(self, js_vars):
         """
-        Set variables for pass to JS global context
+        Set variables for pass to JS global context, a value is
+            serialized once, so set it again after changing it in place
         :param dict vars: variables to pass
         :rtype: bool
         """
@@ -84,6 +263,10 @@ class AbstractBackend(object):
             raise ArgumentError(err)
         for k in js_vars.keys():
             self.js_global_vars[k] = js_vars[k]
+            self.js_global_vars_version += 1
+            self.js_global_vars_serial[k] = self.js_global_vars_version
+            self.js_global_vars_json.pop(k, None)
+            self.js_global_vars_deleted.pop(k, None)
         return True
 
     def delete_global_vars(self, js_vars):
@@ -97,8 +280,64 @@ class AbstractBackend(object):
             raise ArgumentError(err)
         for k in js_vars:
             del self.js_global_vars[k]
+            self.js_global_vars_version += 1
+            self.js_global_vars_deleted[k] = self.js_global_vars_version
+            self.js_global_vars_json.pop(k, None)
+            self.js_global_vars_serial.pop(k, None)
         return True
 
+    def get_global_var_json(self, name):
+        """
+        Return variable of JS global context serialized to JSON
+        :param str name: variable name
+        :rtype: str
+        """
+        value = self.js_global_vars[name]
+        if isinstance(value, DataHandle):
+            # Not cached here, the handle of other process maps its file
+            return value.json
+        value_json = self.js_global_vars_json.get(name)
+        if value_json is None:
+            value_json = self._get_js_json(self.js_global_vars[name])
+            self.js_global_vars_json[name] = value_json
+        return value_json
+
+    def get_global_vars_json(self):
+        """
+        Return all variables of JS global context serialized to JSON
+        :rtype: OrderedDict
+        """
+        return OrderedDict(
+            (k, self.get_global_var_json(k)) for k in self.js_global_vars)
+
+    def global_vars_delta(self, version, serialized=True, data_refs=False):
+        """
+        Return changes of JS global context variables since `version`
+        :param int version: version seen by the engine, `0` for a new one
+        :param bool serialized: (optional) if false, then return raw
+            values instead of JSON
+        :param bool data_refs: (optional) if true, then registered data
+            is returned as a reference to its file (see `register_data()`)
+        :rtype: tuple
+        :return: current version, OrderedDict of changed variables and
+            list of deleted variable names
+        """
+        changed = OrderedDict()
+        for k in self.js_global_vars:
+            if self.js_global_vars_serial[k] > version:
+                value = self.js_global_vars[k]
+                if data_refs and isinstance(value, DataHandle):
+                    changed[k] = value.ref_json
+                else:
+                    changed[k] = (
+                        self.get_global_var_json(k) if serialized else value)
+        deleted = []
+        if version:
+            deleted = [
+                k for k, serial in self.js_global_vars_deleted.items()
+                if serial > version]
+        return self.js_global_vars_version, changed, deleted
+
     def set_global_var(self, name, value):
         """
         Set variable for pass to JS global context
@@ -116,6 +355,199 @@ class AbstractBackend(object):
         """
         return self.delete_global_vars((name, ))
 
+    def register_data(self, name, value):
+        """
+        Set large read-only value as variable of JS global context: it is
+            serialized once per process for all backends, versioned by
+            content hash and re-sent to warm engines only when its content
+            changes; Node.js workers and worker processes load it from
+            a shared file instead of the pipe
+        :param str name: variable name
+        :param value: value or `DataHandle` of registered data
+        :rtype: DataHandle
+        """
+        handle = shared_data.register(value)
+        current = self.js_global_vars.get(name)
+        if not isinstance(current, DataHandle) or current != handle:
+            self.set_global_vars({name: handle})
+        return handle
+
+    def reset(self):
+        """
+        Drop the warm engine context, so the next `run()` starts
+        from the pristine state
+        """
+        self.js_context = None
+        self.js_context_result = None
+        self.js_context_version = 0
+        self.js_context_calls = 0
+
+    def _recycle_context(self):
+        """
+        Count the call of the warm context, the context retired by
+            the recycle policy is dropped and the call loads a new one
+            (in-process engines can not be started in the background,
+            their memory is not sampled)
+        """
+        if self.recycle is not None and self.js_context is not None:
+            reason = self.recycle.reason(self.js_context_calls)
+            if reason is None and self.recycle.idle(
+                    self.js_context_calls, self.js_context_used):
+                reason = 'idle'
+            if reason is not None:
+                AbstractBackend.reset(self)
+                self.recycle.record(type(self).__name__, reason, self.metrics)
+        self.js_context_calls += 1
+        self.js_context_used = time.monotonic()
+
+    def _global_vars_changes(self, serialized=True):
+        """
+        Return global variables (serialized to JSON) to apply to the warm
+        engine context and names of the variables deleted since
+        the previous call
+        :param bool serialized: (optional) if false, then return raw
+            values instead of JSON
+        :rtype: tuple
+        """
+        self.js_context_version, changed, deleted = self.global_vars_delta(
+            self.js_context_version, serialized)
+        return list(changed.items()), deleted
+
+    def cache_function(self, func, global_vars=None):
+        """
+        Memoize results of the pure JS function, calls with the same
+            code, arguments and global variables return the cached result
+            without running the engine
+        :param str func: JS function name
+        :param list global_vars: (optional) names of the global variables
+            the function depends on, default is all of them
+        """
+        self.cached_functions[func] = (
+            tuple(global_vars) if global_vars is not None else None)
+
+    def uncache_function(self, func):
+        """
+        Stop memoizing results of the JS function
+        :param str func: JS function name
+        """
+        self.cached_functions.pop(func, None)
+
+    def _run_cached(self, func, fargs, run):
+        """
+        Return result of `run(func, fargs)` from the result cache, the
+            result is cached if it is not there
+        """
+        key = self._result_cache_key(func, fargs)
+        if key is None:
+            return run(func, fargs)
+        cache = self.result_cache or default_result_cache
+        result = cache.get(key, _MISSING)
+        if result is _MISSING:
+            result = run(func, fargs)
+            cache.set(key, result)
+        return result
+
+    def _result_cache_key(self, func, fargs):
+        """
+        Return key of the call in the result cache or `None` if the
+            arguments can not be canonicalized
+        """
+        try:
+            fargs_json = binary.dumps(
+                list(fargs or ()), sort_keys=True, separators=(',', ':'),
+                allow_nan=False, default=self._canonical_arg)
+        except (TypeError, ValueError) as err:
+            self.logger.debug('Call of %s is not cached: %s', func, err)
+            return None
+        return ResultCache.make_key(
+            self._result_cache_scope(), self._code_digest(), str(func),
+            fargs_json,
+            self._global_vars_digest(self.cached_functions.get(func)))
+
+    def _result_cache_scope(self):
+        """
+        Return part of the result cache keys which separates results of
+            the backends sharing a cache, engines convert the same JS
+            value to different Python objects (ex: int or float)
+        :rtype: str
+        """
+        return type(self).__name__
+
+    @staticmethod
+    def _canonical_arg(obj):
+        if binary.is_binary(obj):
+            return binary.marker(obj)
+        if hasattr(obj, '__dict__'):
+            return dict(obj)
+        raise TypeError('%s is not JSON serializable' % type(obj).__name__)
+
+    def _code_digest(self):
+        """
+        Return hash of the JS code and the libraries, files are hashed
+            again when they are modified
+        """
+        if self.js_code_digest is None:
+            parts = [self.js_code]
+            for name, code in self.js_libs_code.items():
+                parts.extend((name, code))
+            self.js_code_digest = ResultCache.make_key(*parts)
+        parts = [self.js_code_digest]
+        for lib_file in self.js_libs:
+            try:
+                parts.append(self._lib_digest(lib_file))
+            except OSError:
+                parts.append(os.path.abspath(lib_file))
+        return ResultCache.make_key(*parts)
+
+    def _lib_digest(self, lib_file):
+        """
+        Return content hash of the library file, it is computed again
+            only when the file is modified
+        :raise OSError: the file can not be read
+        """
+        lib_file = os.path.abspath(lib_file)
+        stat = os.stat(lib_file)
+        lib_key = (lib_file, stat.st_mtime_ns, stat.st_size)
+        digest = self.js_libs_digests.get(lib_key)
+        if digest is None:
+            digest = self.js_libs_digests[lib_key] = (
+                library_cache.digest(library_cache.read(lib_file)))
+        return digest
+
+    def _global_vars_digest(self, names=None):
+        """
+        Return hash of the global variables (all or `names`), it is
+            computed again only after they are changed
+        """
+        cached = self.js_global_vars_digests.get(names)
+        if cached is not None and cached[0] == self.js_global_vars_version:
+            return cached[1]
+        parts = []
+        for k in (self.js_global_vars if names is None else names):
+            value = self.js_global_vars.get(k, _MISSING)
+            if isinstance(value, DataHandle):
+                parts.extend((k, value.digest))
+            elif value is not _MISSING:
+                parts.extend((k, self.get_global_var_json(k)))
+        digest = ResultCache.make_key(*parts)
+        self.js_global_vars_digests[names] = (
+            self.js_global_vars_version, digest)
+        return digest
+
+    def _call_timeout(self, timeout):
+        """
+        Return deadline of the call: `timeout` or the default one
+        """
+        return self.timeout if timeout is None else timeout
+
+    def _call_metrics(self, func):
+        """
+        Return context manager which records metrics of the `run()` call,
+            it does nothing when no sink is set
+        :param str func: JS function name or `None`
+        """
+        return call_metrics(self, func)
+
     def delete_lib_tempdir(self):
         """
         Delete the temporary directory created for the libraries
@@ -125,3 +557,158 @@ class AbstractBackend(object):
 
     def run(self, *args, **kwargs):
         raise NotImplementedError('Subclasses must override `run()`')
+
+    def run_many(self, func, fargs_iter, chunk_size=100, as_generator=False,
+                 timeout=None):
+        """
+        Call JS function for every list of arguments, each chunk of
+            calls is sent to the engine at once
+
+        :param str func: JS function name
+        :param iterable fargs_iter: lists of JS function args
+        :param int chunk_size: (optional) number of calls per chunk
+        :param bool as_generator: (optional) if true, then return
+            generator instead of list
+        :param float timeout: (optional) deadline of all calls in seconds,
+            the running chunk is interrupted as by `run(..., timeout=...)`
+        :rtype: list|generator
+        :return: results in order of `fargs_iter`, a failed call is
+            represented by `JSException` instance instead of result
+        :raise JSTimeoutError: the deadline has passed
+        """
+        if chunk_size < 1:
+            err = 'The `chunk_size` argument must be positive'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        results = self._iter_many(func, fargs_iter, chunk_size, timeout)
+        return results if as_generator else list(results)
+
+    def pipeline(self):
+        """
+        Return new pipeline of JS function calls made in one engine
+            call (see `Pipeline`)
+        :rtype: Pipeline
+        """
+        return Pipeline(self)
+
+    async def arun(self, func=None, fargs=[], timeout=None):
+        """
+        Awaitable version of `run()`, the call is made in a bounded
+            thread pool to keep the event loop free
+
+        :param str func: (optional) JS function name
+        :param list fargs: (optional) list of JS function args
+        :param float timeout: (optional) seconds to wait for the result,
+            the engine is interrupted as by `run(..., timeout=...)`
+
+        :raise JSTimeoutError: the result is not ready in time
+        """
+        timeout = self._call_timeout(timeout)
+        return await self._in_executor(
+            functools.partial(self.run, func, fargs, timeout=timeout),
+            timeout)
+
+    async def arun_many(self, func, fargs_iter, chunk_size=100,
+                        timeout=None):
+        """
+        Awaitable version of `run_many()`, returns list of results
+
+        :param float timeout: (optional) seconds to wait for all results,
+            the engine is interrupted as by `run_many(..., timeout=...)`
+
+        :raise JSTimeoutError: the results are not ready in time
+        """
+        return await self._in_executor(functools.partial(
+            self.run_many, func, list(fargs_iter), chunk_size,
+            timeout=timeout), timeout)
+
+    async def _in_executor(self, call, timeout=None):
+        """
+        Run `call()` in the executor, on cancel or timeout the result is
+            dropped
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(self._get_executor(), call), timeout)
+        except JSTimeoutError:
+            raise
+        except asyncio.TimeoutError as err:
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from err
+
+    def _get_executor(self):
+        """
+        Return executor for `arun()`, the warm context of persistent mode
+            is used by a single thread
+        """
+        if self.persistent:
+            if self.js_context_executor is None:
+                self.js_context_executor = ThreadPoolExecutor(max_workers=1)
+            return self.js_context_executor
+        with self._executor_lock:
+            if AbstractBackend._executor is None:
+                AbstractBackend._executor = ThreadPoolExecutor(
+                    max_workers=self.executor_max_workers)
+            return AbstractBackend._executor
+
+    def _iter_many(self, func, fargs_iter, chunk_size, timeout=None):
+        end = None if timeout is None else time.monotonic() + timeout
+        chunk = []
+        for fargs in fargs_iter:
+            chunk.append(list(fargs))
+            if len(chunk) == chunk_size:
+                yield from self._run_chunk(func, chunk, _remaining(end))
+                chunk = []
+        if chunk:
+            yield from self._run_chunk(func, chunk, _remaining(end))
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Call JS function for every list of arguments of the chunk,
+            subclasses override it to loop inside the engine
+        :param float timeout: (optional) deadline of the chunk in seconds
+        :rtype: list
+        :raise JSTimeoutError: the deadline has passed
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        results = []
+        for fargs in chunk:
+            try:
+                results.append(self.run(
+                    func=func, fargs=fargs, timeout=_remaining(end)))
+            except JSTimeoutError:
+                raise
+            except JSException as err:
+                results.append(err)
+        return results
+
+    @staticmethod
+    def _get_js_json(obj):
+        """
+        Serialize Python object to JSON source of JS object, binary
+            objects are serialized to markers (see `binary.py`)
+        """
+        if binary.is_binary(obj):
+            return binary.marker_json(obj)
+        if isinstance(obj, DataHandle):
+            return obj.json
+        if hasattr(obj, '__dict__'):
+            obj = dict(obj)
+        return binary.dumps(obj)
+
+    @staticmethod
+    def _batch_results(items):
+        """
+        Convert items returned by `__runjs_batch()` to results
+        :param list items: list of {'result': ...} or {'error': ...}
+        :rtype: list
+        """
+        results = []
+        for item in items:
+            if 'error' in item:
+                results.append(JSRuntimeException(
+                    item['error']['message'], item['error']['stack']))
+            else:
+                results.append(item.get('result'))
+        return results
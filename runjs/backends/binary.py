@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""
+Binary values (`bytes`, `bytearray`, `memoryview`, `array.array`) passed
+to JS as typed arrays and typed arrays returned back.
+
+Inside JSON a binary value is represented by a marker object:
+    {"__runjs_binary__": ["Float64Array", "<base64>"]}
+or, in frames of the Node.js worker, by index of the frame buffer:
+    {"__runjs_binary__": ["Float64Array", 0]}
+
+A frame is:
+    <uint32 JSON length> <uint32 buffers count> <uint32 buffer length>...
+    <JSON> <buffer>...
+(little-endian), so buffers are written and read without encoding.
+
+An object of user data with the only key of a marker (or of a reference to
+registered data, see `shared_data.py`) is escaped by appending "~" to
+the key, so it is not taken for a marker; the decoders remove one "~":
+    {"__runjs_binary__": 1} <-> {"__runjs_binary__~": 1}
+"""
+import array
+import base64
+import json
+import struct
+
+from .exceptions import ArgumentError
+
+__all__ = ['MARKER', 'is_binary', 'typed_array_type', 'byte_view',
+           'marker', 'marker_json', 'js_expression', 'js_value',
+           'escape', 'dumps', 'from_marker', 'loads', 'to_picklable', 'from_picklable',
+           'encode_frame', 'read_frame', 'aread_frame', ]
+
+MARKER = '__runjs_binary__'
+# Start of the marker keys (and their escaped versions) inside JSON
+MARKER_KEY_PREFIX = '"__runjs_'
+# Keys of the markers, `shared_data.DATA_MARKER` is the second one
+_MARKER_KEYS = (MARKER, '__runjs_data__')
+
+BINARY_TYPES = (bytes, bytearray, memoryview, array.array)
+
+# (format character, item size): JS typed array
+_TYPED_ARRAYS = {
+    ('b', 1): 'Int8Array', ('B', 1): 'Uint8Array',
+    ('h', 2): 'Int16Array', ('H', 2): 'Uint16Array',
+    ('i', 4): 'Int32Array', ('I', 4): 'Uint32Array',
+    ('l', 4): 'Int32Array', ('L', 4): 'Uint32Array',
+    ('q', 8): 'BigInt64Array', ('Q', 8): 'BigUint64Array',
+    ('l', 8): 'BigInt64Array', ('L', 8): 'BigUint64Array',
+    ('f', 4): 'Float32Array', ('d', 8): 'Float64Array',
+}
+
+# JS typed array: memoryview format, types missing here are returned
+# as `bytes`
+_FORMATS = {
+    'Int8Array': 'b', 'Int16Array': 'h', 'Uint16Array': 'H',
+    'Int32Array': 'i', 'Uint32Array': 'I', 'Float32Array': 'f',
+    'Float64Array': 'd', 'BigInt64Array': 'q', 'BigUint64Array': 'Q',
+}
+
+_HEADER = struct.Struct('<II')
+_LENGTH = struct.Struct('<I')
+
+
+def is_binary(obj):
+    """ Return true if the object is passed to JS as typed array """
+    return isinstance(obj, BINARY_TYPES)
+
+
+def typed_array_type(obj):
+    """
+    Return name of the JS typed array for the binary object
+    :raise ArgumentError: the item type has no typed array
+    """
+    if isinstance(obj, (bytes, bytearray)):
+        return 'Uint8Array'
+    if isinstance(obj, array.array):
+        fmt, itemsize = obj.typecode, obj.itemsize
+    else:
+        fmt, itemsize = obj.format.lstrip('@=<>!'), obj.itemsize
+    try:
+        return _TYPED_ARRAYS[(fmt, itemsize)]
+    except KeyError:
+        raise ArgumentError(
+            'Can not pass items of type "%s" as typed array' % fmt)
+
+
+def byte_view(obj):
+    """
+    Return memoryview of the bytes of the binary object (no copy for
+        contiguous objects)
+    """
+    view = memoryview(obj)
+    if not view.c_contiguous:
+        view = memoryview(view.tobytes())
+    return view.cast('B') if view.format != 'B' or view.ndim != 1 else view
+
+
+def marker(obj, index=None):
+    """
+    Return marker of the binary object, with base64 of the data or
+        with `index` of the frame buffer
+    """
+    data = index
+    if index is None:
+        data = base64.b64encode(byte_view(obj)).decode('ascii')
+    return {MARKER: [typed_array_type(obj), data]}
+
+
+def marker_json(obj, index=None):
+    """ Return marker of the binary object serialized to JSON """
+    return json.dumps(marker(obj, index))
+
+
+def js_expression(obj):
+    """
+    Return JS source creating the typed array (needs `data/helpers.js`)
+    """
+    return '__runjs_binary("%s", "%s")' % (
+        typed_array_type(obj),
+        base64.b64encode(byte_view(obj)).decode('ascii'))
+
+
+def js_value(value_json):
+    """
+    Return JS source of the value serialized to JSON, markers of binary
+        values are converted to typed arrays and escaped keys are
+        restored (needs `data/helpers.js`)
+    :param str value_json: JSON
+    """
+    if MARKER_KEY_PREFIX in value_json:
+        return '__runjs_parse(%s)' % json.dumps(value_json)
+    return value_json
+
+
+def _is_marker_key(key):
+    """ Return true if the key is a marker key or its escaped version """
+    return key.startswith('__runjs_') and key.rstrip('~') in _MARKER_KEYS
+
+
+def escape(value):
+    """
+    Return copy of the value with the objects (dicts) which have the only
+        marker key escaped, so they are not decoded as markers, objects
+        converted to dict (`Jsonable`) are converted here
+    """
+    if hasattr(value, '__dict__') and hasattr(value, '__iter__'):
+        value = dict(value)
+    if isinstance(value, dict):
+        value = dict((k, escape(v)) for k, v in value.items())
+        if len(value) == 1:
+            key = next(iter(value))
+            if isinstance(key, str) and _is_marker_key(key):
+                value = {key + '~': value[key]}
+        return value
+    if isinstance(value, (list, tuple)):
+        return [escape(item) for item in value]
+    return value
+
+
+def dumps(value, buffers=None, **kwargs):
+    """
+    Serialize the value to JSON (arguments of `json.dumps()`), objects
+        of user data taken for markers are escaped (see `escape()`)
+    :param list buffers: (optional) frame buffers filled by the `default`
+        function, they are cleared when the value is serialized again
+    :rtype: str
+    """
+    text = json.dumps(value, **kwargs)
+    if MARKER_KEY_PREFIX not in text:
+        return text
+    if buffers is not None:
+        del buffers[:]
+    return json.dumps(escape(value), **kwargs)
+
+
+def from_marker(value, buffers=None):
+    """
+    Return Python value of the marker: `bytes` for Uint8Array, ArrayBuffer
+        and other byte arrays, memoryview of the items for other typed
+        arrays, an escaped object is restored and not a marker is returned
+        as is
+    :param list buffers: (optional) frame buffers
+    """
+    if type(value) is not dict or len(value) != 1:
+        return value
+    key = next(iter(value))
+    if key != MARKER:
+        if isinstance(key, str) and key.endswith('~') and _is_marker_key(key):
+            return {key[:-1]: value[key]}
+        return value
+    js_type, data = value[MARKER]
+    if isinstance(data, int):
+        data = buffers[data]
+    else:
+        data = base64.b64decode(data)
+    fmt = _FORMATS.get(js_type)
+    if fmt is None:
+        return bytes(data)
+    return memoryview(data).cast(fmt)
+
+
+def loads(text, buffers=None):
+    """
+    Parse JSON, markers of binary values (and escaped objects) are
+        converted by `from_marker()`
+    :param str|bytes text: JSON
+    :param list buffers: (optional) frame buffers
+    """
+    marker_key = (MARKER_KEY_PREFIX if isinstance(text, str)
+                  else MARKER_KEY_PREFIX.encode())
+    if marker_key not in text:
+        return json.loads(text)
+    return json.loads(
+        text, object_hook=lambda value: from_marker(value, buffers))
+
+
+def to_picklable(value):
+    """
+    Return the value to send to other process, memoryview is not
+        picklable and is sent as `array.array` (or `bytes`)
+    """
+    if isinstance(value, memoryview):
+        if value.format in array.typecodes:
+            return array.array(value.format, value)
+        return value.tobytes()
+    return value
+
+
+def from_picklable(value):
+    """
+    Return the value received from other process (see `to_picklable()`)
+    """
+    if isinstance(value, array.array):
+        return memoryview(value)
+    return value
+
+
+def encode_frame(message, buffers=()):
+    """
+    Return list of chunks of the frame to write
+    :param bytes message: JSON message
+    :param list buffers: (optional) byte views of the binary values
+    """
+    header = _HEADER.pack(len(message), len(buffers))
+    if buffers:
+        header += b''.join(_LENGTH.pack(len(buf)) for buf in buffers)
+    return [header, message] + list(buffers)
+
+
+def _split_frame(message_len, lengths, body):
+    view = memoryview(body)
+    buffers = []
+    offset = message_len
+    for length in lengths:
+        buffers.append(view[offset:offset + length])
+        offset += length
+    return bytes(view[:message_len]), buffers
+
+
+def read_frame(stream):
+    """
+    Read frame from binary stream
+    :rtype: tuple
+    :return: JSON message and list of buffers (memoryviews of one
+        bytes object) or `(None, None)` at the end of the stream
+    """
+    header = stream.read(_HEADER.size)
+    if len(header) < _HEADER.size:
+        return None, None
+    message_len, count = _HEADER.unpack(header)
+    lengths = ()
+    if count:
+        lengths = struct.unpack('<%dI' % count, stream.read(4 * count))
+    size = message_len + sum(lengths)
+    body = stream.read(size)
+    if len(body) < size:
+        return None, None
+    return _split_frame(message_len, lengths, body)
+
+
+async def aread_frame(reader):
+    """
+    Read frame from `asyncio.StreamReader` (see `read_frame()`)
+    """
+    try:
+        message_len, count = _HEADER.unpack(
+            await reader.readexactly(_HEADER.size))
+        lengths = ()
+        if count:
+            lengths = struct.unpack(
+                '<%dI' % count, await reader.readexactly(4 * count))
+        body = await reader.readexactly(message_len + sum(lengths))
+    except EOFError:
+        return None, None
+    return _split_frame(message_len, lengths, body)
@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""
+Build step joining the libraries into one bundle: identical sources are
+included once, comments and whitespace are stripped (line breaks are
+kept, so automatic semicolon insertion is not changed) and every line of
+the bundle is mapped to its original file and line.
+
+Bundles are built once per content and named by its hash
+(`runjs-bundle-<hash>.js`), positions of a bundle in JS tracebacks are
+replaced by the original ones (see `map_traceback()`).
+"""
+import hashlib
+import json
+import os.path
+import re
+import threading
+
+from collections import OrderedDict
+
+from .libcache import library_cache
+
+__all__ = ['Bundle', 'build_bundle', 'strip_js', 'map_traceback', ]
+
+BUNDLE_NAME = 'runjs-bundle-%s.js'
+_BUNDLE_POSITION = re.compile(
+    r'[^\s(@]*runjs-bundle-([0-9a-f]{12})\.js:(\d+)(?::\d+)?')
+
+_VLQ_CHARS = (
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')
+
+# Words after which "/" starts a regular expression, not a division
+_REGEX_KEYWORDS = frozenset((
+    'return', 'typeof', 'instanceof', 'in', 'of', 'new', 'delete', 'void',
+    'throw', 'case', 'do', 'else', 'yield', 'await'))
+_REGEX_AFTER = frozenset('(,=:[!&|?{};+-*%<>~^')
+
+_bundles = OrderedDict()  # id: Bundle, recently built ones
+_max_bundles = 64
+_lock = threading.Lock()
+
+
+def _is_word_char(char):
+    return char.isalnum() or char in '_$'
+
+
+def strip_js(source):
+    """
+    Strip comments and whitespace of JS source, line breaks and the text
+        of strings, template literals and regular expressions are kept.
+        A "/" after ")" or "}" may start a regular expression or be a
+        division, the rest of such line is copied as is.
+    :param str source: JS source code
+    :rtype: list
+    :return: (original line number, stripped line) of non-empty lines
+    """
+    lines = []
+    out = []
+    line_no = 1
+    space = False  # whitespace is pending before the next code char
+    last = ''  # last code char
+    word = ''  # last identifier or keyword
+    braces = [0]  # open braces of the code, per template substitution
+    templates = 0  # template literals with open substitution
+    state = 'code'
+    quote = ''
+    in_class = False  # inside [...] of a regular expression
+    verbatim = False  # the rest of the line is copied as is
+    keep_comment = False  # the block comment is copied as is
+    i = 0
+    length = len(source)
+
+    def flush(keep_empty=False):
+        text = ''.join(out)
+        if text or keep_empty:
+            lines.append((line_no, text))
+        del out[:]
+
+    while i < length:
+        char = source[i]
+        if char == '\n':
+            if state == 'line_comment':
+                state = 'code'
+            elif state in ('string', 'regex'):
+                # Unterminated (or not a regex after all), back to code
+                state = 'code'
+            flush(keep_empty=state == 'template')
+            line_no += 1
+            space = False
+            verbatim = False
+            i += 1
+            continue
+
+        if state == 'code':
+            nxt = source[i + 1] if i + 1 < length else ''
+            if char in ' \t\r\f\v ﻿':
+                if verbatim:
+                    out.append(char)
+                else:
+                    space = True
+                i += 1
+                continue
+            if char == '/' and nxt == '/':
+                state = 'line_comment'
+                if verbatim:
+                    end = source.find('\n', i)
+                    end = length if end < 0 else end
+                    out.append(source[i:end])
+                    i = end
+                else:
+                    i += 2
+                continue
+            if char == '/' and nxt == '*':
+                state = 'block_comment'
+                keep_comment = verbatim
+                if verbatim:
+                    out.append('/*')
+                i += 2
+                continue
+            if space and out:
+                out.append(' ')
+            space = False
+            if char == '/' and last and last in ')}':
+                verbatim = True
+            if char in '\'"':
+                state, quote = 'string', char
+            elif char == '`':
+                state = 'template'
+            elif char == '/' and (
+                    not last or
+                    (last in _REGEX_AFTER and
+                     ''.join(out[-3:]).rstrip()[-2:] not in ('++', '--')) or
+                    (_is_word_char(last) and word in _REGEX_KEYWORDS)):
+                state, in_class = 'regex', False
+            elif char == '{':
+                braces[-1] += 1
+            elif char == '}':
+                if braces[-1] == 0 and templates:
+                    # End of a template substitution
+                    braces.pop()
+                    templates -= 1
+                    state = 'template'
+                else:
+                    braces[-1] -= 1
+            if _is_word_char(char):
+                word = word + char if _is_word_char(last) else char
+            last = char
+            out.append(char)
+            i += 1
+            continue
+
+        if state == 'line_comment':
+            i += 1
+            continue
+
+        if state == 'block_comment':
+            if char == '*' and source.startswith('/', i + 1):
+                state = 'code'
+                space = True
+                if keep_comment:
+                    out.append('*/')
+                i += 2
+                continue
+            if keep_comment:
+                out.append(char)
+            i += 1
+            continue
+
+        # Strings, templates and regular expressions are copied as is
+        out.append(char)
+        i += 1
+        if char == '\\' and i < length and source[i] != '\n':
+            out.append(source[i])
+            i += 1
+            continue
+        if state == 'string':
+            if char == quote:
+                state = 'code'
+                last = char
+        elif state == 'template':
+            if char == '`':
+                state = 'code'
+                last = char
+            elif char == '$' and source.startswith('{', i):
+                out.append('{')
+                i += 1
+                braces.append(0)
+                templates += 1
+                state = 'code'
+                last = '{'
+        elif state == 'regex':
+            if char == '[':
+                in_class = True
+            elif char == ']':
+                in_class = False
+            elif char == '/' and not in_class:
+                state = 'code'
+                last = 'a'  # flags or a division may follow
+                word = ''
+    flush()
+    return lines
+
+
+def _vlq(value):
+    value = (-value << 1) | 1 if value < 0 else value << 1
+    chars = []
+    while True:
+        digit = value & 31
+        value >>= 5
+        if value:
+            digit |= 32
+        chars.append(_VLQ_CHARS[digit])
+        if not value:
+            return ''.join(chars)
+
+
+class Bundle(object):
+    """ Libraries joined into one script with the map of its lines """
+
+    def __init__(self, bundle_id, code, sources, lines):
+        """
+        :param str bundle_id: hash of the content
+        :param str code: bundle source code
+        :param list sources: names (paths) of the bundled libraries
+        :param list lines: (source index, original line) or `None` of
+            every line of the bundle
+        """
+        self.id = bundle_id
+        self.name = BUNDLE_NAME % bundle_id
+        self.code = code
+        self.sources = sources
+        self.lines = lines
+
+    def original_position(self, line):
+        """
+        Return original (name, line) of the bundle line or `None`
+        :param int line: line number of the bundle (from 1)
+        """
+        if 1 <= line <= len(self.lines) and self.lines[line - 1]:
+            index, original_line = self.lines[line - 1]
+            return self.sources[index], original_line
+        return None
+
+    def source_map(self):
+        """
+        Return source map (version 3) of the bundle, lines only
+        :rtype: OrderedDict
+        """
+        mappings = []
+        prev_index = prev_line = 0
+        for position in self.lines:
+            if position is None:
+                mappings.append('')
+                continue
+            index, line = position
+            mappings.append(
+                _vlq(0) + _vlq(index - prev_index) +
+                _vlq(line - 1 - prev_line) + _vlq(0))
+            prev_index, prev_line = index, line - 1
+        return OrderedDict((
+            ('version', 3),
+            ('file', self.name),
+            ('sources', list(self.sources)),
+            ('names', []),
+            ('mappings', ';'.join(mappings)),
+        ))
+
+
+def build_bundle(js_libs=(), js_libs_code=None, module=False, strip=True):
+    """
+    Return bundle of the libraries, identical content is built once
+    :param list js_libs: (optional) paths to JS libraries
+    :param dict js_libs_code: (optional) library name: source code
+    :param bool module: (optional) if true, then every library is wrapped
+        as a Node.js module which exports are copied to the global scope
+        (`include_bundled()` of `data/include.js`), otherwise libraries
+        are joined as scripts
+    :param bool strip: (optional) strip comments and whitespace
+    :rtype: Bundle
+    :raise OSError: a library file can not be read
+    """
+    sources = OrderedDict()  # content hash: (name, source)
+    for path in js_libs:
+        path = os.path.abspath(path)
+        source = library_cache.read(path)
+        sources.setdefault(library_cache.digest(source), (path, source))
+    for name, source in (js_libs_code or {}).items():
+        sources.setdefault(library_cache.digest(source), (name, source))
+
+    bundle_id = hashlib.sha1(json.dumps(
+        [module, strip, [(digest, name) for digest, (name, _)
+                         in sources.items()]]).encode()).hexdigest()[:12]
+    with _lock:
+        bundle = _bundles.get(bundle_id)
+        if bundle is not None:
+            _bundles.move_to_end(bundle_id)
+            return bundle
+
+    code = []
+    lines = []
+    for index, (name, source) in enumerate(sources.values()):
+        if module:
+            code.append(
+                'include_bundled(%s, function (exports, require, module, '
+                '__filename, __dirname) {' % json.dumps(name))
+            lines.append(None)
+        if strip:
+            stripped = strip_js(source)
+        else:
+            stripped = enumerate(source.split('\n'), 1)
+        for line_no, text in stripped:
+            code.append(text)
+            lines.append((index, line_no))
+        # Separated, so the libraries do not continue each other
+        code.append('});' if module else ';')
+        lines.append(None)
+
+    bundle = Bundle(
+        bundle_id, '\n'.join(code) + '\n',
+        [name for name, _ in sources.values()], lines)
+    with _lock:
+        _bundles[bundle_id] = bundle
+        while len(_bundles) > _max_bundles:
+            _bundles.popitem(last=False)
+    return bundle
+
+
+def map_traceback(text):
+    """
+    Replace positions in the bundles (`.../runjs-bundle-<id>.js:12:5`)
+        of the JS traceback by the original file and line
+    :param str text: JS traceback
+    :rtype: str
+    """
+    if not isinstance(text, str) or 'runjs-bundle-' not in text:
+        return text
+
+    def replace(match):
+        with _lock:
+            bundle = _bundles.get(match.group(1))
+        position = bundle and bundle.original_position(int(match.group(2)))
+        if not position:
+            return match.group(0)
+        return '%s:%d' % position
+
+    return _BUNDLE_POSITION.sub(replace, text)
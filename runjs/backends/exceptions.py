@@ -1,3 +1,6 @@
+from .bundle import map_traceback
+
+
 class JSException(Exception):
     """Base exception for javascript engine wrapper."""
 
@@ -16,12 +19,34 @@ class JSRuntimeException(JSException):
     """Javascript runtime exception with a stacktrace."""
 
     def __init__(self, msg, traceback):
-        self.msg = msg
-        self.traceback = traceback
-        super().__init__()
+        # Positions in the bundles are replaced by the original ones
+        self.msg = msg = map_traceback(msg)
+        self.traceback = map_traceback(traceback)
+        super().__init__(msg)
+
+    def __reduce__(self):
+        return self.__class__, (self.msg, self.traceback)
+
+
+class JSLoadError(JSRuntimeException):
+    """The libraries or the JS code can not be loaded by the engine."""
+
+    pass
 
 
 class JSConversionException(JSException):
     """Exception on converting a javascript type to/from python type."""
 
     pass
+
+
+class JSTimeoutError(JSException, TimeoutError):
+    """The JS call did not finish before its deadline."""
+
+    pass
+
+
+class PoolTimeout(JSException):
+    """No idle backend in the pool within the timeout."""
+
+    pass
@@ -2,23 +2,125 @@
 # !!! Note: the object must be converted to a dictionary before
 # !!! JSON serialization
 import decimal
+import json
 from datetime import date, datetime, time
 
 
 __all__ = ('Jsonable', )
 
+_SCALAR_TYPES = frozenset((str, int, float, bool, type(None)))
+_FUNCTION_TYPES = (staticmethod, classmethod, type(lambda: None))
+
+
+class _Plan(object):
+    """
+    Serialization plan of a Jsonable class: class level fields in output
+    order, computed once per class
+    """
+    __slots__ = ('fields', 'names')
+
+    def __init__(self, cls):
+        fields = {}
+        for klass in reversed(cls.__mro__):
+            if klass is object or klass is Jsonable:
+                continue
+            for attr, value in klass.__dict__.items():
+                if attr.startswith('_'):
+                    continue
+                if isinstance(value, _FUNCTION_TYPES):
+                    # methods are never serialized
+                    fields.pop(attr, None)
+                    continue
+                fields[attr] = klass
+
+            slots = klass.__dict__.get('__slots__', ())
+            for attr in (slots, ) if isinstance(slots, str) else slots:
+                if not attr.startswith('_'):
+                    fields[attr] = klass
+
+        # (name, owner class dict, is descriptor)
+        self.fields = tuple(
+            (attr, owner.__dict__,
+             hasattr(owner.__dict__.get(attr), '__get__') or
+             attr not in owner.__dict__)
+            for attr, owner in fields.items())
+        self.names = frozenset(fields)
+
 
 class Jsonable(object):
     """ Mixin for JSONable objects """
     def __iter__(self):
-        merged = self.__class__.__dict__.copy()
-        merged.update(self.__dict__)
-        for attr, value in merged.items():
-            if attr.startswith('_'):
+        return iter(self.to_dict().items())
+
+    def to_dict(self):
+        """
+        Return the object as dict of JSON compatible values
+        :rtype: dict
+        """
+        cls = type(self)
+        plan = cls.__dict__.get('_jsonable_plan')
+        if plan is None:
+            plan = _Plan(cls)
+            cls._jsonable_plan = plan
+        convert = Jsonable._convert
+        instance_dict = getattr(self, '__dict__', {})
+
+        result = {}
+        for attr, owner_dict, is_descriptor in plan.fields:
+            if is_descriptor:
+                # property, cached_property or slot
+                try:
+                    value = getattr(self, attr)
+                except AttributeError:
+                    continue
+            elif attr in instance_dict:
+                value = instance_dict[attr]
+            else:
+                value = owner_dict[attr]
+            if callable(value):
+                continue
+            result[attr] = convert(value)
+
+        for attr, value in instance_dict.items():
+            if attr.startswith('_') or attr in plan.names:
                 continue
-            if callable(getattr(self, attr)):
+            if callable(value):
                 continue
-            yield attr, self.value_to_json(value)
+            result[attr] = convert(value)
+        return result
+
+    def to_json_bytes(self):
+        """
+        Return the object serialized to compact UTF-8 JSON
+        :rtype: bytes
+        """
+        return json.dumps(
+            self.to_dict(), separators=(',', ':')).encode('utf-8')
+
+    @classmethod
+    def reset_jsonable_plan(cls):
+        """
+        Forget the serialization plan, call it after adding or removing
+        class attributes at runtime
+        """
+        if '_jsonable_plan' in cls.__dict__:
+            del cls._jsonable_plan
+
+    @staticmethod
+    def _convert(value):
+        value_type = type(value)
+        if value_type in _SCALAR_TYPES:
+            return value
+        elif value_type is list or value_type is tuple:
+            convert = Jsonable._convert
+            return [convert(subval) for subval in value]
+        elif value_type is dict:
+            convert = Jsonable._convert
+            return {k: convert(v) for k, v in value.items()}
+        elif (isinstance(value, Jsonable) and
+                value_type.__iter__ is Jsonable.__iter__):
+            return value.to_dict()
+        return Jsonable.value_to_json(value)
 
     @staticmethod
     def value_to_json(value):
@@ -34,13 +136,13 @@ class Jsonable(object):
             if isinstance(value, (list, tuple)):
                 a = []
                 for subval in value:
-                    a.append(Jsonable.value_to_json(subval))
+                    a.append(Jsonable._convert(subval))
                 return a
             else:
                 dv = dict(value)
                 d = {}
                 for k in dv:
-                    d[k] = Jsonable.value_to_json(dv[k])
+                    d[k] = Jsonable._convert(dv[k])
                 return d
         else:
             return value
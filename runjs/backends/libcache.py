@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+import atexit
+import errno
+import hashlib
+import logging
+import os
+import os.path
+import shutil
+import stat
+import tempfile
+import threading
+
+from collections import OrderedDict
+
+__all__ = ['LibraryCache', 'library_cache', 'private_dir', 'write_file', ]
+
+
+def private_dir(path=None, prefix='runjs-'):
+    """
+    Return directory for the files of the process: `path` (created if it
+        does not exist) checked to be owned by the user and not writable
+        by others, or a new temporary directory removed at exit
+    :param str path: (optional) directory
+    :param str prefix: (optional) prefix of the temporary directory
+    :rtype: str
+    :raise OSError: `path` is not a private directory of the user
+    """
+    if path is None:
+        path = tempfile.mkdtemp(prefix=prefix)
+        atexit.register(shutil.rmtree, path, True)
+        return path
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if (not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or
+            info.st_mode & 0o022):
+        raise PermissionError(
+            errno.EACCES, 'Not a private directory of the user', path)
+    return path
+
+
+def write_file(path, text):
+    """
+    Write the text to the file unless it already has it, the file is
+        replaced atomically, so readers never see a partial file
+    :param str path: file path
+    :param str text: content
+    :rtype: bool
+    :return: true if the file is written
+    """
+    try:
+        with open(path, encoding='utf-8', newline='') as current:
+            if current.read() == text:
+                return False
+    except (OSError, ValueError):
+        pass
+    fd, tmp_path = tempfile.mkstemp(
+        dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as new:
+            new.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+class LibraryCache(object):
+    """
+    Process-wide cache of JS library sources shared by backend instances.
+    Files are cached by path, mtime and size with LRU eviction, inline
+    code is written to disk once per content hash (into a private
+    temporary directory of the process, removed at exit).
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None):
+        """
+        :param int max_bytes: (optional) max total size of cached sources
+        :param str cache_dir: (optional) directory for inline libraries
+            shared by processes of the user, it must be owned by the user
+            and not writable by others, default is a temporary directory
+            of the process
+        """
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.lib_dir = None  # checked or created on the first use
+        self.sources = OrderedDict()  # (path, mtime, size): source
+        self.size = 0
+        self.paths = {}  # name and code: path of materialized library
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def read(self, path):
+        """
+        Return source of the file, read it only if it is not cached
+            or was modified
+        :param str path: file path
+        :rtype: str
+        :raise OSError: the file can not be read
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            source = self.sources.get(key)
+            if source is not None:
+                self.sources.move_to_end(key)
+                self.hits += 1
+                return source
+
+        with open(path) as lib_file:
+            source = lib_file.read()
+        with self.lock:
+            self.misses += 1
+            if key not in self.sources:
+                self.sources[key] = source
+                self.size += len(source)
+                self._evict()
+        return source
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self.sources) > 1:
+            _, source = self.sources.popitem(last=False)
+            self.size -= len(source)
+
+    def materialize(self, name, code):
+        """
+        Return path of a file with the inline library code, identical
+            code is written only once and shared by all instances
+        :param str name: library name (ex: library.js)
+        :param str code: library source code
+        :rtype: str
+        :raise OSError: `cache_dir` is not a private directory of the user
+        """
+        # str objects cache their hash, so the lookup is cheap
+        key = (name, code)
+        path = self.paths.get(key)
+        if path is not None and os.path.isfile(path):
+            return path
+
+        with self.lock:
+            if self.lib_dir is None:
+                self.lib_dir = private_dir(self.cache_dir, 'runjs-libs-')
+        lib_dir = os.path.join(self.lib_dir, self.digest(code))
+        path = os.path.join(lib_dir, os.path.basename(name) or 'lib.js')
+        os.makedirs(lib_dir, mode=0o700, exist_ok=True)
+        # A file of other process is used only if it has the code
+        if write_file(path, code):
+            self.logger.debug('Materialized JS library: %s', path)
+        with self.lock:
+            self.paths[key] = path
+        return path
+
+    @staticmethod
+    def digest(code):
+        """
+        Return content hash of the code
+        :rtype: str
+        """
+        return hashlib.sha1(code.encode('utf-8')).hexdigest()
+
+    def clear(self):
+        """ Forget all cached sources """
+        with self.lock:
+            self.sources.clear()
+            self.paths.clear()
+            self.size = 0
+
+
+library_cache = LibraryCache()
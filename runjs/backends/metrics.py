@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+import bisect
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+
+__all__ = ['CallMetrics', 'MetricsSink', 'CallbackSink', 'Histogram',
+           'HistogramSink', 'set_metrics_sink', 'get_metrics_sink',
+           'call_metrics', 'recycle_metrics', 'NULL_CALL_METRICS',
+           'PHASES', ]
+
+# Phases of `run()`, not every backend has all of them:
+#   libs    - reading and loading the libraries and JS code
+#   globals - serializing and setting the global variables
+#   compile - precompiling and compiling (PyV8)
+#   args    - converting the function arguments
+#   execute - running the function (or the whole script)
+#   result  - converting the result back to Python
+PHASES = ('libs', 'globals', 'compile', 'args', 'execute', 'result')
+
+logger = logging.getLogger(__name__)
+
+_sink = None  # default sink of the backends without own `metrics`
+
+
+class CallMetrics(object):
+    """
+    Phase timings and byte sizes of one `run()` call, passed to the sink
+    when the call is finished
+    """
+    enabled = True
+    __slots__ = ('sink', 'backend', 'func', 'phases', 'args_bytes',
+                 'result_bytes', 'error', 'duration', '_started', '_last')
+
+    def __init__(self, sink, backend, func):
+        """
+        :param MetricsSink sink: receiver of the metrics
+        :param str backend: backend name
+        :param str func: JS function name or `None`
+        """
+        self.sink = sink
+        self.backend = backend
+        self.func = func
+        self.phases = OrderedDict()  # phase: seconds
+        self.args_bytes = None
+        self.result_bytes = None
+        self.error = None
+        self.duration = None
+
+    def __enter__(self):
+        self._started = self._last = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self._started
+        self.error = exc
+        try:
+            self.sink.observe(self)
+        except Exception:
+            logger.exception('Metrics sink failed')
+
+    def mark(self, phase):
+        """
+        Add the time since the previous mark (or the call start) to
+            the phase
+        :param str phase: phase name
+        """
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0.0) + now - self._last
+        self._last = now
+
+    def as_dict(self):
+        """
+        Return the metrics as dict
+        :rtype: OrderedDict
+        """
+        return OrderedDict((
+            ('backend', self.backend),
+            ('func', self.func),
+            ('duration', self.duration),
+            ('phases', OrderedDict(self.phases)),
+            ('args_bytes', self.args_bytes),
+            ('result_bytes', self.result_bytes),
+            ('error', None if self.error is None else repr(self.error)),
+        ))
+
+
+class _NullCallMetrics(object):
+    """ Metrics of a call when no sink is set, records nothing """
+    enabled = False
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+    def mark(self, phase):
+        pass
+
+
+NULL_CALL_METRICS = _NullCallMetrics()
+
+
+class MetricsSink(object):
+    """ Receiver of the call metrics """
+
+    def observe(self, call):
+        """
+        Receive metrics of the finished call
+        :param CallMetrics call: metrics of the call
+        """
+        raise NotImplementedError('Subclasses must override `observe()`')
+
+    def observe_recycle(self, backend, reason):
+        """
+        Receive recycling of a long-lived engine (see `recycle.py`)
+        :param str backend: backend name
+        :param str reason: 'calls', 'memory' or 'idle'
+        """
+
+
+class CallbackSink(MetricsSink):
+    """ Pass metrics of every call to the callback """
+
+    def __init__(self, callback):
+        """
+        :param callable callback: called with `CallMetrics`
+        """
+        self.callback = callback
+
+    def observe(self, call):
+        self.callback(call)
+
+
+class Histogram(object):
+    """ Histogram with fixed bucket upper bounds """
+
+    def __init__(self, buckets):
+        """
+        :param list buckets: sorted upper bounds of the buckets
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # the last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        Return list of (upper bound, number of values <= bound),
+            the last bound is `float('inf')`
+        """
+        result = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return OrderedDict((
+            ('count', self.count),
+            ('sum', self.sum),
+            ('buckets', OrderedDict(
+                (str(bound), count) for bound, count in self.cumulative())),
+        ))
+
+
+class HistogramSink(MetricsSink):
+    """
+    In-memory aggregator of the call metrics: histograms of phase and
+    call durations and of argument and result sizes per backend
+    """
+    time_buckets = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1,
+                    0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+    size_buckets = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576,
+                    4194304, 16777216)
+
+    def __init__(self, time_buckets=None, size_buckets=None):
+        """
+        :param list time_buckets: (optional) upper bounds in seconds
+        :param list size_buckets: (optional) upper bounds in bytes
+        """
+        if time_buckets is not None:
+            self.time_buckets = tuple(time_buckets)
+        if size_buckets is not None:
+            self.size_buckets = tuple(size_buckets)
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """ Forget all observed metrics """
+        with self.lock:
+            self.calls = OrderedDict()  # (backend, status): count
+            self.durations = OrderedDict()  # backend: Histogram
+            self.phases = OrderedDict()  # (backend, phase): Histogram
+            self.sizes = OrderedDict()  # (backend, direction): Histogram
+            self.recycles = OrderedDict()  # (backend, reason): count
+
+    def observe(self, call):
+        status = 'ok' if call.error is None else 'error'
+        with self.lock:
+            key = (call.backend, status)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self._histogram(
+                self.durations, call.backend,
+                self.time_buckets).observe(call.duration)
+            for phase, seconds in call.phases.items():
+                self._histogram(
+                    self.phases, (call.backend, phase),
+                    self.time_buckets).observe(seconds)
+            for direction, size in (('args', call.args_bytes),
+                                    ('result', call.result_bytes)):
+                if size is not None:
+                    self._histogram(
+                        self.sizes, (call.backend, direction),
+                        self.size_buckets).observe(size)
+
+    def observe_recycle(self, backend, reason):
+        with self.lock:
+            key = (backend, reason)
+            self.recycles[key] = self.recycles.get(key, 0) + 1
+
+    @staticmethod
+    def _histogram(histograms, key, buckets):
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(buckets)
+        return histogram
+
+    def snapshot(self):
+        """
+        Return the aggregated metrics as dict
+        :rtype: OrderedDict
+        """
+        with self.lock:
+            return OrderedDict((
+                ('calls', [
+                    OrderedDict((('backend', backend), ('status', status),
+                                 ('count', count)))
+                    for (backend, status), count in self.calls.items()]),
+                ('durations', OrderedDict(
+                    (backend, histogram.as_dict())
+                    for backend, histogram in self.durations.items())),
+                ('phases', [
+                    OrderedDict((('backend', backend), ('phase', phase)),
+                                **histogram.as_dict())
+                    for (backend, phase), histogram in self.phases.items()]),
+                ('sizes', [
+                    OrderedDict((('backend', backend),
+                                 ('direction', direction)),
+                                **histogram.as_dict())
+                    for (backend, direction), histogram
+                    in self.sizes.items()]),
+                ('recycles', [
+                    OrderedDict((('backend', backend), ('reason', reason),
+                                 ('count', count)))
+                    for (backend, reason), count in self.recycles.items()]),
+            ))
+
+    def to_prometheus(self, prefix='runjs'):
+        """
+        Return the aggregated metrics in Prometheus text exposition format
+        :param str prefix: (optional) prefix of the metric names
+        :rtype: str
+        """
+        lines = []
+        with self.lock:
+            name = prefix + '_calls_total'
+            lines.append('# HELP %s Number of run() calls' % name)
+            lines.append('# TYPE %s counter' % name)
+            for (backend, status), count in self.calls.items():
+                lines.append('%s{backend="%s",status="%s"} %d' % (
+                    name, _label(backend), status, count))
+
+            self._prometheus_histograms(
+                lines, prefix + '_call_seconds', 'Duration of run() calls',
+                [({'backend': backend}, histogram)
+                 for backend, histogram in self.durations.items()])
+            self._prometheus_histograms(
+                lines, prefix + '_phase_seconds',
+                'Duration of the phases of run() calls',
+                [({'backend': backend, 'phase': phase}, histogram)
+                 for (backend, phase), histogram in self.phases.items()])
+            self._prometheus_histograms(
+                lines, prefix + '_payload_bytes',
+                'Size of the serialized arguments and results',
+                [({'backend': backend, 'direction': direction}, histogram)
+                 for (backend, direction), histogram in self.sizes.items()])
+
+            name = prefix + '_recycles_total'
+            lines.append(
+                '# HELP %s Number of recycled long-lived engines' % name)
+            lines.append('# TYPE %s counter' % name)
+            for (backend, reason), count in self.recycles.items():
+                lines.append('%s{backend="%s",reason="%s"} %d' % (
+                    name, _label(backend), reason, count))
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _prometheus_histograms(lines, name, help_text, histograms):
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s histogram' % name)
+        for labels, histogram in histograms:
+            labels_str = ','.join(
+                '%s="%s"' % (k, _label(v)) for k, v in labels.items())
+            for bound, count in histogram.cumulative():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append('%s_bucket{%s,le="%s"} %d' % (
+                    name, labels_str, le, count))
+            lines.append('%s_sum{%s} %r' % (name, labels_str, histogram.sum))
+            lines.append('%s_count{%s} %d' % (
+                name, labels_str, histogram.count))
+
+
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def set_metrics_sink(sink):
+    """
+    Set the default sink of the backends, `None` disables metrics
+    :param MetricsSink sink: sink or `None`
+    """
+    global _sink
+    _sink = sink
+
+
+def get_metrics_sink():
+    """
+    Return the default sink of the backends or `None`
+    """
+    return _sink
+
+
+def call_metrics(backend, func):
+    """
+    Return metrics of a new call of the backend, the returned object
+        records nothing if the backend has no sink
+    :param AbstractBackend backend: backend
+    :param str func: JS function name or `None`
+    """
+    sink = backend.metrics if backend.metrics is not None else _sink
+    if sink is None:
+        return NULL_CALL_METRICS
+    return CallMetrics(sink, type(backend).__name__, func)
+
+
+def recycle_metrics(sink, backend, reason):
+    """
+    Pass recycling of a long-lived engine to the sink (the default sink
+        if `sink` is `None`)
+    :param MetricsSink sink: sink of the backend or `None`
+    :param str backend: backend name
+    :param str reason: recycling reason
+    """
+    sink = sink if sink is not None else _sink
+    if sink is None:
+        return
+    try:
+        sink.observe_recycle(backend, reason)
+    except Exception:
+        logger.exception('Metrics sink failed')
@@ -1,84 +1,285 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import functools
+import itertools
 import json
 import logging
 import os
 import os.path
 import subprocess
+import tempfile
+import time
 
 from tempfile import NamedTemporaryFile
 
-from runjs.backends.exceptions import JSRuntimeException
-from .abstract import AbstractBackend
+from runjs.backends.exceptions import (
+    JSLoadError, JSRuntimeException, JSTimeoutError)
+from . import binary
+from .abstract import DATA_DIR, JS_HELPERS, AbstractBackend, _remaining
+from .libcache import library_cache
+from .metrics import NULL_CALL_METRICS
+from .nodejs_worker import (
+    AsyncNodeJSWorkerPool, NodeJSWorkerPool, tenant_worker_pool)
+from .shared_data import DataHandle
 
 logger = logging.getLogger(__name__)
 
 __all__ = ['NodeJSBackend', ]
 
+# Set by the one-shot script before the call, so an error of the call
+# changes the exit code of the uncaught exception (1), which then means
+# the libraries or the code can not be loaded
+CALL_EXIT_CODE = 4
+CALL_STARTED = (
+    "process.on('exit', function (code) {"
+    " if (code === 1) { process.exitCode = %d; } });\n" % CALL_EXIT_CODE)
+
 
 class NodeJSBackend(AbstractBackend):
     """ Backend class for Nodejs """
     logger = logging.getLogger(__name__)
     can_precompile = False
     can_run_str = False
+    bundle_modules = True
+    node_bin = 'nodejs'  # Node.js executable
+    tenant_owners = itertools.count(1)
+
+    def __init__(self, js_code='', js_libs=[], js_libs_code={}, workers=0,
+                 use_stdin=True, code_cache=False, shared_workers=0,
+                 max_contexts=100, memory_budget=None, **kwargs):
+        """
+        Create new Node.js wrapper
+        :param str js_code: (optional) JS code for run
+        :param list js_libs: (optional) paths to JS libraries code
+        :param dict js_libs_code: (optional) dict of JS libraries code
+        :param int workers: (optional) number of long-lived Node.js
+            processes serving function calls, `0` starts a new process
+            on every `run()` (one worker in persistent mode)
+        :param bool use_stdin: (optional) if true, then the script and
+            libraries are streamed to Node.js from memory, otherwise
+            the script is written to a temporary file and libraries are
+            included from files
+        :param bool|str code_cache: (optional) if true, then the libraries
+            (and `js_code` of the workers) are compiled with V8 code cache
+            kept in this directory (`True` is a per-user directory in
+            the temp directory), so new processes skip compiling them,
+            needs `use_stdin`
+        :param int shared_workers: (optional) number of long-lived
+            Node.js processes shared by all backends with the same
+            options, the code of every backend runs there in its own vm
+            context keyed by the hash of the code and the libraries
+            (replaces `workers`)
+        :param int max_contexts: (optional) contexts kept by a shared
+            worker, least recently used are evicted
+        :param int memory_budget: (optional) megabytes of JS heap of
+            a shared worker, least recently used contexts are evicted
+            above it
+        """
+        super().__init__(js_code, js_libs, js_libs_code, **kwargs)
+        self.use_stdin = use_stdin
+        self.code_cache_dir = None
+        if code_cache and use_stdin:
+            self.code_cache_dir = code_cache if isinstance(
+                code_cache, str) else os.path.join(
+                    tempfile.gettempdir(), 'runjs-code-cache-%s' % os.getuid())
+        self.shared_workers = shared_workers
+        self.max_contexts = max_contexts
+        self.memory_budget = memory_budget
+        self.tenant_owner = next(self.tenant_owners)
+        self.tenant_generation = 0  # a new context after reset()
+        self.workers = 0 if shared_workers else (
+            workers or (1 if self.persistent else 0))
+        self.worker_pool = None
+        self.async_worker_pool = None
+        self.async_worker_loop = None
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+    def reset(self):
+        """
+        Restart the long-lived Node.js processes on the next call
+            (start a new context in the shared workers)
+        """
+        super().reset()
+        self.close()
+        self.tenant_generation += 1
+
+    def close(self):
+        """
+        Stop the long-lived Node.js processes, the shared workers are
+            kept for other backends
+        """
+        if getattr(self, 'worker_pool', None) is not None:
+            if not self.shared_workers:
+                self.worker_pool.close()
+            self.worker_pool = None
+        if getattr(self, 'async_worker_pool', None) is not None:
+            self.async_worker_pool.kill()
+            self.async_worker_pool = None
+
+    async def aclose(self):
+        """
+        Stop the long-lived Node.js processes used by `arun()`
+        """
+        if self.async_worker_pool is not None:
+            pool, self.async_worker_pool = self.async_worker_pool, None
+            await pool.close()
 
-    def run(self, func=None, fargs=[]):
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
         """
         Run JS code with libraries and return result as
             Python unicode string or as dict
 
         :param str func: (optional) JS function name
         :param list fargs: (optional) list of JS function args
+        :param bool cache: (optional) if true, then the result is
+            memoized in the result cache (see `cache_function()`)
+        :param float timeout: (optional) deadline of the call in seconds,
+            the Node.js process (or worker) is killed when it passes
 
         :raise SyntaxError: JS syntax error or runtime error
+        :raise JSTimeoutError: the deadline has passed
         """
-        cdir = os.path.abspath(os.path.dirname(__file__) + '/../data')
-        include_lib = cdir + '/include.js'
+        run = functools.partial(
+            self._run_uncached, timeout=self._call_timeout(timeout))
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(func, fargs, run)
+        return run(func, fargs)
 
-        script_code = ''
-        if os.path.isfile(include_lib) and os.access(include_lib, os.R_OK):
-            script_code = open(include_lib).read()
-        else:
+    def _run_uncached(self, func=None, fargs=[], timeout=None):
+        with self._call_metrics(func) as metrics:
+            if (self.workers or self.shared_workers) and func is not None:
+                return self._run_worker(func, fargs, metrics, timeout)
+
+            script_code = self._call_script(func, fargs, metrics)
+            output = self._run_script(script_code, timeout)
+            metrics.mark('execute')
+            return self._script_result(output, metrics)
+
+    def _call_script(self, func, fargs, metrics=NULL_CALL_METRICS):
+        """
+        Return script code of the one-shot JS function call
+        :param CallMetrics metrics: (optional) metrics of the call
+        """
+        script_code = self._get_script_code(metrics)
+
+        # Convert to JS objects and create arguments string
+        fargs_str = ''
+        fargs_len = len(fargs)
+        for i in range(fargs_len):
+            fargs_str += self._get_js_obj(fargs[i])
+            if i < fargs_len - 1:
+                fargs_str += ', '
+
+        if func is not None:
+            func_call = CALL_STARTED + 'var __func_call_res = %s(%s);\n'
+            func_call += (
+                'process.stdout.write('
+                '__runjs_result_json(__func_call_res));\n')
+            script_code += func_call % (func, fargs_str)
+        metrics.mark('args')
+        if metrics.enabled:
+            metrics.args_bytes = len(fargs_str)
+        return script_code
+
+    def _script_result(self, output, metrics=NULL_CALL_METRICS):
+        """
+        Return result of the one-shot call from the output of the script
+        :param CallMetrics metrics: (optional) metrics of the call
+        """
+        result = self._get_py_obj(output)
+        metrics.mark('result')
+        if metrics.enabled:
+            metrics.result_bytes = len(output)
+        return result
+
+    def _get_script_code(self, metrics=NULL_CALL_METRICS):
+        """
+        Return script code which loads the libraries, sets global
+            variables and runs the main JS code
+        :param CallMetrics metrics: (optional) metrics of the call
+        """
+        include_lib = DATA_DIR + '/include.js'
+
+        try:
+            script_code = library_cache.read(include_lib)
+        except OSError:
             err = 'Can not read: "%s" file' % include_lib
             self.logger.error(err)
             raise RuntimeError(err)
+        script_code += '\n' + JS_HELPERS + '\n'
 
         for js_lib in self.js_libs:
             js_lib = os.path.abspath(js_lib)
+            if self.use_stdin:
+                # Libraries are passed from memory with the script
+                try:
+                    lib_code = library_cache.read(js_lib)
+                except OSError:
+                    err = 'Can not read: "%s" file' % js_lib
+                    self.logger.error(err)
+                    raise RuntimeError(err)
+                if self.code_cache_dir is not None:
+                    script_code += 'include_cached(%s, %s, %s, %s);\n' % (
+                        json.dumps(js_lib), json.dumps(lib_code),
+                        json.dumps(self.code_cache_dir),
+                        json.dumps(self._lib_digest(js_lib)))
+                    continue
+                script_code += 'include_source(%s, %s);\n' % (
+                    json.dumps(js_lib), json.dumps(lib_code))
+                continue
             lib_exists = os.path.isfile(js_lib) and os.access(js_lib, os.R_OK)
             if not lib_exists:
                 err = 'Can not read: "%s" file' % js_lib
                 self.logger.error(err)
                 raise RuntimeError(err)
             script_code += "include('%s');\n" % js_lib
+        metrics.mark('libs')
 
         # Global vars
         if self.js_global_vars:
             script_code += '\n\n// ==== Global JS variables\n'
             for k, v in self.js_global_vars.items():
-                script_code += 'var %s = %s;\n' % (k, self._get_js_obj(v))
+                if isinstance(v, DataHandle):
+                    # Registered data is parsed from its file
+                    script_code += 'var %s = __runjs_load_data(%s);\n' % (
+                        k, json.dumps(v.path))
+                    continue
+                script_code += 'var %s = %s;\n' % (
+                    k, binary.js_value(self.get_global_var_json(k)))
+        metrics.mark('globals')
 
         # Main script code
         script_code += '\n\n// ==== MAIN JS code\n'
         script_code += self.js_code
         script_code += '\n'
+        return script_code
 
-        # Convert to JS objects and create arguments string
-        fargs_str = ''
-        fargs_len = len(fargs)
-        for i in range(fargs_len):
-            fargs_str += self._get_js_obj(fargs[i])
-            if i < fargs_len - 1:
-                fargs_str += ', '
-
-        if func is not None:
-            func_call = 'var __func_call_res = %s(%s);\n'
-            func_call += (
-                'process.stdout.write(JSON.stringify(__func_call_res));\n')
-            script_code += func_call % (func, fargs_str)
-
+    def _run_script(self, script_code, timeout=None):
+        """
+        Run script code in new Node.js process and return its output
+        :param float timeout: (optional) seconds before the process
+            is killed
+        :raise JSTimeoutError: the process is killed by the timeout
+        """
         logger.debug('JS source code:')
         logger.debug(script_code)
 
+        if self.use_stdin:
+            # Stream script code to Node.js, no file is written
+            try:
+                return subprocess.run(
+                    [self.node_bin, '-'], input=script_code.encode(),
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                    check=True, timeout=timeout).stdout
+            except subprocess.CalledProcessError as e:
+                raise self._script_error(e.returncode, e.output) from e
+            except subprocess.TimeoutExpired as e:
+                raise JSTimeoutError(
+                    'The JS call timed out after %ss' % timeout) from e
+
         # Write script code to file
         script_code_file = NamedTemporaryFile(delete=False, suffix='-main.js')
         script_code_file.write(script_code.encode())
@@ -88,22 +289,251 @@ class NodeJSBackend(AbstractBackend):
         result = None
         try:
             result = subprocess.check_output(
-                ['nodejs', script_code_file.name], stderr=subprocess.STDOUT)
+                [self.node_bin, script_code_file.name], stderr=subprocess.STDOUT,
+                timeout=timeout)
         except subprocess.CalledProcessError as e:
-            raise JSRuntimeException('JavaScript error', str(e.output.decode())) from e
+            raise self._script_error(e.returncode, e.output) from e
+        except subprocess.TimeoutExpired as e:
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from e
         finally:
             os.unlink(script_code_file.name)
-        return self._get_py_obj(result)
+        return result
+
+    async def _arun_script(self, script_code, timeout=None):
+        """
+        Awaitable version of `_run_script()`, the Node.js process is
+            killed when the call is cancelled
+        :raise JSTimeoutError: the process is killed by the timeout
+        """
+        logger.debug('JS source code:')
+        logger.debug(script_code)
+
+        script_code_file = None
+        if self.use_stdin:
+            args = [self.node_bin, '-']
+            script_input = script_code.encode()
+        else:
+            script_code_file = NamedTemporaryFile(
+                delete=False, suffix='-main.js')
+            script_code_file.write(script_code.encode())
+            script_code_file.close()
+            args = [self.node_bin, script_code_file.name]
+            script_input = None
+        try:
+            process = await asyncio.create_subprocess_exec(
+                *args, stdin=subprocess.PIPE if self.use_stdin else
+                subprocess.DEVNULL, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT)
+            try:
+                output, _ = await asyncio.wait_for(
+                    process.communicate(script_input), timeout)
+            except asyncio.TimeoutError as e:
+                raise JSTimeoutError(
+                    'The JS call timed out after %ss' % timeout) from e
+            finally:
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+        finally:
+            if script_code_file is not None:
+                os.unlink(script_code_file.name)
+        if process.returncode:
+            raise self._script_error(process.returncode, output)
+        return output
+
+    def _script_error(self, returncode, output):
+        """
+        Return exception of the failed one-shot script
+        :param int returncode: exit code of the Node.js process
+        :param bytes output: output of the process
+        :rtype: JSRuntimeException
+        """
+        cls = JSLoadError if returncode == 1 else JSRuntimeException
+        return cls('JavaScript error', str(output.decode()))
+
+    def _chunk_script(self, func, chunk_json):
+        """
+        Return script code of the one-shot batch call
+        :param list chunk_json: lists of JS function args as JS objects
+        """
+        script_code = self._get_script_code()
+        script_code += '\n\n// ==== Batch call\n' + CALL_STARTED
+        # Functions of the main code are not global in a Node.js module
+        script_code += 'process.stdout.write(__runjs_batch(%s, [%s], %s));\n' % (
+            func, ', '.join(
+                '[%s]' % ', '.join(fargs_json) for fargs_json in chunk_json),
+            func.rpartition('.')[0] or 'undefined')
+        return script_code
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Call JS function for every list of arguments of the chunk
+            in one Node.js process (or request to a worker)
+        """
+        if self.workers or self.shared_workers:
+            chunk_json = [[self._get_worker_arg(arg) for arg in fargs]
+                          for fargs in chunk]
+            items = self._get_worker_pool().call_many(
+                func, chunk_json, self, timeout)
+            return self._batch_results(items)
+
+        chunk_json = [[self._get_js_obj(arg) for arg in fargs]
+                      for fargs in chunk]
+        return self._batch_results(binary.loads(
+            self._run_script(self._chunk_script(func, chunk_json), timeout)))
+
+    def _run_worker(self, func, fargs, metrics=NULL_CALL_METRICS,
+                    timeout=None):
+        """
+        Call JS function in one of the long-lived Node.js processes,
+            the worker is killed (and restarted by the next call) when
+            the call does not finish in `timeout` seconds
+        """
+        fargs_json = [self._get_worker_arg(arg) for arg in fargs]
+        metrics.mark('args')
+        if metrics.enabled:
+            metrics.args_bytes = sum(map(len, fargs_json))
+        # Changes of the global variables are sent with the request
+        result = self._get_worker_pool().call(
+            func, fargs_json, self, timeout)
+        metrics.mark('execute')
+        return result
+
+    def _get_worker_pool(self):
+        if self.worker_pool is None and self.shared_workers:
+            self.worker_pool = tenant_worker_pool(
+                self.shared_workers, self.node_bin, self.max_contexts,
+                self.memory_budget and int(self.memory_budget * 2 ** 20),
+                self.recycle, type(self).__name__, self.metrics)
+        elif self.worker_pool is None:
+            self.worker_pool = NodeJSWorkerPool(
+                self.workers, self.node_bin, self.js_libs, self.js_code,
+                self.use_stdin, self.code_cache_dir, self.recycle,
+                type(self).__name__, self.metrics)
+        return self.worker_pool
+
+    def tenant_context(self):
+        """
+        Return key of the vm context of the code in the shared workers and
+            the owner of the global variables of the context
+        :rtype: tuple
+        """
+        return ('%s-%d' % (self._code_digest(), self.tenant_generation),
+                self.tenant_owner)
+
+    async def arun(self, func=None, fargs=[], timeout=None):
+        """
+        Awaitable version of `run()`, function calls are multiplexed over
+            the pipes of the long-lived Node.js processes of `workers`,
+            without them every call runs in a new Node.js process as
+            by `run()`
+
+        :param str func: (optional) JS function name
+        :param list fargs: (optional) list of JS function args
+        :param float timeout: (optional) seconds to wait for the result,
+            the worker is killed when they pass, failing the other calls
+            in flight in it (the shared workers are called from threads)
+
+        :raise JSTimeoutError: the result is not ready in time
+        """
+        timeout = self._call_timeout(timeout)
+        if func is None or self.shared_workers:
+            return await super().arun(func, fargs, timeout)
+        if not self.workers:
+            with self._call_metrics(func) as metrics:
+                script_code = self._call_script(func, fargs, metrics)
+                output = await self._arun_script(script_code, timeout)
+                metrics.mark('execute')
+                return self._script_result(output, metrics)
+        return await self._get_async_worker_pool().call(
+            func, [self._get_worker_arg(arg) for arg in fargs], self,
+            timeout)
+
+    async def arun_many(self, func, fargs_iter, chunk_size=100,
+                        timeout=None):
+        """
+        Awaitable version of `run_many()`, chunks are sent to the workers
+            concurrently (without `workers` they run one by one in new
+            Node.js processes)
+
+        :param float timeout: (optional) seconds to wait for all results,
+            the workers of the unfinished chunks are killed when they pass
+
+        :raise JSTimeoutError: the results are not ready in time
+        """
+        if self.shared_workers:
+            return await super().arun_many(
+                func, fargs_iter, chunk_size, timeout)
+        get_arg = self._get_worker_arg if self.workers else self._get_js_obj
+        chunks = []
+        chunk = []
+        for fargs in fargs_iter:
+            chunk.append([get_arg(arg) for arg in fargs])
+            if len(chunk) == chunk_size:
+                chunks.append(chunk)
+                chunk = []
+        if chunk:
+            chunks.append(chunk)
+
+        results = []
+        if not self.workers:
+            end = None if timeout is None else time.monotonic() + timeout
+            for chunk_json in chunks:
+                output = await self._arun_script(
+                    self._chunk_script(func, chunk_json), _remaining(end))
+                results.extend(self._batch_results(binary.loads(output)))
+            return results
+
+        # Every chunk is sent at once, so each of them has the deadline
+        pool = self._get_async_worker_pool()
+        items = await asyncio.gather(*[
+            pool.call_many(func, chunk_json, self, timeout)
+            for chunk_json in chunks], return_exceptions=True)
+        errors = [item for item in items if isinstance(item, BaseException)]
+        if errors:
+            # The chunks in flight in a killed worker fail as it dies
+            raise next((err for err in errors
+                        if isinstance(err, JSTimeoutError)), errors[0])
+        for chunk_items in items:
+            results.extend(self._batch_results(chunk_items))
+        return results
+
+    def _get_async_worker_pool(self):
+        loop = asyncio.get_running_loop()
+        if self.async_worker_pool is None or self.async_worker_loop is not loop:
+            if self.async_worker_pool is not None:
+                self.async_worker_pool.kill()
+            self.async_worker_pool = AsyncNodeJSWorkerPool(
+                self.workers, self.node_bin, self.js_libs, self.js_code,
+                self.use_stdin, self.code_cache_dir, self.recycle,
+                type(self).__name__, self.metrics)
+            self.async_worker_loop = loop
+        return self.async_worker_pool
 
     def _get_js_obj(self, obj):
+        if binary.is_binary(obj):
+            return binary.js_expression(obj)
         if hasattr(obj, '__dict__'):
             obj = dict(obj)
         return json.dumps(obj)
 
+    def _get_worker_arg(self, obj):
+        """
+        Return argument for a worker: JSON or binary object, which is
+            sent as is in the request frame
+        """
+        if binary.is_binary(obj):
+            return obj
+        if hasattr(obj, '__dict__'):
+            obj = dict(obj)
+        # Parsed by the worker, so objects taken for markers are escaped
+        return binary.dumps(obj)
+
     def _get_py_obj(self, obj):
         result = obj
         try:
-            result = json.loads(obj)
+            result = binary.loads(obj)
         except Exception:
             pass
         return result
@@ -0,0 +1,893 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import atexit
+import collections
+import json
+import logging
+import os
+import os.path
+import subprocess
+import threading
+import time
+import weakref
+
+from . import binary
+from .abstract import DATA_DIR, deadline
+from .exceptions import JSLoadError, JSRuntimeException, JSTimeoutError
+from .libcache import library_cache
+from .recycle import RecyclingPool
+
+__all__ = ['NodeJSWorker', 'NodeJSWorkerPool', 'AsyncNodeJSWorker',
+           'AsyncNodeJSWorkerPool', 'TenantNodeJSWorker',
+           'TenantNodeJSWorkerPool', 'tenant_worker_pool', ]
+
+
+def worker_code(js_libs, js_code, use_sources=True, cache_dir=None):
+    """
+    Libraries and code of the configuration (or of a context) of
+        `data/worker.js`
+    :param list js_libs: paths to JS libraries
+    :param str js_code: main JS code
+    :param bool use_sources: (optional) if true, then pass sources of
+        the libraries instead of paths
+    :param str cache_dir: (optional) directory of V8 code cache of the
+        library sources and the code
+    :rtype: dict
+    """
+    libs = []
+    for lib in js_libs:
+        lib = os.path.abspath(lib)
+        if use_sources:
+            source = library_cache.read(lib)
+            libs.append({'name': lib, 'source': source})
+            if cache_dir is not None:
+                libs[-1]['digest'] = library_cache.digest(source)
+        else:
+            libs.append({'name': lib})
+    config = {'libs': libs, 'code': js_code}
+    if cache_dir is not None and use_sources:
+        config['cacheDir'] = cache_dir
+        config['codeDigest'] = library_cache.digest(js_code)
+    return config
+
+
+def worker_config(js_libs, js_code, use_sources=True, cache_dir=None,
+                  globals_json=None):
+    """
+    Configuration frame for `data/worker.js` (see `worker_code()`)
+    :param dict globals_json: (optional) global variables serialized
+        to JSON, they are set before the libraries and the code are run
+    """
+    config = worker_code(js_libs, js_code, use_sources, cache_dir)
+    config['include'] = DATA_DIR + '/include.js'
+    if globals_json:
+        config['globals'] = format_globals(globals_json)
+    return binary.encode_frame(json.dumps(config).encode())
+
+
+def format_globals(globals_json):
+    """
+    Return JSON object of the global variables serialized to JSON
+    :param dict globals_json: variable name: JSON
+    :rtype: str
+    """
+    return '{%s}' % ', '.join(
+        '%s: %s' % (json.dumps(k), v) for k, v in globals_json.items())
+
+
+def _initial_globals(backend_ref):
+    """
+    Return version and global variables (serialized to JSON) of
+        the backend to set in a new worker before its code is run
+    :param weakref.ref backend_ref: weak reference to the backend or `None`
+    :rtype: tuple
+    """
+    backend = backend_ref() if backend_ref is not None else None
+    if backend is None:
+        return 0, {}
+    version, globals_json, _ = backend.global_vars_delta(0, data_refs=True)
+    return version, globals_json
+
+
+def format_args(fargs_json, buffers):
+    """
+    Return JSON array of the args, binary args are appended to `buffers`
+    :param list fargs_json: args serialized to JSON or binary objects
+    :param list buffers: buffers of the frame
+    """
+    parts = []
+    for arg in fargs_json:
+        if not isinstance(arg, str):
+            buffers.append(binary.byte_view(arg))
+            arg = binary.marker_json(arg, len(buffers) - 1)
+        parts.append(arg)
+    return '[%s]' % ', '.join(parts)
+
+
+def format_call(fargs_json, buffers):
+    """ Request payload of a single call """
+    return '"args": %s' % format_args(fargs_json, buffers)
+
+
+def format_batch(chunk_json, buffers):
+    """ Request payload of a batch call """
+    return '"batch": [%s]' % ', '.join(
+        format_args(fargs_json, buffers) for fargs_json in chunk_json)
+
+
+def format_request(request_id, func, payload, globals_json, deleted,
+                   buffers=(), context=None, replace=False):
+    """
+    Return request frame for `data/worker.js`
+    :param int request_id: request id
+    :param str func: JS function name
+    :param str payload: `format_call()` or `format_batch()` result
+    :param dict globals_json: changed global variables serialized to JSON
+    :param list deleted: names of deleted global variables
+    :param list buffers: (optional) binary args
+    :param str context: (optional) context key of a tenant worker
+    :param bool replace: (optional) the globals replace all globals of
+        the context
+    :rtype: list
+    :return: chunks of the frame
+    """
+    # The context key goes first, the worker reads it without parsing
+    prefix = '"context": %s, ' % json.dumps(context) if context else ''
+    if replace:
+        prefix += '"replace": true, '
+    return binary.encode_frame((
+        '{%s"id": %d, "func": %s, %s, "globals": %s, "deleted": %s}' % (
+            prefix, request_id, json.dumps(func), payload,
+            format_globals(globals_json), json.dumps(deleted))).encode(),
+        buffers)
+
+
+class _ContextMissing(Exception):
+    """ The context of the request is evicted by the tenant worker """
+
+
+def response_value(response, key='result'):
+    """
+    Return value of the worker response
+    :raise JSRuntimeException: JS error
+    """
+    if 'error' in response:
+        raise JSRuntimeException(
+            response['error']['message'], response['error']['stack'])
+    if response.get('missing'):
+        raise _ContextMissing()
+    return response.get(key)
+
+
+class NodeJSWorker(object):
+    """
+    Long-lived Node.js process which loads the libraries and the main
+    code once and then serves function calls over a pipe
+    (see `data/worker.js` for the protocol)
+    """
+    logger = logging.getLogger(__name__)
+    log_tail_lines = 50  # how many lines of worker output to keep
+    node_args = ()
+
+    def __init__(self, node_bin, js_libs, js_code, use_sources=True,
+                 cache_dir=None):
+        """
+        :param str node_bin: Node.js executable
+        :param list js_libs: paths to JS libraries
+        :param str js_code: main JS code
+        :param bool use_sources: (optional) pass sources of the libraries
+            from memory instead of paths
+        :param str cache_dir: (optional) directory of V8 code cache
+        """
+        self.node_bin = node_bin
+        self.js_libs = js_libs
+        self.js_code = js_code
+        self.use_sources = use_sources
+        self.cache_dir = cache_dir
+        self.process = None
+        self.responses = None
+        self.output = collections.deque(maxlen=self.log_tail_lines)
+        self.output_thread = None
+        self.last_id = 0
+        self.globals_version = 0  # global vars version seen by the worker
+        # Weak reference to the backend of the global variables set
+        # before the code is run by a new process
+        self.backend = None
+        self.killed = False  # the process is killed by a timeout
+        self.calls = 0  # calls served by the process
+        self.last_used = time.monotonic()
+        self.lock = threading.Lock()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    @property
+    def pid(self):
+        process = self.process
+        return process.pid if process is not None else None
+
+    def start(self):
+        """
+        Start Node.js process and load the JS code into it
+
+        :raise JSLoadError: the JS code can not be loaded
+        """
+        read_fd, write_fd = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [self.node_bin] + list(self.node_args) +
+                [DATA_DIR + '/worker.js', str(write_fd)],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, pass_fds=(write_fd, ))
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self.responses = os.fdopen(read_fd, 'rb')
+        self.output.clear()
+        self.output_thread = threading.Thread(
+            target=self._drain_output, args=(self.process, ), daemon=True)
+        self.output_thread.start()
+        self.logger.debug('Started Node.js worker pid=%s', self.process.pid)
+
+        self.last_id = 0
+        self.globals_version, globals_json = _initial_globals(self.backend)
+        self.killed = False
+        self.calls = 0
+        self._send(self._config(globals_json))
+        try:
+            self._receive(0)
+        except JSRuntimeException as err:
+            self.stop()
+            raise JSLoadError(err.msg, err.traceback) from err
+
+    def _config(self, globals_json):
+        return worker_config(
+            self.js_libs, self.js_code, self.use_sources, self.cache_dir,
+            globals_json)
+
+    def stop(self):
+        """ Stop Node.js process """
+        process, self.process = self.process, None
+        if process is None:
+            return
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
+        try:
+            process.wait(timeout=1)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if self.responses is not None:
+            self.responses.close()
+            self.responses = None
+
+    def kill(self):
+        """ Kill Node.js process running a call past its deadline """
+        process = self.process
+        if process is not None and process.poll() is None:
+            self.killed = True
+            self.logger.warning(
+                'Killing timed out Node.js worker pid=%s', process.pid)
+            process.kill()
+
+    def call(self, func, fargs_json, backend, timeout=None):
+        """
+        Call JS function in the worker and return its result
+
+        :param str func: JS function name
+        :param list fargs_json: function args serialized to JSON or
+            binary objects (sent as typed arrays)
+        :param AbstractBackend backend: owner of the global variables,
+            only their changes since the previous call are sent
+        :param float timeout: (optional) seconds before the worker is
+            killed, it is restarted by the next call
+        :raise JSRuntimeException: JS error or the worker has died
+        :raise JSTimeoutError: the worker is killed by the timeout
+        """
+        buffers = []
+        return self._request(
+            func, format_call(fargs_json, buffers), backend, buffers=buffers,
+            timeout=timeout)
+
+    def call_many(self, func, chunk_json, backend, timeout=None):
+        """
+        Call JS function in the worker for every list of arguments
+        and return list of {'result': ...} or {'error': ...} items
+
+        :param str func: JS function name
+        :param list chunk_json: lists of function args serialized to JSON
+            or binary objects
+        :param AbstractBackend backend: owner of the global variables
+        :param float timeout: (optional) seconds before the worker is
+            killed, it is restarted by the next call
+        :raise JSRuntimeException: the worker has died
+        :raise JSTimeoutError: the worker is killed by the timeout
+        """
+        buffers = []
+        return self._request(
+            func, format_batch(chunk_json, buffers), backend, 'results',
+            buffers, timeout)
+
+    def _request(self, func, payload, backend, key='result', buffers=(),
+                 timeout=None):
+        with self.lock:
+            if not self.alive:
+                self.backend = weakref.ref(backend)
+                self.start()
+            self.calls += 1
+            self.last_used = time.monotonic()
+            self.last_id += 1
+            self.globals_version, globals_json, deleted = (
+                backend.global_vars_delta(
+                    self.globals_version, data_refs=True))
+            with deadline(timeout, self.kill):
+                self._send(format_request(
+                    self.last_id, func, payload, globals_json, deleted,
+                    buffers))
+                return self._receive(self.last_id, key)
+
+    def _send(self, frame):
+        try:
+            for chunk in frame:
+                self.process.stdin.write(chunk)
+            self.process.stdin.flush()
+        except (OSError, ValueError):
+            self._died()
+
+    def _receive(self, request_id, key='result'):
+        message, buffers = binary.read_frame(self.responses)
+        if message is None:
+            self._died()
+        response = binary.loads(message, buffers)
+        if response.get('id') != request_id:
+            self.stop()
+            raise JSRuntimeException(
+                'Node.js worker protocol error',
+                'Expected response id %s, got %s' % (
+                    request_id, response.get('id')))
+        return response_value(response, key)
+
+    def _died(self):
+        process = self.process
+        self.stop()
+        if self.output_thread is not None:
+            self.output_thread.join(timeout=1)
+        returncode = process.returncode if process is not None else None
+        if not self.killed:
+            self.logger.error(
+                'Node.js worker died (exit code %s)', returncode)
+        raise JSRuntimeException(
+            'Node.js worker died (exit code %s)' % returncode,
+            ''.join(self.output))
+
+    def _drain_output(self, process):
+        for line in iter(process.stdout.readline, b''):
+            self.output.append(line.decode(errors='replace'))
+        process.stdout.close()
+
+
+class NodeJSWorkerPool(RecyclingPool):
+    """
+    Fixed size pool of `NodeJSWorker` processes, recycled by the policy
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, size, node_bin, js_libs, js_code, use_sources=True,
+                 cache_dir=None, policy=None, name=None, sink=None):
+        """
+        :param int size: number of Node.js processes
+        :param str node_bin: Node.js executable
+        :param list js_libs: paths to JS libraries
+        :param str js_code: main JS code
+        :param bool use_sources: (optional) pass sources of the libraries
+            from memory instead of paths
+        :param str cache_dir: (optional) directory of V8 code cache
+        :param RecyclePolicy policy: (optional) recycling of the workers
+        :param str name: (optional) backend name of the metrics
+        :param MetricsSink sink: (optional) metrics sink of the backend
+        """
+        super().__init__([
+            NodeJSWorker(
+                node_bin, js_libs, js_code, use_sources, cache_dir)
+            for _ in range(size)], policy, name, sink)
+
+    @property
+    def workers(self):
+        return self.engines
+
+    def _new_engine(self, worker):
+        new = NodeJSWorker(
+            worker.node_bin, worker.js_libs, worker.js_code,
+            worker.use_sources, worker.cache_dir)
+        new.backend = worker.backend
+        return new
+
+    def call(self, func, fargs_json, backend, timeout=None):
+        """
+        Call JS function in the first idle worker, crashed and timed out
+        workers are restarted on the next call
+        """
+        worker = self._acquire(backend)
+        try:
+            return worker.call(func, fargs_json, backend, timeout)
+        finally:
+            self._release(worker)
+
+    def call_many(self, func, chunk_json, backend, timeout=None):
+        """
+        Call JS function for every list of arguments in the first
+        idle worker
+        """
+        worker = self._acquire(backend)
+        try:
+            return worker.call_many(func, chunk_json, backend, timeout)
+        finally:
+            self._release(worker)
+
+
+class TenantNodeJSWorker(NodeJSWorker):
+    """
+    Long-lived Node.js process hosting the code of many backends, each
+    in its own vm context keyed by the digest of the code and libraries
+    (see `data/worker.js`). A context is loaded on the first call of its
+    code and loaded again when the worker has evicted it.
+    """
+    node_args = ('--expose-gc', )  # the memory budget frees heap at once
+
+    def __init__(self, node_bin, max_contexts=100, memory_budget=None):
+        """
+        :param str node_bin: Node.js executable
+        :param int max_contexts: (optional) contexts kept by the worker
+        :param int memory_budget: (optional) bytes of JS heap, least
+            recently used contexts are evicted above it
+        """
+        super().__init__(node_bin, [], '')
+        self.max_contexts = max_contexts
+        self.memory_budget = memory_budget
+        self.contexts = {}  # context key: (owner, globals version)
+
+    def _config(self, globals_json):
+        # The globals are set by the contexts
+        return binary.encode_frame(json.dumps({
+            'include': DATA_DIR + '/include.js',
+            'tenants': {
+                'maxContexts': self.max_contexts,
+                'memoryBudget': self.memory_budget,
+            }}).encode())
+
+    def start(self):
+        self.contexts = {}
+        super().start()
+
+    def _load(self, key, backend):
+        """
+        Load the libraries and the code of the backend into a new context
+        :raise JSLoadError: the JS code can not be loaded
+        """
+        self.last_id += 1
+        version, globals_json, _ = backend.global_vars_delta(
+            0, data_refs=True)
+        message = worker_code(backend.js_libs, backend.js_code)
+        message.update(load=key, id=self.last_id,
+                       globals=format_globals(globals_json))
+        self._send(binary.encode_frame(json.dumps(message).encode()))
+        try:
+            self._receive(self.last_id)
+        except JSRuntimeException as err:
+            raise JSLoadError(err.msg, err.traceback) from err
+        self.contexts[key] = (backend.tenant_context()[1], version)
+
+    def _request(self, func, payload, backend, key='result', buffers=(),
+                 timeout=None):
+        context, owner = backend.tenant_context()
+        with self.lock:
+            if not self.alive:
+                self.start()
+            self.calls += 1
+            self.last_used = time.monotonic()
+            while True:
+                if context not in self.contexts:
+                    self._load(context, backend)
+                # Globals of other backends of the same code are replaced
+                last_owner, version = self.contexts[context]
+                replace = last_owner != owner
+                self.last_id += 1
+                version, globals_json, deleted = backend.global_vars_delta(
+                    0 if replace else version, data_refs=True)
+                self.contexts[context] = (owner, version)
+                try:
+                    with deadline(timeout, self.kill):
+                        self._send(format_request(
+                            self.last_id, func, payload, globals_json,
+                            deleted, buffers, context, replace))
+                        return self._receive(self.last_id, key)
+                except _ContextMissing:
+                    del self.contexts[context]
+
+
+class TenantNodeJSWorkerPool(NodeJSWorkerPool):
+    """
+    Pool of `TenantNodeJSWorker` processes shared by the backends of
+    many codes, a call goes to an idle worker which already has the
+    context of the code, else to the idle worker with the fewest contexts
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, size, node_bin, max_contexts=100, memory_budget=None,
+                 policy=None, name=None, sink=None):
+        """
+        :param int size: number of Node.js processes
+        :param str node_bin: Node.js executable
+        :param int max_contexts: (optional) contexts kept by a worker
+        :param int memory_budget: (optional) bytes of JS heap of a worker
+        :param RecyclePolicy policy: (optional) recycling of the workers
+        :param str name: (optional) backend name of the metrics
+        :param MetricsSink sink: (optional) metrics sink of the backend
+        """
+        RecyclingPool.__init__(self, [
+            TenantNodeJSWorker(node_bin, max_contexts, memory_budget)
+            for _ in range(size)], policy, name, sink)
+
+    def _new_engine(self, worker):
+        return TenantNodeJSWorker(
+            worker.node_bin, worker.max_contexts, worker.memory_budget)
+
+    def _pick(self, backend):
+        context = backend.tenant_context()[0]
+        worker = next(
+            (worker for worker in self.idle if context in worker.contexts),
+            None)
+        if worker is None:
+            worker = min(self.idle, key=lambda worker: len(worker.contexts))
+        return worker
+
+
+_tenant_pools = {}
+_tenant_pools_lock = threading.Lock()
+
+
+def tenant_worker_pool(size, node_bin, max_contexts=100, memory_budget=None,
+                       policy=None, name=None, sink=None):
+    """
+    Return the process-wide `TenantNodeJSWorkerPool` of the parameters,
+        it is shared by all backends with them (policies with equal
+        options are the same, the pool counts recycled workers in
+        the policy of the backend which has created it)
+    :rtype: TenantNodeJSWorkerPool
+    """
+    key = (size, node_bin, max_contexts, memory_budget,
+           policy.options() if policy is not None else None)
+    with _tenant_pools_lock:
+        pool = _tenant_pools.get(key)
+        if pool is None:
+            pool = _tenant_pools[key] = TenantNodeJSWorkerPool(
+                size, node_bin, max_contexts, memory_budget, policy, name,
+                sink)
+        return pool
+
+
+@atexit.register
+def close_tenant_worker_pools():
+    """ Stop the workers of the shared pools at exit """
+    with _tenant_pools_lock:
+        pools = list(_tenant_pools.values())
+        _tenant_pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+class AsyncNodeJSWorker(object):
+    """
+    asyncio version of `NodeJSWorker`, many requests may be in flight
+    at once, responses are matched to them by request id
+    """
+    logger = logging.getLogger(__name__)
+    log_tail_lines = 50  # how many lines of worker output to keep
+    stream_limit = 2 ** 30  # buffer limit of the output stream
+
+    def __init__(self, node_bin, js_libs, js_code, use_sources=True,
+                 cache_dir=None):
+        """
+        :param str node_bin: Node.js executable
+        :param list js_libs: paths to JS libraries
+        :param str js_code: main JS code
+        :param bool use_sources: (optional) pass sources of the libraries
+            from memory instead of paths
+        :param str cache_dir: (optional) directory of V8 code cache
+        """
+        self.node_bin = node_bin
+        self.js_libs = js_libs
+        self.js_code = js_code
+        self.use_sources = use_sources
+        self.cache_dir = cache_dir
+        self.process = None
+        self.pending = {}
+        self.output = collections.deque(maxlen=self.log_tail_lines)
+        self.last_id = 0
+        self.start_lock = None
+        self.globals_version = 0  # global vars version seen by the worker
+        self.backend = None  # see `NodeJSWorker.backend`
+        self.killed = False  # the process is killed by a timeout
+        self.calls = 0  # calls served by the process
+        self.last_used = time.monotonic()
+        self.tasks = []  # response and output readers
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.returncode is None
+
+    @property
+    def pid(self):
+        process = self.process
+        return process.pid if process is not None else None
+
+    async def start(self):
+        """
+        Start Node.js process and load the JS code into it
+
+        :raise JSLoadError: the JS code can not be loaded
+        """
+        loop = asyncio.get_running_loop()
+        read_fd, write_fd = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                self.node_bin, DATA_DIR + '/worker.js', str(write_fd),
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, pass_fds=(write_fd, ),
+                limit=self.stream_limit)
+        except Exception:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        self.logger.debug('Started Node.js worker pid=%s', process.pid)
+
+        responses = asyncio.StreamReader(limit=self.stream_limit)
+        await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(responses),
+            os.fdopen(read_fd, 'rb'))
+        self.output.clear()
+        self.last_id = 0
+        self.globals_version, globals_json = _initial_globals(self.backend)
+        self.killed = False
+        self.calls = 0
+        ready = self.pending[0] = loop.create_future()
+        self.tasks = [
+            loop.create_task(self._read_responses(process, responses)),
+            loop.create_task(self._drain_output(process))]
+        process.stdin.writelines(worker_config(
+            self.js_libs, self.js_code, self.use_sources, self.cache_dir,
+            globals_json))
+        # The worker is alive for the requests only when the configuration
+        # is written, the requests written later are queued behind it
+        self.process = process
+        try:
+            response_value(await ready)
+        except JSRuntimeException as err:
+            await self.stop()
+            raise JSLoadError(err.msg, err.traceback) from err
+
+    async def stop(self):
+        """ Stop Node.js process """
+        process, self.process = self.process, None
+        if process is None or process.returncode is not None:
+            return
+        process.stdin.close()
+        try:
+            await asyncio.wait_for(process.wait(), 1)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+    def kill(self):
+        """ Kill Node.js process without waiting for it """
+        if self.alive:
+            self.killed = True
+            self.process.kill()
+
+    async def call(self, func, fargs_json, backend, timeout=None):
+        """
+        Call JS function in the worker and return its result
+        (see `NodeJSWorker.call()`), on timeout the worker is killed
+        and the other requests in flight in it fail
+        """
+        buffers = []
+        return await self._request(
+            func, format_call(fargs_json, buffers), backend,
+            buffers=buffers, timeout=timeout)
+
+    async def call_many(self, func, chunk_json, backend, timeout=None):
+        """
+        Call JS function in the worker for every list of arguments
+        (see `NodeJSWorker.call_many()`)
+        """
+        buffers = []
+        return await self._request(
+            func, format_batch(chunk_json, buffers), backend, 'results',
+            buffers, timeout)
+
+    async def _request(self, func, payload, backend, key='result',
+                       buffers=(), timeout=None):
+        if not self.alive:
+            self.backend = weakref.ref(backend)
+            if self.start_lock is None:
+                self.start_lock = asyncio.Lock()
+            async with self.start_lock:
+                if not self.alive:
+                    await self.start()
+        self.calls += 1
+        self.last_used = time.monotonic()
+        self.last_id += 1
+        request_id = self.last_id
+        future = self.pending[request_id] = (
+            asyncio.get_running_loop().create_future())
+        # A cancelled request stays pending until the worker answers it,
+        # so the busy worker is not picked by the pool, the response
+        # is dropped
+        # Requests are written in order, so the worker sees every change
+        self.globals_version, globals_json, deleted = (
+            backend.global_vars_delta(self.globals_version, data_refs=True))
+        try:
+            self.process.stdin.writelines(format_request(
+                request_id, func, payload, globals_json, deleted, buffers))
+            # Back pressure: wait while the pipe buffer is full
+            await self.process.stdin.drain()
+        except (ConnectionError, RuntimeError) as err:
+            self.pending.pop(request_id, None)
+            raise JSRuntimeException(
+                'Node.js worker died', ''.join(self.output)) from err
+        try:
+            response = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError as err:
+            # The JS loop can not be interrupted, the worker is killed
+            # and replaced by the next request
+            if self.alive and not self.killed:
+                self.logger.warning(
+                    'Killing timed out Node.js worker pid=%s',
+                    self.process.pid)
+                self.kill()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from err
+        return response_value(response, key)
+
+    async def _read_responses(self, process, responses):
+        while True:
+            message, buffers = await binary.aread_frame(responses)
+            if message is None:
+                break
+            response = binary.loads(message, buffers)
+            future = self.pending.pop(response.get('id'), None)
+            if future is not None and not future.done():
+                future.set_result(response)
+
+        await process.wait()
+        if process is self.process and not self.killed:
+            self.logger.error(
+                'Node.js worker died (exit code %s)', process.returncode)
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(JSRuntimeException(
+                    'Node.js worker died (exit code %s)' % process.returncode,
+                    ''.join(self.output)))
+
+    async def _drain_output(self, process):
+        while True:
+            line = await process.stdout.readline()
+            if not line:
+                break
+            self.output.append(line.decode(errors='replace'))
+
+
+class AsyncNodeJSWorkerPool(object):
+    """
+    Pool of `AsyncNodeJSWorker` processes, requests are multiplexed to
+    the worker with the fewest requests in flight. Workers retired by the
+    recycling policy are replaced by workers started in the background,
+    then stopped when their requests in flight are answered.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, size, node_bin, js_libs, js_code, use_sources=True,
+                 cache_dir=None, policy=None, name=None, sink=None):
+        """
+        :param int size: number of Node.js processes
+        :param str node_bin: Node.js executable
+        :param list js_libs: paths to JS libraries
+        :param str js_code: main JS code
+        :param bool use_sources: (optional) pass sources of the libraries
+            from memory instead of paths
+        :param str cache_dir: (optional) directory of V8 code cache
+        :param RecyclePolicy policy: (optional) recycling of the workers
+        :param str name: (optional) backend name of the metrics
+        :param MetricsSink sink: (optional) metrics sink of the backend
+        """
+        self.workers = [
+            AsyncNodeJSWorker(
+                node_bin, js_libs, js_code, use_sources, cache_dir)
+            for _ in range(size)]
+        self.policy = policy
+        self.name = name or type(self).__name__
+        self.sink = sink
+        self.replacing = set()  # ids of the workers being replaced
+        self.tasks = set()  # replacements in progress
+
+    def _worker(self):
+        if self.policy is not None and self.policy.idle_timeout:
+            now = time.monotonic()
+            for worker in list(self.workers):
+                if (worker.alive and not worker.pending and self.policy.idle(
+                        worker.calls, worker.last_used, now)):
+                    self._recycle(worker, 'idle')
+        return min(self.workers, key=lambda worker: len(worker.pending))
+
+    def _check(self, worker):
+        if self.policy is not None and worker.alive:
+            reason = self.policy.reason(worker.calls, worker.pid)
+            if reason is not None:
+                self._recycle(worker, reason)
+
+    def _recycle(self, worker, reason):
+        if id(worker) in self.replacing or worker not in self.workers:
+            return
+        self.replacing.add(id(worker))
+        task = asyncio.get_running_loop().create_task(
+            self._replace(worker, reason))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def _replace(self, old, reason):
+        new = AsyncNodeJSWorker(
+            old.node_bin, old.js_libs, old.js_code, old.use_sources,
+            old.cache_dir)
+        new.backend = old.backend
+        try:
+            await new.start()
+        except Exception:
+            self.logger.exception(
+                'Can not start replacement of %s engine', self.name)
+            self.replacing.discard(id(old))
+            return
+        self.replacing.discard(id(old))
+        if old not in self.workers:
+            await new.stop()
+            return
+        self.workers[self.workers.index(old)] = new
+        self.policy.record(self.name, reason, self.sink)
+        await asyncio.gather(*list(old.pending.values()),
+                             return_exceptions=True)
+        await old.stop()
+
+    async def call(self, func, fargs_json, backend, timeout=None):
+        worker = self._worker()
+        try:
+            return await worker.call(func, fargs_json, backend, timeout)
+        finally:
+            self._check(worker)
+
+    async def call_many(self, func, chunk_json, backend, timeout=None):
+        worker = self._worker()
+        try:
+            return await worker.call_many(func, chunk_json, backend, timeout)
+        finally:
+            self._check(worker)
+
+    async def close(self):
+        """ Stop all workers """
+        for task in list(self.tasks):
+            task.cancel()
+        for worker in self.workers:
+            await worker.stop()
+
+    def kill(self):
+        """ Kill all workers without waiting for them """
+        for task in list(self.tasks):
+            task.cancel()
+        for worker in self.workers:
+            worker.kill()
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import logging
+
+from .exceptions import ArgumentError
+
+__all__ = ['Pipeline', 'PipelineHandle', ]
+
+# Helper of `data/helpers.js` running the steps inside the engine
+PIPELINE_FUNC = '__runjs_pipeline'
+
+
+class PipelineHandle(object):
+    """
+    Result of a pipeline step, it stays in the engine and is passed to
+    the later steps which have the handle in their arguments
+    """
+
+    def __init__(self, pipeline, step):
+        self.pipeline = pipeline
+        self.step = step
+
+    def __repr__(self):
+        return '<PipelineHandle step=%d %s>' % (
+            self.step, self.pipeline.steps[self.step][0])
+
+
+class Pipeline(object):
+    """
+    Chain of JS function calls made in one engine call, intermediate
+    results are not converted to Python:
+
+        js.pipeline().call('decode_cbor').call('normalize', [opts]).run()
+
+    Every step gets the result of the previous one as its first argument
+    (unless `chain=False`), results of earlier steps are passed by their
+    handles (see `handle()`). Only the result of the last step is
+    returned.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, backend):
+        """
+        :param backend: backend or `BackendPool` running the pipeline
+        """
+        self.backend = backend
+        self.steps = []  # (func, fargs, chain)
+
+    def call(self, func, fargs=[], chain=True):
+        """
+        Add call of JS function
+        :param str func: JS function name
+        :param list fargs: (optional) list of JS function args, they may
+            contain handles of the earlier steps
+        :param bool chain: (optional) if true, then the result of the
+            previous step is passed as the first argument
+        :rtype: Pipeline
+        :return: the pipeline itself, for chaining
+        """
+        if not isinstance(fargs, (list, tuple)):
+            err = 'The `fargs` argument must be list or tuple'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        for arg in fargs:
+            if isinstance(arg, PipelineHandle) and (
+                    arg.pipeline is not self or arg.step >= len(self.steps)):
+                err = 'The handle is not a result of an earlier step'
+                self.logger.error(err)
+                raise ArgumentError(err)
+        self.steps.append((func, list(fargs), chain))
+        return self
+
+    def handle(self, step=-1):
+        """
+        Return handle of the step result (default is the last step)
+        :param int step: (optional) index of the step
+        :rtype: PipelineHandle
+        """
+        if not self.steps:
+            err = 'The pipeline has no steps'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        return PipelineHandle(self, range(len(self.steps))[step])
+
+    def _call_args(self):
+        """
+        Return arguments of `__runjs_pipeline()`: the steps as
+            [func, argument refs, chain] followed by the arguments, a ref
+            is an index of the arguments or [step] of a handle
+        :rtype: list
+        """
+        if not self.steps:
+            err = 'The pipeline has no steps'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        steps = []
+        args = []
+        for func, fargs, chain in self.steps:
+            refs = []
+            for arg in fargs:
+                if isinstance(arg, PipelineHandle):
+                    refs.append([arg.step])
+                else:
+                    refs.append(len(args))
+                    args.append(arg)
+            steps.append([func, refs, chain])
+        return [steps] + args
+
+    def run(self, cache=False, timeout=None):
+        """
+        Run all steps in one engine call and return the last result
+        :param bool cache: (optional) memoize the result (the key covers
+            all steps and arguments)
+        :param float timeout: (optional) deadline of the whole pipeline
+        :raise JSRuntimeException: a step has failed
+        """
+        return self.backend.run(
+            PIPELINE_FUNC, self._call_args(), cache=cache, timeout=timeout)
+
+    async def arun(self, timeout=None):
+        """
+        Awaitable version of `run()`
+        """
+        return await self.backend.arun(
+            PIPELINE_FUNC, self._call_args(), timeout=timeout)
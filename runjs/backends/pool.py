@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+import functools
+import logging
+import threading
+import time
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .exceptions import ArgumentError, JSTimeoutError, PoolTimeout
+from .pipeline import Pipeline
+from .shared_data import DataHandle, shared_data
+
+__all__ = ['BackendPool', ]
+
+
+class BackendPool(object):
+    """
+    Thread-safe pool of backend instances with the backend `run()` API,
+    every call checks out an idle backend for its duration
+    """
+    logger = logging.getLogger(__name__)
+    strategies = ('round_robin', 'thread')
+
+    def __init__(self, create, size, timeout=None, strategy='round_robin'):
+        """
+        :param callable create: returns new backend instance
+        :param int size: number of backends
+        :param float timeout: (optional) default seconds to wait for an
+            idle backend, `None` waits forever
+        :param str strategy: (optional) 'round_robin' takes the backend
+            idle for the longest time, 'thread' prefers the backend used
+            last by the calling thread
+        """
+        if size < 1:
+            err = 'The pool size must be positive'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        if strategy not in self.strategies:
+            err = 'The pool strategy must be one of: %s' % ', '.join(
+                self.strategies)
+            self.logger.error(err)
+            raise ArgumentError(err)
+
+        self.backends = [create() for _ in range(size)]
+        self.timeout = timeout
+        self.strategy = strategy
+        self.idle = list(self.backends)
+        self.condition = threading.Condition()
+        self.local = threading.local()
+
+        # Global variables applied to a backend when it is checked out
+        self.js_global_vars = OrderedDict()
+        self.js_global_vars_serial = {}  # name: version of the last set
+        self.js_global_vars_deleted = {}  # name: version of the deletion
+        self.js_global_vars_version = 0
+        self.synced_versions = dict.fromkeys(map(id, self.backends), 0)
+
+        self.waiters = 0
+        self.busy = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    @contextmanager
+    def acquire(self, block=True, timeout=False):
+        """
+        Check out an idle backend
+
+        :param bool block: (optional) if false, then fail at once when
+            no backend is idle
+        :param float timeout: (optional) seconds to wait, default is
+            the pool timeout
+
+        :raise PoolTimeout: no idle backend within the timeout
+        """
+        if timeout is False:
+            timeout = self.timeout
+        if not block:
+            timeout = 0
+        started = time.monotonic()
+
+        with self.condition:
+            self.waiters += 1
+            try:
+                while not self.idle:
+                    remaining = None
+                    if timeout is not None:
+                        remaining = timeout - (time.monotonic() - started)
+                        if remaining <= 0:
+                            self.timeouts += 1
+                            raise PoolTimeout(
+                                'No idle backend in the pool within %ss'
+                                % timeout)
+                    self.condition.wait(remaining)
+            finally:
+                self.waiters -= 1
+
+            backend = self._take()
+            self.busy += 1
+            self.acquired += 1
+            waited = time.monotonic() - started
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+            self._sync_global_vars(backend)
+
+        try:
+            yield backend
+        finally:
+            with self.condition:
+                self.idle.append(backend)
+                self.busy -= 1
+                self.condition.notify_all()
+
+    def _take(self):
+        if self.strategy == 'thread':
+            backend = getattr(self.local, 'backend', None)
+            if backend is not None and backend in self.idle:
+                self.idle.remove(backend)
+                return backend
+            self.local.backend = backend = self.idle.pop()
+            return backend
+        return self.idle.pop(0)
+
+    def _sync_global_vars(self, backend):
+        """
+        Apply changes of the global variables made since the backend
+        was checked out last time, unchanged ones keep their serialized
+        form in the backend
+        """
+        version = self.synced_versions[id(backend)]
+        if version == self.js_global_vars_version:
+            return
+        backend.delete_global_vars([
+            k for k, serial in self.js_global_vars_deleted.items()
+            if serial > version and k in backend.js_global_vars])
+        backend.set_global_vars({
+            k: v for k, v in self.js_global_vars.items()
+            if self.js_global_vars_serial[k] > version})
+        self.synced_versions[id(backend)] = self.js_global_vars_version
+
+    def stats(self):
+        """
+        Return pool statistics
+        :rtype: dict
+        """
+        with self.condition:
+            return {
+                'size': len(self.backends),
+                'busy': self.busy,
+                'idle': len(self.idle),
+                'waiters': self.waiters,
+                'acquired': self.acquired,
+                'timeouts': self.timeouts,
+                'wait_time': self.wait_time,
+                'max_wait_time': self.max_wait_time,
+                'avg_wait_time': (
+                    self.wait_time / self.acquired if self.acquired else 0.0),
+            }
+
+    def run(self, *args, **kwargs):
+        """
+        Call `run()` of an idle backend
+        """
+        with self.acquire() as backend:
+            return backend.run(*args, **kwargs)
+
+    def run_many(self, func, fargs_iter, chunk_size=100, as_generator=False,
+                 timeout=None):
+        """
+        Call `run_many()` of an idle backend, the generator holds
+            the backend until it is exhausted
+        """
+        if as_generator:
+            return self._iter_many(func, fargs_iter, chunk_size, timeout)
+        with self.acquire() as backend:
+            return backend.run_many(
+                func, fargs_iter, chunk_size, timeout=timeout)
+
+    def _iter_many(self, func, fargs_iter, chunk_size, timeout=None):
+        with self.acquire() as backend:
+            yield from backend.run_many(
+                func, fargs_iter, chunk_size, as_generator=True,
+                timeout=timeout)
+
+    def pipeline(self):
+        """
+        Return new pipeline run by an idle backend (see `Pipeline`)
+        """
+        return Pipeline(self)
+
+    async def arun(self, func=None, fargs=[], timeout=None):
+        """
+        Awaitable version of `run()`, waits for an idle backend
+            in a thread, `timeout` is the deadline of the call too
+        :raise JSTimeoutError: the result is not ready in time
+        """
+        return await self._in_executor(functools.partial(
+            self.run, func, fargs, timeout=timeout), timeout)
+
+    async def arun_many(self, func, fargs_iter, chunk_size=100,
+                        timeout=None):
+        """
+        Awaitable version of `run_many()`, `timeout` is the deadline
+            of the calls too
+        :raise JSTimeoutError: the results are not ready in time
+        """
+        return await self._in_executor(functools.partial(
+            self.run_many, func, list(fargs_iter), chunk_size,
+            timeout=timeout), timeout)
+
+    async def _in_executor(self, call, timeout=None):
+        """
+        Run `call()` in the default executor, the backend interrupts
+            the timed out call itself
+        """
+        # Imported by the first awaitable call, the pool is imported
+        # with the package
+        import asyncio
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(None, call), timeout)
+        except JSTimeoutError:
+            raise
+        except asyncio.TimeoutError as err:
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from err
+
+    def set_global_vars(self, js_vars):
+        """
+        Set variables for pass to JS global context of every backend
+        :param dict vars: variables to pass
+        :rtype: bool
+        """
+        if not isinstance(js_vars, dict):
+            err = 'The `js_vars` argument must be dict'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        with self.condition:
+            for k, v in js_vars.items():
+                self.js_global_vars[k] = v
+                self.js_global_vars_version += 1
+                self.js_global_vars_serial[k] = self.js_global_vars_version
+                self.js_global_vars_deleted.pop(k, None)
+        return True
+
+    def delete_global_vars(self, js_vars):
+        """
+        Delete variables for pass to JS global context of every backend
+        :param list|tuple vars: variables name for deleting
+        """
+        if not isinstance(js_vars, (list, tuple)):
+            err = 'The `js_vars` argument must be list or tuple'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        with self.condition:
+            for k in js_vars:
+                del self.js_global_vars[k]
+                self.js_global_vars_version += 1
+                self.js_global_vars_deleted[k] = self.js_global_vars_version
+                self.js_global_vars_serial.pop(k, None)
+        return True
+
+    def set_global_var(self, name, value):
+        """
+        Set variable for pass to JS global context of every backend
+        """
+        return self.set_global_vars({name: value})
+
+    def delete_global_var(self, name):
+        """
+        Delete variable for pass to JS global context of every backend
+        """
+        return self.delete_global_vars((name, ))
+
+    def register_data(self, name, value):
+        """
+        Set large read-only value as variable of JS global context of
+            every backend (see `AbstractBackend.register_data()`)
+        :rtype: DataHandle
+        """
+        handle = shared_data.register(value)
+        with self.condition:
+            current = self.js_global_vars.get(name)
+        if not isinstance(current, DataHandle) or current != handle:
+            self.set_global_vars({name: handle})
+        return handle
+
+    def cache_function(self, func, global_vars=None):
+        """
+        Memoize results of the pure JS function in every backend
+            (see `AbstractBackend.cache_function()`)
+        """
+        for backend in self.backends:
+            backend.cache_function(func, global_vars)
+
+    def uncache_function(self, func):
+        """
+        Stop memoizing results of the JS function in every backend
+        """
+        for backend in self.backends:
+            backend.uncache_function(func)
+
+    def reset(self):
+        """
+        Reset every backend, waits until all of them are idle
+        """
+        with self.condition:
+            while len(self.idle) < len(self.backends):
+                self.condition.wait()
+            for backend in self.backends:
+                backend.reset()
+
+    def close(self):
+        """
+        Close every backend which has long-lived processes
+        """
+        for backend in self.backends:
+            if hasattr(backend, 'close'):
+                backend.close()
@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+import logging
+import itertools
+import multiprocessing
+import os
+import threading
+import time
+
+from .binary import from_picklable, to_picklable
+from .exceptions import JSRuntimeException, JSTimeoutError
+from .recycle import RecyclingPool
+
+__all__ = ['EngineProcessPool', ]
+
+# Pinned processes of all pools of the process take the next CPUs
+_next_cpu = itertools.count()
+_cpu_lock = threading.Lock()
+
+
+def _worker_main(conn, backend_cls, backend_args, backend_kwargs, cpu):
+    """
+    Worker process: evaluate the JS code once in a persistent backend
+    and serve calls received over the pipe
+    """
+    if cpu is not None:
+        os.sched_setaffinity(0, {cpu})
+    backend = backend_cls(*backend_args, persistent=True, **backend_kwargs)
+    while True:
+        try:
+            op, args, changed, deleted = conn.recv()
+        except EOFError:
+            break
+        try:
+            backend.delete_global_vars(
+                [k for k in deleted if k in backend.js_global_vars])
+            backend.set_global_vars(changed)
+            if op == 'run':
+                result = to_picklable(backend.run(*args))
+            else:
+                result = [to_picklable(item)
+                          for item in backend._run_chunk(*args)]
+            conn.send((True, result))
+        except Exception as err:
+            conn.send((False, err))
+
+
+class EngineProcess(object):
+    """ Worker process with a warm in-process backend """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, mp_context, backend_cls, backend_args, backend_kwargs,
+                 cpu=None):
+        self.mp_context = mp_context
+        self.backend_cls = backend_cls
+        self.backend_args = backend_args
+        self.backend_kwargs = backend_kwargs
+        self.cpu = cpu
+        self.process = None
+        self.conn = None
+        self.globals_version = 0  # global vars version seen by the process
+        self.calls = 0  # calls served by the process
+        self.last_used = time.monotonic()
+
+    @property
+    def alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    @property
+    def pid(self):
+        process = self.process
+        return process.pid if process is not None else None
+
+    def start(self):
+        self.conn, child_conn = self.mp_context.Pipe()
+        self.globals_version = 0
+        self.calls = 0
+        self.process = self.mp_context.Process(
+            target=_worker_main, daemon=True, args=(
+                child_conn, self.backend_cls, self.backend_args,
+                self.backend_kwargs, self.cpu))
+        self.process.start()
+        child_conn.close()
+        self.logger.debug(
+            'Started engine process pid=%s cpu=%s', self.process.pid, self.cpu)
+
+    def warm_up(self):
+        """
+        Load the JS code in the started process before its first call
+        :raise JSException: the JS code can not be loaded
+        """
+        try:
+            self.conn.send(('run', (None, []), {}, []))
+            ok, result = self.conn.recv()
+        except (EOFError, OSError) as err:
+            exitcode = self.process.exitcode
+            self.stop()
+            raise JSRuntimeException(
+                'Engine process died (exit code %s)' % exitcode,
+                str(err)) from err
+        if not ok:
+            self.stop()
+            raise result
+
+    def stop(self):
+        process, self.process = self.process, None
+        if process is None:
+            return
+        self.conn.close()
+        process.join(timeout=1)
+        if process.is_alive():
+            process.kill()
+            process.join()
+
+    def call(self, op, args, backend, timeout=None):
+        """
+        Send the call with changes of the global variables of `backend`
+        to the process and return its result
+
+        :param float timeout: (optional) seconds before the process is
+            killed, it is restarted by the next call
+        :raise JSRuntimeException: the process has died
+        :raise JSTimeoutError: the process is killed by the timeout
+        """
+        if not self.alive:
+            self.start()
+        self.calls += 1
+        self.last_used = time.monotonic()
+        self.globals_version, changed, deleted = backend.global_vars_delta(
+            self.globals_version, serialized=False)
+        try:
+            self.conn.send((op, args, dict(
+                (k, to_picklable(v)) for k, v in changed.items()), deleted))
+            if timeout is not None and not self.conn.poll(timeout):
+                self.logger.warning(
+                    'Engine process pid=%s timed out, killing it',
+                    self.process.pid)
+                self.process.kill()
+                self.stop()
+                raise JSTimeoutError(
+                    'The JS call timed out after %ss' % timeout)
+            ok, result = self.conn.recv()
+        except (EOFError, OSError) as err:
+            exitcode = self.process.exitcode
+            self.stop()
+            self.logger.error('Engine process died (exit code %s)', exitcode)
+            raise JSRuntimeException(
+                'Engine process died (exit code %s)' % exitcode,
+                str(err)) from err
+        if not ok:
+            raise result
+        return result
+
+
+class EngineProcessPool(RecyclingPool):
+    """
+    Pool of processes, each one holds a warm persistent backend, to run
+    in-process engines in parallel outside of the GIL. Calls and results
+    are pickled over pipes. Processes retired by the recycling policy are
+    replaced by warm processes started in the background.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, size, backend_cls, backend_args=(), backend_kwargs={},
+                 pin_cpus=False, start_method='spawn', policy=None, name=None,
+                 sink=None):
+        """
+        :param int size: number of processes
+        :param type backend_cls: backend class run in the processes
+        :param tuple backend_args: (optional) backend class args
+        :param dict backend_kwargs: (optional) backend class kwargs
+        :param bool pin_cpus: (optional) pin every process to one CPU,
+            pools of the process continue on the CPUs after the previous
+            pool, so they do not stack onto the same cores
+        :param str start_method: (optional) multiprocessing start method
+        :param RecyclePolicy policy: (optional) recycling of the processes
+        :param str name: (optional) backend name of the metrics
+        :param MetricsSink sink: (optional) metrics sink of the backend
+        """
+        mp_context = multiprocessing.get_context(start_method)
+        cpus = [None] * size
+        if pin_cpus and hasattr(os, 'sched_getaffinity'):
+            allowed = sorted(os.sched_getaffinity(0))
+            with _cpu_lock:
+                cpus = [allowed[next(_next_cpu) % len(allowed)]
+                        for _ in range(size)]
+        super().__init__([
+            EngineProcess(
+                mp_context, backend_cls, backend_args, backend_kwargs, cpu)
+            for cpu in cpus], policy, name or backend_cls.__name__, sink)
+
+    @property
+    def processes(self):
+        return self.engines
+
+    def _new_engine(self, process):
+        return EngineProcess(
+            process.mp_context, process.backend_cls, process.backend_args,
+            process.backend_kwargs, process.cpu)
+
+    def _start_engine(self, process):
+        process.start()
+        process.warm_up()
+
+    def start(self):
+        """ Start all processes at once instead of on the first call """
+        for process in self.processes:
+            if not process.alive:
+                process.start()
+
+    def run(self, func, fargs, backend, timeout=None):
+        """
+        Call `run()` of the backend in the first idle process
+        :param AbstractBackend backend: owner of the global variables
+        :param float timeout: (optional) seconds before the process is
+            killed and replaced
+        """
+        fargs = [to_picklable(arg) for arg in fargs or ()]
+        return from_picklable(
+            self._call('run', (func, fargs), backend, timeout))
+
+    def run_chunk(self, func, chunk, backend, timeout=None):
+        """
+        Call `_run_chunk()` of the backend in the first idle process
+        :param float timeout: (optional) seconds before the process is
+            killed and replaced
+        """
+        chunk = [[to_picklable(arg) for arg in fargs] for fargs in chunk]
+        return [from_picklable(item) for item in self._call(
+            'chunk', (func, chunk), backend, timeout)]
+
+    def _call(self, op, args, backend, timeout=None):
+        process = self._acquire()
+        try:
+            return process.call(op, args, backend, timeout)
+        finally:
+            self._release(process)
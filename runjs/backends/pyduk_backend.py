@@ -1,15 +1,20 @@
+import functools
 import json
-import os
 
-from .exceptions import JSConversionException, JSRuntimeException
+from collections import OrderedDict
+
+from .exceptions import (
+    JSConversionException, JSLoadError, JSRuntimeException, JSTimeoutError)
 
 try:
     import pyduk
 except ImportError:
-    print("Could not import pyduk")
-    pass
+    pyduk = None
 
-from .abstract import AbstractBackend
+from . import binary
+from .abstract import JS_HELPERS, AbstractBackend, call_with_deadline
+from .metrics import NULL_CALL_METRICS
+from .process_pool import EngineProcessPool
 
 __all__ = ['PydukBackend']
 
@@ -20,49 +25,196 @@ class PydukBackend(AbstractBackend):
     can_run_str = True
     can_precompile = False
 
+    def __init__(self, js_code='', js_libs=[], js_libs_code={}, processes=0,
+                 pin_cpus=False, **kwargs):
+        """
+        Create new pyduk wrapper
+        :param str js_code: (optional) JS code for run
+        :param list js_libs: (optional) paths to JS libraries code
+        :param dict js_libs_code: (optional) dict of JS libraries code
+        :param int processes: (optional) number of worker processes with
+            warm contexts to run calls in parallel outside of the GIL,
+            `0` runs calls in this process
+        :param bool pin_cpus: (optional) pin every worker process to
+            its own CPU (see `EngineProcessPool`)
+        :raise ImportError: pyduk is not installed
+        """
+        super().__init__(js_code, js_libs, js_libs_code, **kwargs)
+        self.process_pool = None
+        if pyduk is None:
+            err = 'Could not import pyduk'
+            self.logger.error(err)
+            raise ImportError(err)
+        self.processes = processes
+        if processes:
+            libs_code = OrderedDict(
+                (k, v) for k, v in self.js_libs_code.items() if k != 'main')
+            self.process_pool = EngineProcessPool(
+                processes, PydukBackend, (js_code, self.js_libs, libs_code),
+                pin_cpus=pin_cpus, policy=self.recycle,
+                name=type(self).__name__, sink=self.metrics)
+
+    def __del__(self):
+        self.close()
+        super().__del__()
+
+    def close(self):
+        """
+        Stop the worker processes
+        """
+        if getattr(self, 'process_pool', None) is not None:
+            self.process_pool.close()
+
     def _get_js_obj(self, obj):
+        if binary.is_binary(obj):
+            return binary.js_expression(obj)
         if hasattr(obj, '__dict__'):
             obj = dict(obj)
         return json.dumps(obj)
 
-    def _run_unprotected(self, func=None, fargs=None):
+    def _new_context(self, metrics=NULL_CALL_METRICS):
+        """
+        Create new context, evaluate the libraries and JS code in it
+        :param CallMetrics metrics: (optional) metrics of the call
+        :rtype: tuple
+        :return: context and result of the JS code
+        :raise JSLoadError: the libraries or the JS code fail
+        """
         ctx = pyduk.Context(use_global_polyfill=True)
-        for k, v in self.js_global_vars.items():
-            ctx.run(f'var {k} = {self._get_js_obj(v)}')
-
-        for js_lib in self.js_libs:
-            js_lib = os.path.abspath(js_lib)
-            with open(js_lib) as lib_file:
-                ctx.run(lib_file.read())
+        ctx.run(JS_HELPERS)
+        for k, v in self.get_global_vars_json().items():
+            v = binary.js_value(v)
+            if self.persistent:
+                # Assigned (not declared) to be deletable by later calls
+                ctx.run(f'this[{json.dumps(k)}] = {v}')
+            else:
+                ctx.run(f'var {k} = {v}')
+        metrics.mark('globals')
+
+        # Library files are read into `js_libs_code` by the constructor,
+        # the main JS code is run last for its result
+        try:
+            for js_lib, lib_code in self.js_libs_code.items():
+                if js_lib != 'main':
+                    ctx.run(lib_code)
 
-        for _, lib_code in self.js_libs_code.items():
-            ctx.run(lib_code)
+            result = ctx.run(self.js_code)
+        except pyduk.JSRuntimeError as err:
+            raise JSLoadError(str(err), err.wrapped.traceback) from err
+        metrics.mark('libs')
+        return ctx, result
 
-        res = ctx.run(self.js_code)
+    def _warm_context(self, metrics=NULL_CALL_METRICS):
+        """
+        Return the persistent context with the current global variables
+        """
+        self._recycle_context()
+        if self.js_context is None:
+            self.js_context, self.js_context_result = self._new_context(
+                metrics)
+            self._global_vars_changes()
+            return self.js_context
+
+        ctx = self.js_context
+        js_vars, deleted = self._global_vars_changes()
+        for k in deleted:
+            ctx.run(f'delete this[{json.dumps(k)}]')
+        for k, v in js_vars:
+            ctx.run(f'this[{json.dumps(k)}] = {binary.js_value(v)}')
+        metrics.mark('globals')
+        return ctx
+
+    def _run_unprotected(self, func=None, fargs=None,
+                         metrics=NULL_CALL_METRICS):
+        if self.persistent:
+            ctx = self._warm_context(metrics)
+            res = self.js_context_result
+        else:
+            ctx, res = self._new_context(metrics)
         if func:
             args = ','.join(map(self._get_js_obj, fargs if fargs else []))
-            res = ctx.run(f'{func}({args})')
+            metrics.mark('args')
+            if metrics.enabled:
+                metrics.args_bytes = len(args)
+            # The engine returns the result converted to Python,
+            # typed arrays are passed as markers
+            res = binary.from_marker(
+                ctx.run(f'__runjs_binary_result({func}({args}))'))
+            metrics.mark('execute')
         return res
 
+    def _run_chunk_unprotected(self, func, chunk):
+        if self.persistent:
+            ctx = self._warm_context()
+        else:
+            ctx, _ = self._new_context()
+        chunk_js = ','.join(
+            '[%s]' % ','.join(map(self._get_js_obj, fargs)) for fargs in chunk)
+        items = ctx.run(f'__runjs_batch({json.dumps(func)}, [{chunk_js}])')
+        return self._batch_results(binary.loads(items))
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        if self.process_pool is not None:
+            return self.process_pool.run_chunk(func, chunk, self, timeout)
+        try:
+            return call_with_deadline(
+                timeout, self._protected, self._run_chunk_unprotected, func,
+                chunk)
+        except JSTimeoutError:
+            # The abandoned call still owns the warm context
+            self.reset()
+            raise
+
+    def _protected(self, call, *args):
+        """
+        Call `call(*args)` converting pyduk errors to runjs exceptions
+        """
+        try:
+            return call(*args)
+        except IOError as err:
+            raise RuntimeError from IOError
+        except pyduk.JSRuntimeError as err:
+            raise JSRuntimeException(str(err), err.wrapped.traceback) from err
+        except pyduk.ConversionError as err:
+            raise JSConversionException from err
 
-    def run(self, func=None, fargs=None):
+    def run(self, func=None, fargs=None, cache=False, timeout=None):
         """
         run js code with libraries and return result as
             python type
 
         :param str func: (optional) js function name
         :param list fargs: (optional) list of js function args
+        :param bool cache: (optional) if true, then the result is
+            memoized in the result cache (see `cache_function()`)
+        :param float timeout: (optional) deadline of the call in seconds,
+            a worker process is killed and replaced when it passes, an
+            in-process call is abandoned in its thread (pyduk can not be
+            interrupted, use `processes` for runaway scripts, see
+            `call_with_deadline()`)
 
         :raise JSRuntimeException: js runtime error
         :raise JSCoversionError: js conversion error
+        :raise JSTimeoutError: the deadline has passed
         :raise RuntimeError
         """
-
-        try:
-            return self._run_unprotected(func, fargs)
-        except IOError as err:
-            raise RuntimeError from IOError
-        except pyduk.JSRuntimeError as err:
-            raise JSRuntimeException(str(err), err.wrapped.traceback) from err
-        except pyduk.ConversionError as err:
-            raise JSConversionException from err
+        run = functools.partial(
+            self._run_uncached, timeout=self._call_timeout(timeout))
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(func, fargs, run)
+        return run(func, fargs)
+
+    def _run_uncached(self, func=None, fargs=None, timeout=None):
+        with self._call_metrics(func) as metrics:
+            if self.process_pool is not None:
+                result = self.process_pool.run(func, fargs, self, timeout)
+                metrics.mark('execute')
+                return result
+            try:
+                return call_with_deadline(
+                    timeout, self._protected, self._run_unprotected, func,
+                    fargs, metrics)
+            except JSTimeoutError:
+                # The abandoned call still owns the warm context
+                self.reset()
+                raise
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import functools
+import json
 import logging
+import threading
 from collections import OrderedDict
 
 try:
@@ -7,21 +10,50 @@ try:
 except:
     pass
 
-from .abstract import AbstractBackend
-from .exceptions import ArgumentError, JSFunctionNotExists
+from . import binary
+from .abstract import JS_HELPERS, AbstractBackend, deadline
+from .exceptions import (
+    ArgumentError, JSConversionException, JSFunctionNotExists, JSLoadError,
+    JSTimeoutError)
+from .libcache import library_cache
+from .metrics import NULL_CALL_METRICS
 
 __all__ = ['PyV8Backend', ]
 
 
+def _load_error(err):
+    """
+    Return exception for the error of compiling or running the libraries
+    :rtype: JSLoadError
+    """
+    return JSLoadError(str(err), getattr(err, 'stackTrace', None) or str(err))
+
+
 class PyV8Backend(AbstractBackend):
     """ Backend class for PyV8 """
     logger = logging.getLogger(__name__)
     can_precompile = True
     can_run_str = True
+    json_max_depth = 500  # max nesting converted via JSON in the engine
+    max_depth = 10000  # max nesting of converted objects
+    precompile_cache_size = 256  # max number of precompiled sources
+    # Precompiled data by source hash, shared by all instances
+    _precompiled = OrderedDict()
+    _precompiled_lock = threading.Lock()
+
+    def __init__(self, js_code='', js_libs=[], js_libs_code={}, **kwargs):
+        """
+        Create new PyV8 wrapper
+        :param str js_code: (optional) JS code for run
+        :param list js_libs: (optional) paths to JS libraries code
+        :param dict js_libs_code: (optional) dict of JS libraries code
+        """
+        super().__init__(js_code, js_libs, js_libs_code, **kwargs)
+        self.js_libs_code_digests = {}  # name: (source, hash)
 
     def run(
             self, func=None, fargs=[], precompil_only=False,
-            compil_only=False):
+            compil_only=False, cache=False, timeout=None):
         """
         Run JS code with libraries and return last operand result or
             `func` result if it present
@@ -32,140 +64,377 @@ class PyV8Backend(AbstractBackend):
             return precommiled data all JS code
         :param bool compil_only: (optional) if true, then it
             will compile the JS code and throw errors if they were
+        :param bool cache: (optional) if true, then the result of `func`
+            is memoized in the result cache (see `cache_function()`)
+        :param float timeout: (optional) deadline of the call in seconds,
+            JS execution is terminated when it passes (V8 terminates
+            JS in all threads of the process)
 
         :raise SyntaxError: JS syntax error
         :raise PyV8.JSError: JS runtime error (contain fields:
             name, message, scriptName, lineNum, startPos, endPos,
             startCol, endCol, sourceLine, stackTrace)
+        :raise JSTimeoutError: the deadline has passed
+        """
+        timeout = self._call_timeout(timeout)
+        if (func is not None and not (precompil_only or compil_only) and
+                (cache or func in self.cached_functions)):
+            return self._run_cached(func, fargs, functools.partial(
+                self._run_uncached, timeout=timeout))
+        return self._run_uncached(
+            func, fargs, precompil_only, compil_only, timeout)
+
+    def _run_uncached(self, func=None, fargs=[], precompil_only=False,
+                      compil_only=False, timeout=None):
+        with self._call_metrics(func) as metrics:
+            call = None
+            if func and type(func) == str:
+                def call(js_context):
+                    return self._call(js_context, func, fargs, metrics)
+            try:
+                with deadline(timeout, PyV8.JSEngine.terminateAllThreads):
+                    return self._run(
+                        call, precompil_only, compil_only, metrics)
+            except JSTimeoutError:
+                # The terminated script may leave the warm context broken
+                self.reset()
+                raise
+
+    def _run(self, call=None, precompil_only=False, compil_only=False,
+             metrics=NULL_CALL_METRICS):
+        """
+        Run JS code with libraries and return last operand result or
+            result of `call(js_context)` if it present
         """
+        if self.persistent and not (precompil_only or compil_only):
+            return self._run_persistent(call, metrics)
+
         precompiled = OrderedDict()
         compiled = OrderedDict()
 
         with PyV8.JSLocker():
             with PyV8.JSContext() as js_context:
+                js_context.eval(JS_HELPERS)
                 self.logger.debug('Set JS global context class attributes')
-                for k, v in self.js_global_vars.items():
-                    self.logger.debug(
-                        'Set attribute name=%s, value=%s' % (k, v))
-                    # Convert to JS objects
-                    setattr(
-                        js_context.locals, k,
-                        self._get_js_obj(js_context, v))
+                self._set_global_vars(
+                    js_context, self.js_global_vars.items())
+                metrics.mark('globals')
 
                 with PyV8.JSEngine() as engine:
                     precompil_error = False
                     try:
                         for js_lib, js_code in self.js_libs_code.items():
                             self.logger.debug('Precompile JS lib: %s' % js_lib)
-                            precompiled[js_lib] = engine.precompile(js_code)
+                            precompiled[js_lib] = self._precompile(
+                                engine, js_lib, js_code)
                     except SyntaxError:
                         precompil_error = True
 
                     if not precompil_error and precompil_only:
                         return precompiled
 
-                    for js_lib, js_code in self.js_libs_code.items():
-                        self.logger.debug('Compile JS lib: %s' % js_lib)
-                        cparams = dict(
-                            source=self.js_libs_code[js_lib],
-                            name=js_lib)
-                        if js_lib in precompiled:
-                            cparams['precompiled'] = precompiled[js_lib]
-                        compiled[js_lib] = engine.compile(**cparams)
+                    try:
+                        for js_lib, js_code in self.js_libs_code.items():
+                            self.logger.debug('Compile JS lib: %s' % js_lib)
+                            cparams = dict(
+                                source=self.js_libs_code[js_lib],
+                                name=js_lib)
+                            if js_lib in precompiled:
+                                cparams['precompiled'] = precompiled[js_lib]
+                            compiled[js_lib] = engine.compile(**cparams)
+                    except (SyntaxError, PyV8.JSError) as err:
+                        if compil_only:
+                            raise
+                        raise _load_error(err) from err
+                    metrics.mark('compile')
                     if compil_only:
                         return True
 
                     result = None
-                    for js_lib, js_script in compiled.items():
-                        self.logger.debug('Run JS lib: %s' % js_lib)
-                        result = js_script.run()
+                    try:
+                        for js_lib, js_script in compiled.items():
+                            self.logger.debug('Run JS lib: %s' % js_lib)
+                            result = js_script.run()
+                    except PyV8.JSError as err:
+                        raise _load_error(err) from err
+                    metrics.mark('libs')
 
-                    if not func or type(func) != str:
+                    if call is None:
                         return result
 
-                    if fargs and not isinstance(fargs, (list, tuple)):
-                        raise ArgumentError(
-                            'The "fargs" must be list or tuple')
+                    return call(js_context)
+
+    def _run_persistent(self, call=None, metrics=NULL_CALL_METRICS):
+        """
+        Run `call(js_context)` in the warm JS context, the libraries are
+        compiled and run only on the first call
+        """
+        with PyV8.JSLocker():
+            self._recycle_context()
+            if self.js_context is None:
+                js_context = PyV8.JSContext()
+                with js_context:
+                    js_context.eval(JS_HELPERS)
+                    self._set_global_vars(
+                        js_context, self.js_global_vars.items())
+                    metrics.mark('globals')
+                    result = None
+                    with PyV8.JSEngine() as engine:
+                        for js_lib, js_code in self.js_libs_code.items():
+                            self.logger.debug('Compile JS lib: %s' % js_lib)
+                            cparams = dict(source=js_code, name=js_lib)
+                            try:
+                                cparams['precompiled'] = self._precompile(
+                                    engine, js_lib, js_code)
+                            except SyntaxError:
+                                pass
+                            try:
+                                result = engine.compile(**cparams).run()
+                            except (SyntaxError, PyV8.JSError) as err:
+                                raise _load_error(err) from err
+                    metrics.mark('libs')
+                self.js_context = js_context
+                self.js_context_result = result
+                self._global_vars_changes(serialized=False)
+
+            with self.js_context as js_context:
+                js_vars, deleted = self._global_vars_changes(serialized=False)
+                self._set_global_vars(js_context, js_vars, deleted)
+                metrics.mark('globals')
+
+                if call is None:
+                    return self.js_context_result
+
+                return call(js_context)
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Call JS function for every list of arguments of the chunk
+            inside one JS context
+        """
+        chunk_json = '[%s]' % ','.join(
+            '[%s]' % ','.join(map(self._get_js_json, fargs))
+            for fargs in chunk)
+
+        def call(js_context):
+            items = js_context.locals['__runjs_batch'](func, chunk_json)
+            return self._batch_results(binary.loads(str(items)))
+        try:
+            with deadline(timeout, PyV8.JSEngine.terminateAllThreads):
+                return self._run(call)
+        except JSTimeoutError:
+            self.reset()
+            raise
 
-                    if func not in js_context.locals:
-                        raise JSFunctionNotExists(
-                            'Function "%s" not exists in JS context' % func)
+    def _precompile(self, engine, js_lib, js_code):
+        """
+        Return precompiled data of the library, a source is precompiled
+            once per process and reused by every instance and `run()`
+        :param PyV8.JSEngine engine: current engine
+        :param str js_lib: library name
+        :param str js_code: library source code
+        :raise SyntaxError: JS syntax error
+        """
+        # The sources are not changed, so their hashes are computed once
+        cached = self.js_libs_code_digests.get(js_lib)
+        if cached is None or cached[0] is not js_code:
+            cached = self.js_libs_code_digests[js_lib] = (
+                js_code, library_cache.digest(js_code))
+        digest = cached[1]
+
+        with self._precompiled_lock:
+            precompiled = self._precompiled.get(digest)
+            if precompiled is not None:
+                self._precompiled.move_to_end(digest)
+                return precompiled
+        precompiled = engine.precompile(js_code)
+        with self._precompiled_lock:
+            self._precompiled[digest] = precompiled
+            while len(self._precompiled) > self.precompile_cache_size:
+                self._precompiled.popitem(last=False)
+        return precompiled
+
+    def _set_global_vars(self, js_context, js_vars, deleted=()):
+        """
+        Set variables in the JS global context, values serialized to JSON
+            are parsed by the engine in one script, the others (ex: Python
+            callables) are converted to JS objects
+        :param PyV8.JSContext js_context: current JS context
+        :param iterable js_vars: pairs of name and value
+        :param iterable deleted: (optional) names of variables to delete
+        """
+        code = ''
+        for k in deleted:
+            code += 'delete this[%s];\n' % json.dumps(k)
+        objects = []
+        for k, v in js_vars:
+            self.logger.debug('Set attribute name=%s, value=%s' % (k, v))
+            try:
+                v_json = self.get_global_var_json(k)
+            except (TypeError, ValueError):
+                objects.append((k, v))
+                continue
+            code += 'this[%s] = %s;\n' % (
+                json.dumps(k), binary.js_value(v_json))
+        if code:
+            js_context.eval(code)
+        for k, v in objects:
+            setattr(js_context.locals, k, self._get_js_obj(js_context, v))
 
-                    # Convert to JS objects
-                    for i in range(len(fargs)):
-                        fargs[i] = self._get_js_obj(js_context, fargs[i])
+    def _call(self, js_context, func, fargs, metrics=NULL_CALL_METRICS):
+        """
+        Call JS function in the entered context and return its result
+        converted to Python objects
+        :param PyV8.JSContext js_context: current JS context
+        :param str func: JS function name
+        :param list fargs: list of JS function args
+        :param CallMetrics metrics: (optional) metrics of the call
+        """
+        if fargs and not isinstance(fargs, (list, tuple)):
+            raise ArgumentError(
+                'The "fargs" must be list or tuple')
+
+        if func not in js_context.locals:
+            raise JSFunctionNotExists(
+                'Function "%s" not exists in JS context' % func)
+
+        # Convert to JS objects
+        js_fargs = [self._get_js_obj(js_context, arg) for arg in fargs]
+        metrics.mark('args')
 
-                    # Convert to Python objects
-                    return self._get_py_obj(
-                        js_context,
-                        js_context.locals[func](*fargs))
+        js_result = js_context.locals[func](*js_fargs)
+        if isinstance(js_result, PyV8.JSObject):
+            # Typed arrays are returned as markers
+            js_result = js_context.locals['__runjs_binary_result'](js_result)
+        metrics.mark('execute')
+
+        # Convert to Python objects
+        result = binary.from_marker(self._get_py_obj(js_context, js_result))
+        metrics.mark('result')
+        return result
 
     def _get_js_obj(self, ctx, obj):
         """
-        Convert Python object to JS object and return it
+        Convert Python object to JS object and return it, lists and dicts
+            of JSON types are passed as JSON and parsed by the engine
         :param PyV8.JSContext ctx: current JS context
         :param mixed obj: object for convert
         """
-        if isinstance(obj, (list, tuple)):
+        if isinstance(obj, (list, tuple, dict)):
+            try:
+                obj_json = json.dumps(obj, allow_nan=False)
+            except (TypeError, ValueError):
+                pass
+            else:
+                return ctx.locals['JSON'].parse(obj_json)
+        return self._get_js_obj_slow(ctx, obj)
+
+    def _get_js_obj_slow(self, ctx, obj):
+        """
+        Convert Python object to JS object item by item
+        """
+        if binary.is_binary(obj):
+            return ctx.eval(binary.js_expression(obj))
+        elif isinstance(obj, (list, tuple)):
             js_list = []
             for entry in obj:
-                js_list.append(self._get_js_obj(ctx, entry))
+                js_list.append(self._get_js_obj_slow(ctx, entry))
             return PyV8.JSArray(js_list)
         elif isinstance(obj, dict):
             js_obj = ctx.eval('new Object();')
             for key in obj.keys():
                 try:
-                    js_obj[key] = self._get_js_obj(ctx, obj[key])
+                    js_obj[key] = self._get_js_obj_slow(ctx, obj[key])
                 except Exception as e:
                     if (not str(e).startswith('Python argument types in')):
                         raise
                     import unicodedata
                     nkey = unicodedata.normalize(
                         'NFKD', key).encode('ascii', 'ignore')
-                    js_obj[nkey] = self._get_js_obj(ctx, obj[key])
+                    js_obj[nkey] = self._get_js_obj_slow(ctx, obj[key])
             return js_obj
         else:
             return obj
 
-    def _get_py_obj(self, ctx, obj, route=[]):
+    def _get_py_obj(self, ctx, obj):
         """
-        Convert JS object to Python object and return it
+        Convert JS object to Python object and return it, objects of
+            JSON types are serialized by the engine and parsed at once
         :param PyV8.JSContext ctx: current JS context
         :param mixed obj: object for convert
-        :param list route: key list for lookup
-            in iterable objects (internal usage)
+
+        :raise JSConversionException: the object is cyclic or too deep
+        """
+        if isinstance(obj, (PyV8.JSArray, PyV8.JSObject)):
+            obj_json = ctx.locals['__runjs_to_json'](obj, self.json_max_depth)
+            if obj_json is not None:
+                if isinstance(obj_json, bytes):
+                    obj_json = obj_json.decode('utf-8')
+                else:
+                    obj_json = str(obj_json)
+                if obj_json[0] == 'J':
+                    return json.loads(obj_json[1:])
+                elif obj_json[0] == 'K':
+                    return json.loads(
+                        obj_json[1:], object_pairs_hook=_index_keys_dict)
+                raise JSConversionException('Can not convert cyclic object')
+        return self._get_py_obj_slow(obj)
+
+    def _get_py_obj_slow(self, obj):
+        """
+        Convert JS object to Python object without recursion
+        :param mixed obj: object for convert
         """
         def access(obj, key):
             if key in obj:
                 return obj[key]
             return None
 
-        cloned = None
-        if isinstance(obj, (list, tuple, PyV8.JSArray)):
-            cloned = []
-            num_elements = len(obj)
-            for index in range(num_elements):
-                elem = obj[index]
-                cloned.append(self._get_py_obj(ctx, elem, route + [index]))
-        elif isinstance(obj, (dict, PyV8.JSObject)):
-            cloned = {}
-            for key in obj.keys():
-                cloned_val = None
-                if type(key) == int:
-                    val = None
-                    try:
-                        val = access(obj, str(key))
-                    except KeyError:
-                        pass
-                    if val is None:
+        root = [None]
+        # JS value, container of the converted value, key, depth
+        stack = [(obj, root, 0, 0)]
+        while stack:
+            obj, parent, parent_key, depth = stack.pop()
+            is_array = isinstance(obj, (list, tuple, PyV8.JSArray))
+            if is_array or isinstance(obj, (dict, PyV8.JSObject)):
+                if depth >= self.max_depth:
+                    raise JSConversionException(
+                        'Can not convert object nested deeper than %d '
+                        'levels (cyclic?)' % self.max_depth)
+            if is_array:
+                num_elements = len(obj)
+                cloned = [None] * num_elements
+                for index in range(num_elements):
+                    stack.append((obj[index], cloned, index, depth + 1))
+            elif isinstance(obj, (dict, PyV8.JSObject)):
+                cloned = {}
+                for key in obj.keys():
+                    if type(key) == int:
+                        val = None
+                        try:
+                            val = access(obj, str(key))
+                        except KeyError:
+                            pass
+                        if val is None:
+                            val = access(obj, key)
+                    else:
                         val = access(obj, key)
-                    cloned_val = self._get_py_obj(ctx, val, route + [key])
-                else:
-                    cloned_val = self._get_py_obj(
-                        ctx, access(obj, key), route + [key])
-                cloned[key] = cloned_val
-        elif isinstance(obj, (str, bytes)):
-            cloned = obj.decode('utf-8')
-        else:
-            cloned = obj
-        return cloned
+                    cloned[key] = None  # keeps the order of the keys
+                    stack.append((val, cloned, key, depth + 1))
+            elif isinstance(obj, bytes):
+                cloned = obj.decode('utf-8')
+            else:
+                cloned = obj
+            parent[parent_key] = cloned
+        return root[0]
+
+
+def _index_keys_dict(pairs):
+    """
+    Return dict of JSON object pairs with array index keys as `int`,
+        as PyV8 returns them
+    """
+    return dict(
+        (int(k) if k.isascii() and k.isdigit() and (
+            k == '0' or k[0] != '0') and int(k) < 4294967295 else k, v)
+        for k, v in pairs)
@@ -1,15 +1,46 @@
+import functools
 import json
 
-from runjs.backends.exceptions import JSRuntimeException
+from runjs.backends.exceptions import (
+    JSLoadError, JSRuntimeException, JSTimeoutError)
 
 try:
     import pyv8
     from pyv8 import *
-
-    V8Initializer.get_instance()
 except ImportError:
     pass
-from runjs.backends.abstract import AbstractBackend
+from runjs.backends import binary
+from runjs.backends.abstract import (
+    JS_HELPERS, AbstractBackend, call_with_deadline)
+from runjs.backends.libcache import library_cache
+from runjs.backends.metrics import NULL_CALL_METRICS
+
+_v8_initialized = False
+
+
+def _new_instance():
+    """
+    Return new V8 instance, V8 is initialized by the first call instead
+        of the module import
+    """
+    global _v8_initialized
+    if not _v8_initialized:
+        V8Initializer.get_instance()
+        _v8_initialized = True
+    instance = V8Instance()
+    instance.run("var global = new Function('return this;')();")
+    return instance
+
+
+def _load(instance, code):
+    """
+    Run code of the libraries in the V8 instance and return its result
+    :raise JSLoadError: the code fails
+    """
+    try:
+        return instance.run(code)
+    except pyv8.V8Error as err:
+        raise JSLoadError(str(err), err.wrapped.traceback) from err
 
 
 class PyV8NewBackend(AbstractBackend):
@@ -19,46 +50,145 @@ class PyV8NewBackend(AbstractBackend):
     can_run_str = False
 
     def _get_js_obj(self, obj):
+        if binary.is_binary(obj):
+            return binary.js_expression(obj)
         if hasattr(obj, '__dict__'):
             obj = dict(obj)
         return json.dumps(obj)
 
-    def _run_unprotected(self, func=None, fargs=[]):
-        instance = V8Instance()
-        instance.run("var global = new Function('return this;')();")
-        code = ''
-        for k, v in self.js_global_vars.items():
-            code += f'var {k} = {self._get_js_obj(v)};\n'
+    def _run_unprotected(self, func=None, fargs=[],
+                         metrics=NULL_CALL_METRICS):
+        call_code = None
+        if func:
+            args = ','.join(map(self._get_js_obj, fargs if fargs else []))
+            call_code = f'__runjs_binary_result({func}({args}));\n'
+            metrics.mark('args')
+            if metrics.enabled:
+                metrics.args_bytes = len(args)
+            return binary.from_marker(self._run_code(call_code, metrics))
+        return self._run_code(call_code, metrics)
+
+    def _run_code(self, call_code=None, metrics=NULL_CALL_METRICS):
+        """
+        Run JS code with libraries followed by `call_code`
+            and return its result
+        """
+        if self.persistent:
+            return self._run_persistent(call_code, metrics)
+
+        instance = _new_instance()
+        code = JS_HELPERS
+        for k, v in self.get_global_vars_json().items():
+            code += f'var {k} = {binary.js_value(v)};\n'
+        metrics.mark('globals')
 
         for lib in self.js_libs:
-            with open(lib) as f:
-                code += f.read()
+            code += library_cache.read(lib)
 
         for lib in self.js_libs_code.values():
             code += lib
+        # The main code is run with the libraries (`js_libs_code`),
+        # before the call
+        result = _load(instance, code)
+        metrics.mark('libs')
 
-        if func:
-            code += f'{func}({",".join(map(self._get_js_obj, fargs))});\n'
-            code += self.js_code
-            ret = instance.run(code)
-        return ret
+        if call_code:
+            result = instance.run(call_code)
+            metrics.mark('execute')
+        return result
 
+    def _run_persistent(self, call_code=None, metrics=NULL_CALL_METRICS):
+        """
+        Run `call_code` in the warm V8 instance, the libraries are
+        evaluated only on the first call
+        """
+        self._recycle_context()
+        if self.js_context is None:
+            instance = _new_instance()
+            code = JS_HELPERS
+            for k, v in self.get_global_vars_json().items():
+                code += f'global[{json.dumps(k)}] = {binary.js_value(v)};\n'
+
+            for lib in self.js_libs:
+                code += library_cache.read(lib)
+
+            for lib in self.js_libs_code.values():
+                code += lib
+
+            self.js_context_result = _load(instance, code)
+            self.js_context = instance
+            self._global_vars_changes()
+            metrics.mark('libs')
+        else:
+            code = ''
+            js_vars, deleted = self._global_vars_changes()
+            for k in deleted:
+                code += f'delete global[{json.dumps(k)}];\n'
+            for k, v in js_vars:
+                code += f'global[{json.dumps(k)}] = {binary.js_value(v)};\n'
+            if code:
+                self.js_context.run(code)
+            metrics.mark('globals')
+
+        if not call_code:
+            return self.js_context_result
+        result = self.js_context.run(call_code)
+        metrics.mark('execute')
+        return result
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Call JS function for every list of arguments of the chunk
+            inside one V8 instance
+        """
+        chunk_js = ','.join(
+            '[%s]' % ','.join(map(self._get_js_obj, fargs)) for fargs in chunk)
+        try:
+            items = call_with_deadline(
+                timeout, self._run_code,
+                f'__runjs_batch({json.dumps(func)}, [{chunk_js}]);\n')
+        except JSTimeoutError:
+            self.reset()
+            raise
+        except pyv8.V8Error as err:
+            raise JSRuntimeException(str(err), err.wrapped.traceback) from err
+        return self._batch_results(binary.loads(items))
 
-    def run(self, func=None, fargs=None):
+    def run(self, func=None, fargs=None, cache=False, timeout=None):
         """
         run js code with libraries and return result as
             python type
 
         :param str func: (optional) js function name
         :param list fargs: (optional) list of js function args
+        :param bool cache: (optional) if true, then the result is
+            memoized in the result cache (see `cache_function()`)
+        :param float timeout: (optional) deadline of the call in seconds,
+            the call is abandoned in its thread when it passes (see
+            `call_with_deadline()`)
 
         :raise JSRuntimeException: js runtime error
+        :raise JSTimeoutError: the deadline has passed
         :raise RuntimeError
         """
 
-        try:
-            return self._run_unprotected(func, fargs)
-        except IOError as err:
-            raise RuntimeError from IOError
-        except pyv8.V8Error as err:
-            raise JSRuntimeException(str(err), err.wrapped.traceback) from err
+        run = functools.partial(
+            self._run_uncached, timeout=self._call_timeout(timeout))
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(func, fargs, run)
+        return run(func, fargs)
+
+    def _run_uncached(self, func=None, fargs=None, timeout=None):
+        with self._call_metrics(func) as metrics:
+            try:
+                return call_with_deadline(
+                    timeout, self._run_unprotected, func, fargs, metrics)
+            except JSTimeoutError:
+                # The abandoned call still owns the warm instance
+                self.reset()
+                raise
+            except IOError as err:
+                raise RuntimeError from IOError
+            except pyv8.V8Error as err:
+                raise JSRuntimeException(
+                    str(err), err.wrapped.traceback) from err
@@ -0,0 +1,297 @@
+# -*- coding: utf-8 -*-
+"""
+Recycling of long-lived engines (Node.js workers, engine processes and
+warm contexts) which slowly accumulate heap of leaky scripts: an engine
+is replaced after `max_calls` calls, when its resident memory (sampled
+every `check_interval` calls from `/proc`) exceeds `max_memory` or when
+it has been idle for `idle_timeout` seconds.
+
+Engines of the pools are replaced in the background: the retired engine
+keeps serving calls until its replacement is started and warm.
+"""
+import logging
+import os
+import threading
+import time
+import weakref
+
+from collections import OrderedDict
+
+from .exceptions import ArgumentError
+from .metrics import recycle_metrics
+
+__all__ = ['RecyclePolicy', 'RecyclingPool', 'process_rss', ]
+
+try:
+    _PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def process_rss(pid):
+    """
+    Return resident memory of the process in bytes, `None` when it can
+        not be read cheaply (no `/proc`)
+    :param int pid: process id
+    :rtype: int
+    """
+    try:
+        with open('/proc/%d/statm' % pid, 'rb') as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class RecyclePolicy(object):
+    """
+    When a long-lived engine is replaced by a fresh one, counts the
+    recycled engines by backend and reason ('calls', 'memory', 'idle')
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_calls=None, max_memory=None, idle_timeout=None,
+                 check_interval=100):
+        """
+        :param int max_calls: (optional) calls served by an engine
+        :param float max_memory: (optional) megabytes of resident memory
+            of an engine process
+        :param float idle_timeout: (optional) seconds without calls after
+            which an engine which has served calls is replaced
+        :param int check_interval: (optional) calls between samples of
+            the memory
+        """
+        if check_interval < 1:
+            err = 'The `check_interval` argument must be positive'
+            self.logger.error(err)
+            raise ArgumentError(err)
+        self.max_calls = max_calls
+        self.max_memory = max_memory
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self.counts = OrderedDict()  # (backend, reason): count
+        self.lock = threading.Lock()
+
+    @classmethod
+    def create(cls, value):
+        """
+        Return policy of the `recycle` backend argument: `RecyclePolicy`,
+            dict of its arguments or `None`
+        :rtype: RecyclePolicy
+        :raise ArgumentError: invalid value
+        """
+        if value is None or isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            return cls(**value)
+        err = 'The `recycle` argument must be RecyclePolicy or dict'
+        cls.logger.error(err)
+        raise ArgumentError(err)
+
+    def options(self):
+        """
+        Return the arguments of the policy, equal options recycle engines
+            the same way
+        :rtype: tuple
+        """
+        return (self.max_calls, self.max_memory, self.idle_timeout,
+                self.check_interval)
+
+    def reason(self, calls, pid=None):
+        """
+        Return reason to recycle the engine after its call or `None`
+        :param int calls: calls served by the engine
+        :param int pid: (optional) process id of the engine, the memory
+            of in-process engines is not sampled
+        :rtype: str
+        """
+        if self.max_calls and calls >= self.max_calls:
+            return 'calls'
+        if (self.max_memory and pid is not None and
+                calls % self.check_interval == 0):
+            rss = process_rss(pid)
+            if rss is not None and rss > self.max_memory * 2 ** 20:
+                return 'memory'
+        return None
+
+    def idle(self, calls, last_used, now=None):
+        """
+        Return true if the engine which has served calls is idle for
+            longer than `idle_timeout`
+        :rtype: bool
+        """
+        if not self.idle_timeout or not calls:
+            return False
+        now = time.monotonic() if now is None else now
+        return now - last_used > self.idle_timeout
+
+    def record(self, backend, reason, sink=None):
+        """
+        Count the recycled engine and pass it to the metrics sink
+        :param str backend: backend name
+        :param str reason: recycling reason
+        :param MetricsSink sink: (optional) sink of the backend
+        """
+        with self.lock:
+            key = (backend, reason)
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.logger.info('Recycled %s engine (%s)', backend, reason)
+        recycle_metrics(sink, backend, reason)
+
+    def stats(self):
+        """
+        Return counts of the recycled engines
+        :rtype: list
+        """
+        with self.lock:
+            return [
+                OrderedDict((('backend', backend), ('reason', reason),
+                             ('count', count)))
+                for (backend, reason), count in self.counts.items()]
+
+
+def _reap_idle(pool_ref, interval):
+    """
+    Recycle idle engines of the pool until it is closed or collected
+    """
+    while True:
+        time.sleep(interval)
+        pool = pool_ref()
+        if pool is None or pool.closed:
+            return
+        pool._recycle_idle()
+        del pool
+
+
+class RecyclingPool(object):
+    """
+    Pool of long-lived engines recycled by a `RecyclePolicy`, a call
+    checks out the idle engine used last. A retired engine keeps serving
+    calls while its replacement starts in a background thread, then they
+    are swapped, so recycling does not delay calls.
+
+    Engines have `start()`, `stop()`, `alive`, `pid`, `calls` and
+    `last_used`, subclasses implement `_new_engine()`.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, engines, policy=None, name=None, sink=None):
+        """
+        :param list engines: engines of the pool
+        :param RecyclePolicy policy: (optional) recycling policy
+        :param str name: (optional) backend name of the metrics
+        :param MetricsSink sink: (optional) metrics sink of the backend
+        """
+        self.engines = list(engines)
+        self.idle = list(self.engines)
+        self.condition = threading.Condition()
+        self.policy = policy
+        self.name = name or type(self).__name__
+        self.sink = sink
+        self.replacing = set()  # ids of the engines being replaced
+        self.retired = set()  # ids of the replaced engines in a call
+        self.closed = False
+        if policy is not None and policy.idle_timeout:
+            threading.Thread(
+                target=_reap_idle, name='runjs-recycle', daemon=True,
+                args=(weakref.ref(self),
+                      min(max(policy.idle_timeout / 4.0, 0.05), 60.0)),
+            ).start()
+
+    def _new_engine(self, engine):
+        """
+        Return new (not started) engine replacing `engine`
+        """
+        raise NotImplementedError('Subclasses must override `_new_engine()`')
+
+    def _start_engine(self, engine):
+        """ Start the replacement, it must be ready to serve calls """
+        engine.start()
+
+    def _pick(self, *args):
+        """ Return the idle engine for the call """
+        return self.idle[-1]
+
+    def _acquire(self, *args):
+        with self.condition:
+            while not self.idle:
+                self.condition.wait()
+            engine = self._pick(*args)
+            self.idle.remove(engine)
+            return engine
+
+    def _release(self, engine):
+        reason = None
+        if self.policy is not None and engine.alive:
+            reason = self.policy.reason(engine.calls, engine.pid)
+        with self.condition:
+            retired = id(engine) in self.retired
+            if retired:
+                self.retired.discard(id(engine))
+            else:
+                self.idle.append(engine)
+                self.condition.notify()
+        if retired:
+            threading.Thread(target=engine.stop, daemon=True).start()
+        elif reason is not None:
+            self._recycle(engine, reason)
+
+    def _recycle(self, engine, reason):
+        """
+        Start replacement of the engine in a background thread
+        """
+        with self.condition:
+            if (self.closed or id(engine) in self.replacing or
+                    not any(item is engine for item in self.engines)):
+                return
+            self.replacing.add(id(engine))
+        threading.Thread(
+            target=self._replace, args=(engine, reason),
+            name='runjs-recycle', daemon=True).start()
+
+    def _replace(self, old, reason):
+        try:
+            new = self._new_engine(old)
+            self._start_engine(new)
+        except Exception:
+            self.logger.exception(
+                'Can not start replacement of %s engine', self.name)
+            with self.condition:
+                self.replacing.discard(id(old))
+            return
+        with self.condition:
+            self.replacing.discard(id(old))
+            index = next((i for i, item in enumerate(self.engines)
+                          if item is old), None)
+            if self.closed or index is None:
+                stale = new
+            else:
+                self.engines[index] = new
+                if any(item is old for item in self.idle):
+                    self.idle.remove(old)
+                    stale = old
+                else:
+                    # Stopped when its call is finished
+                    self.retired.add(id(old))
+                    stale = None
+                self.idle.append(new)
+                self.condition.notify()
+        if stale is not None:
+            stale.stop()
+        if stale is not new:
+            self.policy.record(self.name, reason, self.sink)
+
+    def _recycle_idle(self):
+        now = time.monotonic()
+        with self.condition:
+            engines = [engine for engine in self.idle if engine.alive and
+                       self.policy.idle(engine.calls, engine.last_used, now)]
+        for engine in engines:
+            self._recycle(engine, 'idle')
+
+    def close(self):
+        """ Stop all engines """
+        with self.condition:
+            self.closed = True
+            engines = list(self.engines)
+        for engine in engines:
+            engine.stop()
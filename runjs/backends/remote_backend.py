@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+"""
+Client of the runjs server (`python -m runjs.server`) which owns warm
+engines shared by many processes. Messages are frames of `binary.py`
+over a Unix socket: JSON with binary values moved to frame buffers and
+registered data passed as references to its file.
+
+Requests carry an "id" (responses may come in any order) and "op":
+    {"op": "open", "backend": ..., "js_code": ..., "js_libs_code": {...},
+     "options": {...}}
+    {"op": "run", "func": ..., "args": [...], "cache": false,
+     "timeout": null, "globals": {...}, "deleted": [...]}
+    {"op": "run_many", "func": ..., "batch": [[...], ...],
+     "chunk_size": 100, "globals": {...}, "deleted": [...]}
+    {"op": "reset"}, {"op": "stats"}
+Responses are {"id": 1, "result": ...} or {"id": 1, "error": {"type",
+"message", "traceback"}}, items of "run_many" results are {"result"} or
+{"error"}.
+"""
+import asyncio
+import functools
+import itertools
+import json
+import logging
+import os
+import os.path
+import socket
+import tempfile
+import threading
+
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from . import binary
+from .abstract import AbstractBackend
+from .exceptions import (
+    ArgumentError, JSConversionException, JSException, JSFunctionNotExists,
+    JSLoadError, JSRuntimeException, JSTimeoutError, PoolTimeout)
+from .shared_data import DATA_MARKER, DataHandle, shared_data
+
+__all__ = ['RemoteBackend', 'default_socket_path', 'encode_message',
+           'decode_message', 'error_message', 'remote_error', ]
+
+# Errors re-raised by the client as they were raised by the server
+_ERRORS = dict((cls.__name__, cls) for cls in (
+    ArgumentError, JSConversionException, JSException, JSFunctionNotExists,
+    JSTimeoutError, PoolTimeout))
+# Errors with the JS stack trace
+_RUNTIME_ERRORS = dict(
+    (cls.__name__, cls) for cls in (JSRuntimeException, JSLoadError))
+
+
+def default_socket_path():
+    """
+    Return path of the server socket: `RUNJS_SOCKET` environment
+        variable or a per-user socket in the temp directory
+    :rtype: str
+    """
+    return os.environ.get('RUNJS_SOCKET') or os.path.join(
+        tempfile.gettempdir(), 'runjs-%s.sock' % os.getuid())
+
+
+def encode_message(message):
+    """
+    Return chunks of the frame of the message, binary values are sent
+        as frame buffers and registered data as a reference to its file
+    :param dict message: message
+    :rtype: list
+    """
+    buffers = []
+
+    def default(obj):
+        if binary.is_binary(obj):
+            buffers.append(binary.byte_view(obj))
+            return binary.marker(obj, len(buffers) - 1)
+        if isinstance(obj, DataHandle):
+            return obj.ref()
+        if hasattr(obj, '__dict__'):
+            return dict(obj)
+        raise TypeError(
+            'Object of type %s is not JSON serializable' % type(obj).__name__)
+
+    return binary.encode_frame(binary.dumps(
+        message, buffers, default=default).encode(), buffers)
+
+
+def decode_message(data, buffers):
+    """
+    Return message of the frame (see `encode_message()`)
+    :param bytes data: JSON of the frame
+    :param list buffers: frame buffers
+    :rtype: dict
+    """
+    def object_hook(value):
+        if len(value) == 1:
+            if DATA_MARKER in value:
+                path, digest = value[DATA_MARKER]
+                return shared_data.from_file(digest, path)
+            # Binary value or escaped object
+            return binary.from_marker(value, buffers)
+        return value
+
+    return json.loads(data, object_hook=object_hook)
+
+
+def error_message(err):
+    """
+    Return error of the response for the exception
+    :rtype: dict
+    """
+    return {
+        'type': type(err).__name__,
+        'message': getattr(err, 'msg', None) or str(err),
+        'traceback': getattr(err, 'traceback', None),
+    }
+
+
+def remote_error(error):
+    """
+    Return exception for the error of the response
+    :rtype: JSException
+    """
+    cls = _RUNTIME_ERRORS.get(error['type'])
+    if cls is not None:
+        return cls(error['message'], error['traceback'])
+    cls = _ERRORS.get(error['type'])
+    if cls is None:
+        return JSException('%s: %s' % (error['type'], error['message']))
+    return cls(error['message'])
+
+
+class _Connection(object):
+    """
+    Connection of the process to the server, requests of all threads are
+    multiplexed over it and matched to responses by a reader thread
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, socket_path, connect_timeout=None):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(connect_timeout)
+        try:
+            self.sock.connect(socket_path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.settimeout(None)
+        self.stream = self.sock.makefile('rb')
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.futures = {}  # request id: Future
+        self.globals_version = 0  # global vars version seen by the server
+        self.closed = False
+        self.reader = threading.Thread(
+            target=self._read, name='runjs-remote', daemon=True)
+        self.reader.start()
+
+    def request(self, message, backend=None):
+        """
+        Send the request and return `Future` of its result, blocks while
+            the server does not read (backpressure)
+        :param dict message: request without id
+        :param AbstractBackend backend: (optional) owner of the global
+            variables, their changes are sent with the request
+        :rtype: Future
+        """
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise JSException('The connection to runjs server is closed')
+            message['id'] = request_id = next(self.ids)
+            if backend is not None:
+                version, changed, deleted = backend.global_vars_delta(
+                    self.globals_version, serialized=False)
+                message['globals'] = changed
+                message['deleted'] = deleted
+            frame = encode_message(message)
+            self.futures[request_id] = future
+            try:
+                self.sock.sendall(b''.join(frame))
+            except OSError as err:
+                self.futures.pop(request_id, None)
+                self._close()
+                raise JSException(
+                    'The connection to runjs server is lost: %s' % err)
+            if backend is not None:
+                self.globals_version = version
+        return future
+
+    def _read(self):
+        try:
+            while True:
+                data, buffers = binary.read_frame(self.stream)
+                if data is None:
+                    break
+                response = decode_message(data, buffers)
+                future = self.futures.pop(response['id'], None)
+                if future is None:
+                    continue
+                if 'error' in response:
+                    future.set_exception(remote_error(response['error']))
+                else:
+                    future.set_result(response.get('result'))
+        except (OSError, ValueError) as err:
+            if not self.closed:
+                self.logger.error('Can not read runjs server response: %s',
+                                  err)
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        if not self.closed:
+            self.closed = True
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self.sock.close()
+        futures, self.futures = self.futures, {}
+        for future in futures.values():
+            future.set_exception(
+                JSException('The connection to runjs server is lost'))
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+
+class RemoteBackend(AbstractBackend):
+    """
+    Backend running JS in the warm engines of the runjs server, shared
+    by all processes connected to it. Every process has its own
+    connection (made again after fork), global variables are sent only
+    when changed.
+    """
+    logger = logging.getLogger(__name__)
+    can_run_str = True  # library sources are sent to the server
+    connect_timeout = 5.0
+    open_timeout = 120.0  # the server may start engines for the code
+    timeout_grace = 1.0  # seconds to wait for the server after a deadline
+
+    def __init__(self, js_code='', js_libs=[], js_libs_code={},
+                 socket_path=None, remote_backend=None, backend_options=None,
+                 persistent=False, bundle=False, **kwargs):
+        """
+        Connect to the runjs server and open engines for the code
+        :param str js_code: (optional) JS code for run
+        :param list js_libs: (optional) paths to JS libraries code
+        :param dict js_libs_code: (optional) dict of JS libraries code
+        :param str socket_path: (optional) server socket, default is
+            `default_socket_path()`
+        :param str remote_backend: (optional) backend of the server
+            engines, default is the backend of the server
+        :param dict backend_options: (optional) options of the server
+            backend, ex: {'workers': 2}
+        :param bool persistent: (optional) warm contexts of the server
+            engines
+        :param bool bundle: (optional) bundle the libraries in the server
+        :raise JSException: the server is not available
+        """
+        super().__init__(js_code, js_libs, js_libs_code, **kwargs)
+        self.socket_path = socket_path or default_socket_path()
+        options = dict(backend_options or {})
+        options.setdefault('persistent', persistent)
+        options.setdefault('bundle', bundle)
+        self.open_message = {
+            'op': 'open',
+            'backend': remote_backend,
+            'js_code': js_code,
+            'js_libs_code': dict(
+                (k, v) for k, v in self.js_libs_code.items() if k != 'main'),
+            'options': options,
+        }
+        self.connection = None
+        self.connection_lock = threading.Lock()
+        self._connect()
+
+    def _result_cache_scope(self):
+        """ The results are converted by the backend of the server """
+        return '%s:%s' % (type(self).__name__, json.dumps(
+            [self.open_message['backend'], self.open_message['options']],
+            sort_keys=True, default=repr))
+
+    def _connect(self):
+        """
+        Return connection of the process, it is opened on the first call
+            and after fork or loss of the previous one
+        """
+        connection = self.connection
+        if (connection is not None and not connection.closed and
+                connection.pid == os.getpid()):
+            return connection
+        with self.connection_lock:
+            connection = self.connection
+            if (connection is not None and not connection.closed and
+                    connection.pid == os.getpid()):
+                return connection
+            try:
+                connection = _Connection(
+                    self.socket_path, self.connect_timeout)
+            except OSError as err:
+                err = 'Can not connect to runjs server at %s: %s' % (
+                    self.socket_path, err)
+                self.logger.error(err)
+                raise JSException(err)
+            self._wait(connection.request(dict(self.open_message)),
+                       self.open_timeout)
+            self.connection = connection
+            return connection
+
+    def _wait(self, future, timeout=None):
+        """
+        Return result of the request
+        :raise JSTimeoutError: no response in `timeout` seconds
+        """
+        try:
+            return future.result(timeout)
+        except FutureTimeoutError:
+            if future.done():
+                raise
+        raise JSTimeoutError('The runjs server did not respond in %ss'
+                             % timeout)
+
+    def _wait_timeout(self, timeout):
+        return None if timeout is None else timeout + self.timeout_grace
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        """
+        Run JS function in an engine of the server
+            (see `NodeJSBackend.run()`)
+
+        :param str func: (optional) JS function name
+        :param list fargs: (optional) list of JS function args
+        :param bool cache: (optional) memoize the result
+        :param float timeout: (optional) deadline of the call in seconds
+        """
+        run = functools.partial(
+            self._run_uncached, timeout=self._call_timeout(timeout))
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(func, fargs, run)
+        return run(func, fargs)
+
+    def _run_uncached(self, func=None, fargs=[], timeout=None):
+        with self._call_metrics(func) as metrics:
+            future = self._connect().request({
+                'op': 'run', 'func': func, 'args': list(fargs or []),
+                'timeout': timeout}, self)
+            metrics.mark('args')
+            result = self._wait(future, self._wait_timeout(timeout))
+            metrics.mark('execute')
+            return result
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Send the chunk to the server at once
+        """
+        items = self._wait(self._connect().request({
+            'op': 'run_many', 'func': func, 'batch': chunk,
+            'chunk_size': len(chunk), 'timeout': timeout}, self),
+            self._wait_timeout(timeout))
+        return [remote_error(item['error']) if 'error' in item
+                else item.get('result') for item in items]
+
+    async def arun(self, func=None, fargs=[], timeout=None):
+        """
+        Awaitable version of `run()`, requests are multiplexed over
+            the connection without threads
+        """
+        timeout = self._call_timeout(timeout)
+        future = self._connect().request({
+            'op': 'run', 'func': func, 'args': list(fargs or []),
+            'timeout': timeout}, self)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), self._wait_timeout(timeout))
+        except asyncio.TimeoutError as err:
+            raise JSTimeoutError(
+                'The JS call timed out after %ss' % timeout) from err
+
+    def stats(self):
+        """
+        Return statistics of the server
+        :rtype: dict
+        """
+        return self._wait(self._connect().request({'op': 'stats'}))
+
+    def reset(self):
+        """
+        Reset the server engines of the code
+        """
+        super().reset()
+        self._wait(self._connect().request({'op': 'reset'}))
+
+    def close(self):
+        """
+        Close the connection of the process
+        """
+        connection, self.connection = self.connection, None
+        if connection is not None and connection.pid == os.getpid():
+            connection.close()
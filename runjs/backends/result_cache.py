@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import logging
+import os
+import os.path
+import pickle
+import tempfile
+import threading
+import time
+
+from collections import OrderedDict
+
+__all__ = ['ResultCache', 'result_cache', ]
+
+_MISSING = object()
+
+
+class ResultCache(object):
+    """
+    Memoization cache of JS function results: LRU in memory with optional
+    TTL and size bound, and an optional on-disk tier shared by processes.
+    Results are stored pickled, so every hit returns a fresh copy.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, max_entries=10000, max_bytes=64 * 1024 * 1024,
+                 ttl=None, cache_dir=None):
+        """
+        :param int max_entries: (optional) max number of results in memory
+        :param int max_bytes: (optional) max total size of pickled results
+            in memory, a larger result is not cached in memory
+        :param float ttl: (optional) seconds a result is valid, `None`
+            keeps it until it is evicted
+        :param str cache_dir: (optional) directory of the on-disk tier,
+            `None` disables it
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.entries = OrderedDict()  # key: (expires or None, data)
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(*parts):
+        """
+        Return cache key of the parts (str or bytes)
+        :rtype: str
+        """
+        digest = hashlib.sha1()
+        for part in parts:
+            if isinstance(part, str):
+                part = part.encode('utf-8')
+            digest.update(b'%d:' % len(part))
+            digest.update(part)
+        return digest.hexdigest()
+
+    def get(self, key, default=None):
+        """
+        Return cached result or `default`
+        :param str key: `make_key()` result
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires, data = entry
+                if expires is None or expires > now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return pickle.loads(data)
+                self._remove(key)
+
+        entry = self._disk_get(key, now)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                return default
+            self.disk_hits += 1
+            self._store(key, *entry)
+        return pickle.loads(entry[1])
+
+    def set(self, key, value):
+        """
+        Cache the result
+        :param str key: `make_key()` result
+        :param value: picklable result
+        :return: true if the result is cached
+        """
+        try:
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            self.logger.debug('Result is not cached: %s', err)
+            return False
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            self._store(key, expires, data)
+        self._disk_set(key, expires, data)
+        return True
+
+    def _store(self, key, expires, data):
+        if len(data) > self.max_bytes:
+            return
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (expires, data)
+        self.size += len(data)
+        while (len(self.entries) > self.max_entries or
+               self.size > self.max_bytes):
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def _remove(self, key):
+        _, data = self.entries.pop(key)
+        self.size -= len(data)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _disk_get(self, key, now):
+        if self.cache_dir is None:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as cache_file:
+                expires, data = pickle.load(cache_file)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            self.logger.warning('Broken result cache file %s: %s', path, err)
+            return None
+        if expires is not None and expires <= now:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            return None
+        return expires, data
+
+    def _disk_set(self, key, expires, data):
+        if self.cache_dir is None:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as cache_file:
+                pickle.dump((expires, data), cache_file,
+                            pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as err:
+            self.logger.warning('Can not write result cache file: %s', err)
+
+    def clear(self, disk=False):
+        """
+        Forget all cached results
+        :param bool disk: (optional) if true, then delete the on-disk
+            tier files too
+        """
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+        if disk and self.cache_dir is not None:
+            for root, _, files in os.walk(self.cache_dir):
+                for name in files:
+                    try:
+                        os.unlink(os.path.join(root, name))
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """
+        Return cache statistics
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'size': self.size,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+result_cache = ResultCache()
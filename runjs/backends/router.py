@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+import logging
+import math
+import threading
+import time
+
+from collections import OrderedDict
+
+from . import get_backend
+from .abstract import AbstractBackend
+from .exceptions import (
+    ArgumentError, JSConversionException, JSException, JSFunctionNotExists,
+    JSLoadError, JSRuntimeException)
+
+__all__ = ['AutoBackend', ]
+
+
+class AutoBackend(AbstractBackend):
+    """
+    Router over the installed backends: latency of every backend is
+    measured per function and payload size class, and each call is routed
+    to the fastest one. A backend which can not be created or whose engine
+    fails is dropped. A call which fails because the backend can not load
+    the code or has no such function is retried on the next backend (ex: a
+    `module.exports` library which only Node.js can load), the function
+    has not run then. Other JS errors and invalid arguments are raised at
+    once.
+    """
+    logger = logging.getLogger(__name__)
+    backends = ('pyduk', 'pyv8_new', 'pyv8', 'nodejs')  # order of probes
+    probe_calls = 3  # measured calls of every backend before routing
+    explore_interval = 100  # every N-th call re-measures another backend
+    ewma_alpha = 0.3  # weight of the last latency in the average
+    # Errors retried on the next backend with `fallback=True`
+    fallback_errors = (JSRuntimeException, JSConversionException)
+    # Errors raised before the function runs, they are always retried on
+    # the next backend
+    definition_errors = (JSFunctionNotExists, JSLoadError)
+
+    def __init__(self, js_code='', js_libs=[], js_libs_code={},
+                 backends=None, backend_options=None, persistent=False,
+                 metrics=None, result_cache=None, timeout=None,
+                 bundle=False, recycle=None, fallback=False):
+        """
+        Create router, the backends are created at once and skipped
+            when they are not installed
+        :param str js_code: (optional) JS code for run
+        :param list js_libs: (optional) paths to JS libraries code
+        :param dict js_libs_code: (optional) dict of JS libraries code
+        :param list backends: (optional) names of the backends to route
+            to, default is `AutoBackend.backends`
+        :param dict backend_options: (optional) options of the backends
+            by name, ex: {'nodejs': {'workers': 2}}
+        :param bool persistent: (optional) warm contexts of the backends
+        :param MetricsSink metrics: (optional) receiver of the backend
+            call metrics
+        :param ResultCache result_cache: (optional) cache of the results
+        :param float timeout: (optional) default deadline of the calls
+        :param bool bundle: (optional) bundle the libraries of the backends
+        :param RecyclePolicy|dict recycle: (optional) recycling of the
+            long-lived engines of the backends
+        :param bool fallback: (optional) if true, then every JS error is
+            retried on the next backend, not only errors of loading the
+            code (the function may run several times)
+        :raise ArgumentError: no backend can be created
+        """
+        super().__init__(
+            js_code, js_libs, js_libs_code, persistent=persistent,
+            metrics=metrics, result_cache=result_cache, timeout=timeout)
+        backend_options = backend_options or {}
+        self.fallback = fallback
+        self.engines = OrderedDict()  # name: backend instance
+        self.unavailable = OrderedDict()  # name: reason
+        self.latencies = {}  # (func, size class): {name: (calls, seconds)}
+        self.calls = {}  # (func, size class): number of calls
+        self.errors = {}  # (func, name): JS errors fixed by other backends
+        self.lock = threading.Lock()
+        for name in (backends or self.backends):
+            options = dict(backend_options.get(name, {}))
+            options.setdefault('persistent', persistent)
+            options.setdefault('metrics', metrics)
+            options.setdefault('bundle', bundle)
+            options.setdefault('recycle', recycle)
+            try:
+                self.engines[name] = get_backend(name)(
+                    js_code, js_libs, js_libs_code, **options)
+            except Exception as err:
+                self._drop(name, err)
+        if not self.engines:
+            err = 'No backend is available: %s' % ', '.join(
+                '%s (%s)' % item for item in self.unavailable.items())
+            self.logger.error(err)
+            raise ArgumentError(err)
+
+        self.synced_versions = dict.fromkeys(self.engines, 0)
+
+    def _drop(self, name, err):
+        """ Stop routing to the backend which can not run JS code """
+        with self.lock:
+            engine = self.engines.pop(name, None)
+            self.unavailable[name] = '%s: %s' % (type(err).__name__, err)
+        self.logger.warning(
+            'Backend %s is not available: %s', name, self.unavailable[name])
+        if engine is not None and hasattr(engine, 'close'):
+            engine.close()
+
+    @staticmethod
+    def size_class(fargs):
+        """
+        Return payload size class of the arguments: log4 of the sum of
+            lengths of the sized arguments (1 for the others)
+        :rtype: int
+        """
+        size = 0
+        for arg in fargs or ():
+            try:
+                size += len(arg)
+            except TypeError:
+                size += 1
+        return int(math.log(size + 1, 4))
+
+    def _candidates(self, key):
+        """
+        Return backend names in order of routing for the key: backends
+            with too few measurements first, then the fastest one
+        """
+        with self.lock:
+            stats = self.latencies.setdefault(key, {})
+            calls = self.calls[key] = self.calls.get(key, 0) + 1
+            # Backends which can not run the function are tried last
+            names = [name for name in self.engines
+                     if (key[0], name) not in self.errors]
+            failed = [name for name in self.engines if name not in names]
+            probing = [name for name in names
+                       if stats.get(name, (0, 0.0))[0] < self.probe_calls]
+            if probing:
+                return probing + [
+                    name for name in names if name not in probing] + failed
+            ranked = sorted(names, key=lambda name: stats[name][1])
+            if calls % self.explore_interval == 0 and len(ranked) > 1:
+                # Re-measure the backend measured the longest time ago
+                stale = min(ranked[1:], key=lambda name: stats[name][0])
+                ranked.remove(stale)
+                ranked.insert(0, stale)
+            return ranked + failed
+
+    def _observe(self, key, name, seconds):
+        with self.lock:
+            stats = self.latencies.setdefault(key, {})
+            count, average = stats.get(name, (0, None))
+            if average is not None:
+                seconds += (1 - self.ewma_alpha) * (average - seconds)
+            stats[name] = (count + 1, seconds)
+
+    def _sync_global_vars(self, name, engine):
+        """
+        Apply changes of the global variables made since the previous
+            call of the backend
+        """
+        version, changed, deleted = self.global_vars_delta(
+            self.synced_versions[name], serialized=False)
+        if version == self.synced_versions[name]:
+            return
+        engine.delete_global_vars(
+            [k for k in deleted if k in engine.js_global_vars])
+        engine.set_global_vars(dict(changed))
+        self.synced_versions[name] = version
+
+    def _route(self, key, call, count=1):
+        """
+        Return `call(engine)` of the first backend which does not fail,
+            in order of routing for the key
+        :param tuple key: function name and size class
+        :param callable call: makes the call in the backend
+        :param int count: (optional) number of calls made by `call`
+        :raise JSException: error of the first backend if all of them
+            have failed with JS errors (the code is broken, not them)
+        """
+        first_error = None
+        failed = []
+        for name in self._candidates(key):
+            engine = self.engines.get(name)
+            if engine is None:
+                continue
+            self._sync_global_vars(name, engine)
+            started = time.perf_counter()
+            try:
+                result = call(engine)
+            except JSException as err:
+                if not (isinstance(err, self.definition_errors) or (
+                        self.fallback and isinstance(
+                            err, self.fallback_errors))):
+                    raise
+                failed.append(name)
+                if first_error is None:
+                    first_error = err
+                continue
+            except (TypeError, ValueError):
+                # Arguments which can not be converted, not the engine
+                raise
+            except Exception as err:
+                self._drop(name, err)
+                continue
+            self._observe(key, name, (time.perf_counter() - started) / count)
+            if failed:
+                with self.lock:
+                    for failed_name in failed:
+                        error_key = (key[0], failed_name)
+                        self.errors[error_key] = (
+                            self.errors.get(error_key, 0) + 1)
+            return result
+
+        if first_error is not None:
+            raise first_error
+        err = 'No backend is available: %s' % ', '.join(
+            '%s (%s)' % item for item in self.unavailable.items())
+        self.logger.error(err)
+        raise ArgumentError(err)
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        """
+        Run JS function in the fastest backend for the function and
+            the size of the arguments (see `NodeJSBackend.run()`)
+
+        :param str func: (optional) JS function name
+        :param list fargs: (optional) list of JS function args
+        :param bool cache: (optional) memoize the result
+        :param float timeout: (optional) deadline of the call in seconds
+        """
+        timeout = self._call_timeout(timeout)
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(
+                func, fargs, lambda func, fargs: self._run_routed(
+                    func, fargs, timeout))
+        return self._run_routed(func, fargs, timeout)
+
+    def _run_routed(self, func, fargs, timeout):
+        fargs = fargs or []
+        return self._route(
+            (func, self.size_class(fargs)),
+            lambda engine: engine.run(func, fargs, timeout=timeout))
+
+    def _run_chunk(self, func, chunk, timeout=None):
+        """
+        Send the chunk to the fastest backend for the function and size
+            of the first arguments, it is measured as its calls
+        """
+        return self._route(
+            (func, self.size_class(chunk[0])),
+            lambda engine: engine.run_many(
+                func, chunk, len(chunk), timeout=timeout),
+            len(chunk))
+
+    def stats(self):
+        """
+        Return measured latencies and errors by function, payload size
+            class and backend
+        :rtype: dict
+        """
+        with self.lock:
+            return {
+                'backends': list(self.engines),
+                'unavailable': dict(self.unavailable),
+                'latencies': [
+                    {'func': func, 'size_class': size_class,
+                     'backends': {
+                         name: {'calls': count,
+                                'latency_ms': round(average * 1000, 3)}
+                         for name, (count, average) in stats.items()}}
+                    for (func, size_class), stats in self.latencies.items()],
+                'errors': [
+                    {'func': func, 'backend': name, 'count': count}
+                    for (func, name), count in self.errors.items()],
+            }
+
+    def reset(self):
+        """ Reset every backend """
+        super().reset()
+        for engine in self.engines.values():
+            engine.reset()
+
+    def close(self):
+        """ Close every backend which has long-lived processes """
+        for engine in getattr(self, 'engines', {}).values():
+            if hasattr(engine, 'close'):
+                engine.close()
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import logging
+import os
+import os.path
+import threading
+import weakref
+
+from . import binary
+from .libcache import private_dir, write_file
+
+__all__ = ['DataHandle', 'SharedData', 'shared_data', ]
+
+# Marker of a data reference in the globals sent to Node.js workers
+DATA_MARKER = '__runjs_data__'
+
+
+class DataHandle(object):
+    """
+    Registered read-only value serialized to JSON once, versioned by
+    content hash and stored in a file for other processes. A handle is
+    pickled as its file, so worker processes read the file instead of
+    receiving the data over the pipe (every process parses its own copy).
+    """
+
+    def __init__(self, digest, path, value_json=None):
+        """
+        :param str digest: content hash of the JSON
+        :param str path: file with the JSON
+        :param str value_json: (optional) JSON, it is read from the file
+            on every use when not given
+        """
+        self.digest = digest
+        self.path = path
+        self._json = value_json
+
+    def __repr__(self):
+        return '<DataHandle %s %s>' % (self.digest[:12], self.path)
+
+    def __reduce__(self):
+        return _from_file, (self.digest, self.path)
+
+    def __eq__(self, other):
+        return isinstance(other, DataHandle) and other.digest == self.digest
+
+    def __hash__(self):
+        return hash(self.digest)
+
+    @property
+    def json(self):
+        """
+        JSON of the value, a handle of other process reads it from
+            the file on every use, so the process keeps only the copy of
+            the engine
+        :rtype: str
+        """
+        if self._json is not None:
+            return self._json
+        with open(self.path, encoding='utf-8') as data_file:
+            return data_file.read()
+
+    def ref(self):
+        """
+        Return reference to the file, the file is written again if it
+            was removed
+        :rtype: dict
+        """
+        if self._json is not None and not os.path.isfile(self.path):
+            # Removed by a cleaner of the temp directory
+            shared_data._write(self.digest, self._json)
+        return {DATA_MARKER: [self.path, self.digest]}
+
+    @property
+    def ref_json(self):
+        """
+        JSON of the reference to the file (see `include.js`)
+        :rtype: str
+        """
+        return json.dumps(self.ref())
+
+
+class SharedData(object):
+    """
+    Process-wide registry of the data registered by
+    `AbstractBackend.register_data()`: equal values are serialized once
+    and share a handle (and its JSON) across backend instances, the
+    file is written once per content hash.
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, data_dir=None):
+        """
+        :param str data_dir: (optional) directory of the data files, it
+            must be owned by the user and not writable by others, default
+            is a temporary directory of the process (removed at exit)
+        """
+        self.data_dir = data_dir
+        self.files_dir = None  # checked or created on the first use
+        # Handles alive in the process by content hash
+        self.handles = weakref.WeakValueDictionary()
+        self.lock = threading.Lock()
+
+    def register(self, value):
+        """
+        Return handle of the value, serialized to JSON once
+        :param value: JSON serializable value, binary value or `DataHandle`
+        :rtype: DataHandle
+        """
+        if isinstance(value, DataHandle):
+            return value
+        if binary.is_binary(value):
+            value_json = binary.marker_json(value)
+        else:
+            if hasattr(value, '__dict__'):
+                value = dict(value)
+            value_json = binary.dumps(value)
+        digest = hashlib.sha1(value_json.encode('utf-8')).hexdigest()
+        with self.lock:
+            handle = self.handles.get(digest)
+            if handle is not None and handle._json is not None:
+                return handle
+        path = self._write(digest, value_json)
+        with self.lock:
+            handle = self.handles.get(digest)
+            if handle is None or handle._json is None:
+                handle = DataHandle(digest, path, value_json)
+                self.handles[digest] = handle
+        return handle
+
+    def from_file(self, digest, path):
+        """
+        Return handle of the data file written by other process
+        :rtype: DataHandle
+        """
+        with self.lock:
+            handle = self.handles.get(digest)
+            if handle is None:
+                handle = self.handles[digest] = DataHandle(digest, path)
+        return handle
+
+    def _write(self, digest, value_json):
+        """
+        Write the JSON to the data file unless it already has it
+        :rtype: str
+        :return: path of the file
+        :raise OSError: `data_dir` is not a private directory of the user
+        """
+        with self.lock:
+            if self.files_dir is None:
+                self.files_dir = private_dir(self.data_dir, 'runjs-data-')
+        path = os.path.join(self.files_dir, digest + '.json')
+        if write_file(path, value_json):
+            self.logger.debug('Wrote shared data: %s', path)
+        return path
+
+
+shared_data = SharedData()
+
+
+def _from_file(digest, path):
+    # Unpickles a handle in other process
+    return shared_data.from_file(digest, path)
@@ -0,0 +1,518 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite of the backends
+
+Usage:
+    python -m runjs.bench [--backends nodejs,pyduk] [--json result.json]
+                          [--compare baseline.json]
+
+Every workload is run for every installed backend in three modes:
+    cold    - new backend instance per call (startup included)
+    warm    - one persistent backend, one call per `run()`
+    batched - one persistent backend, calls via `run_many()`
+Backends which are not installed are skipped. Import time of `runjs` and
+of every backend module (with its engine) is measured in new interpreters.
+"""
+import argparse
+import json
+import math
+import os
+import os.path
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+from collections import OrderedDict
+
+from .backends.jsonable import Jsonable
+from .wrapper import JSRunWrapper
+
+__all__ = ['BACKENDS', 'MODES', 'WORKLOADS', 'Workload', 'run_suite',
+           'compare', 'import_time', 'main', ]
+
+BACKENDS = ('nodejs', 'pyduk', 'pyv8', 'pyv8_new')
+MODES = ('cold', 'warm', 'batched')
+EXAMPLES_DIR = os.path.abspath(os.path.dirname(__file__) + '/../examples')
+
+
+class BenchNode(Jsonable):
+    """ Node of the Jsonable graph workload """
+    kind = 'node'
+
+    def __init__(self, value, children=()):
+        self.value = value
+        self.label = 'node-%s' % value
+        self.children = list(children)
+
+
+def _jsonable_tree(depth, width, counter=None):
+    counter = counter if counter is not None else [0]
+    counter[0] += 1
+    value = counter[0]
+    children = []
+    if depth > 0:
+        children = [_jsonable_tree(depth - 1, width, counter)
+                    for _ in range(width)]
+    return BenchNode(value, children)
+
+
+class Workload(object):
+    """ Benchmark workload: JS code and the call which is measured """
+
+    def __init__(self, name, func, fargs=None, js_code='', js_libs=None,
+                 global_vars=None, description=''):
+        """
+        :param str name: workload name
+        :param str func: JS function name
+        :param callable fargs: (optional) returns list of the arguments
+        :param str js_code: (optional) main JS code
+        :param callable js_libs: (optional) returns list of paths to JS
+            libraries or `None` if the libraries are not available
+        :param callable global_vars: (optional) returns dict of global
+            variables
+        :param str description: (optional) short description
+        """
+        self.name = name
+        self.func = func
+        self.fargs = fargs or (lambda: [])
+        self.js_code = js_code
+        self.js_libs = js_libs or (lambda: [])
+        self.global_vars = global_vars or (lambda: {})
+        self.description = description
+
+    def setup(self):
+        """
+        Prepare the data of the workload
+        :return: (js_libs, fargs, global_vars) or `None` if the workload
+            can not be run
+        """
+        js_libs = self.js_libs()
+        if js_libs is None:
+            return None
+        return js_libs, self.fargs(), self.global_vars()
+
+
+def _example_libs(*names):
+    def js_libs():
+        paths = [os.path.join(EXAMPLES_DIR, name) for name in names]
+        if all(os.path.isfile(path) for path in paths):
+            return paths
+        return None
+    return js_libs
+
+
+WORKLOADS = OrderedDict((w.name, w) for w in (
+    Workload(
+        'trivial', 'noop',
+        js_code='function noop() { return 1; }',
+        description='call without arguments'),
+    Workload(
+        'arithmetic', 'loop', lambda: [100000],
+        js_code='''
+            function loop(n) {
+                var s = 0;
+                for (var i = 0; i < n; i++) { s = (s + i * 7) % 1000003; }
+                return s;
+            }''',
+        description='arithmetic loop of 100000 iterations'),
+    Workload(
+        'large_list', 'sum', lambda: [list(range(10000))],
+        js_code='''
+            function sum(l) {
+                var s = 0;
+                for (var i = 0; i < l.length; i++) { s += l[i]; }
+                return s;
+            }''',
+        description='list of 10000 numbers argument'),
+    Workload(
+        'large_dict', 'count',
+        lambda: [dict(('key%d' % i, {'id': i, 'name': 'value%d' % i})
+                      for i in range(5000))],
+        js_code='function count(d) { return Object.keys(d).length; }',
+        description='dict of 5000 objects argument'),
+    Workload(
+        'binary', 'byte_sum', lambda: [bytes(range(256)) * 4096],
+        js_code='''
+            function byte_sum(b) {
+                var s = 0;
+                for (var i = 0; i < b.length; i++) { s += b[i]; }
+                return s;
+            }''',
+        description='1 MiB bytes argument (typed array)'),
+    Workload(
+        'big_globals', 'total',
+        js_code='''
+            function total() {
+                var s = 0;
+                for (var i = 0; i < big_list.length; i++) { s += big_list[i]; }
+                return s + Object.keys(big_dict).length;
+            }''',
+        global_vars=lambda: {
+            'big_list': list(range(50000)),
+            'big_dict': dict(('key%d' % i, i) for i in range(10000))},
+        description='global variables of 60000 items'),
+    Workload(
+        'jsonable', 'count_nodes', lambda: [_jsonable_tree(4, 5)],
+        js_code='''
+            function count_nodes(node) {
+                var n = 1;
+                for (var i = 0; i < node.children.length; i++) {
+                    n += count_nodes(node.children[i]);
+                }
+                return n;
+            }''',
+        description='Jsonable graph of 781 objects'),
+    Workload(
+        'cbor_libs', 'decode_cbor',
+        js_code='''
+            function decode_cbor() {
+                var data = 'jRgeGl9SAAQaAALMLBoAV++uGgA816oYZAEYGhgaGBsYPQYD';
+                return CBOR.decode(Base64Binary.decodeArrayBuffer(data));
+            }''',
+        js_libs=_example_libs('base64-binary.js', 'cbor.js'),
+        description='CBOR decoding with the example libraries'),
+))
+
+
+def percentile(samples, percent):
+    """
+    Return percentile of the samples (nearest rank)
+    :param list samples: sorted samples
+    :param float percent: percentile, 0..100
+    """
+    if not samples:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(samples))) - 1
+    return samples[min(max(rank, 0), len(samples) - 1)]
+
+
+def summarize(latencies, calls, elapsed):
+    """
+    Return statistics of the measured calls
+    :param list latencies: seconds per call
+    :param int calls: number of calls
+    :param float elapsed: total seconds
+    :rtype: OrderedDict
+    """
+    latencies = sorted(latencies)
+    ms = lambda value: None if value is None else round(value * 1000, 4)
+    return OrderedDict((
+        ('calls', calls),
+        ('p50_ms', ms(percentile(latencies, 50))),
+        ('p95_ms', ms(percentile(latencies, 95))),
+        ('p99_ms', ms(percentile(latencies, 99))),
+        ('mean_ms', ms(sum(latencies) / len(latencies))),
+        ('throughput', round(calls / elapsed, 2) if elapsed else None),
+    ))
+
+
+def peak_rss():
+    """
+    Return peak RSS in KiB of this process and of its finished children
+    (high-water marks of the whole run)
+    """
+    scale = 1024 if sys.platform == 'darwin' else 1  # bytes on macOS
+    return OrderedDict((
+        ('self_kib', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss //
+         scale),
+        ('children_kib',
+         resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss // scale),
+    ))
+
+
+def import_time(statement='import runjs', repeat=3):
+    """
+    Return seconds of the import statement in a new interpreter (best of
+        `repeat` runs), the interpreter startup is not included
+    :param str statement: (optional) Python import statement
+    :param int repeat: (optional) number of interpreters
+    :rtype: float
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        filter(None, (root, os.environ.get('PYTHONPATH')))))
+    code = ('import time\n'
+            'started = time.perf_counter()\n'
+            '%s\n'
+            'print(time.perf_counter() - started)\n' % statement)
+    return min(
+        float(subprocess.check_output(
+            [sys.executable, '-c', code], env=env,
+            stderr=subprocess.DEVNULL).split()[-1])
+        for _ in range(repeat))
+
+
+def _import_times(backends):
+    times = OrderedDict()
+    times['runjs'] = round(import_time() * 1000, 3)
+    for backend in backends:
+        times[backend] = round(import_time(
+            'from runjs.backends import get_backend\n'
+            'get_backend(%r)' % backend) * 1000, 3)
+    return times
+
+
+def _create(backend, workload, js_libs, global_vars, persistent):
+    js = JSRunWrapper.factory(
+        backend=backend, js_code=workload.js_code, js_libs=js_libs,
+        persistent=persistent)
+    if global_vars:
+        js.set_global_vars(global_vars)
+    return js
+
+
+def _close(js):
+    close = getattr(js, 'close', None)
+    if close is not None:
+        close()
+
+
+def _bench_cold(backend, workload, data, iterations, warmup, batch_size):
+    js_libs, fargs, global_vars = data
+    latencies = []
+    started = time.perf_counter()
+    for i in range(warmup + iterations):
+        call_started = time.perf_counter()
+        js = _create(backend, workload, js_libs, global_vars, False)
+        try:
+            js.run(func=workload.func, fargs=fargs)
+        finally:
+            _close(js)
+        if i == warmup - 1:
+            started = time.perf_counter()
+        elif i >= warmup:
+            latencies.append(time.perf_counter() - call_started)
+    return summarize(latencies, iterations, time.perf_counter() - started)
+
+
+def _bench_warm(backend, workload, data, iterations, warmup, batch_size):
+    js_libs, fargs, global_vars = data
+    js = _create(backend, workload, js_libs, global_vars, True)
+    try:
+        for _ in range(warmup):
+            js.run(func=workload.func, fargs=fargs)
+        latencies = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call_started = time.perf_counter()
+            js.run(func=workload.func, fargs=fargs)
+            latencies.append(time.perf_counter() - call_started)
+        elapsed = time.perf_counter() - started
+    finally:
+        _close(js)
+    return summarize(latencies, iterations, elapsed)
+
+
+def _bench_batched(backend, workload, data, iterations, warmup, batch_size):
+    js_libs, fargs, global_vars = data
+    js = _create(backend, workload, js_libs, global_vars, True)
+    try:
+        js.run_many(workload.func, [fargs] * max(warmup, 1), batch_size)
+        # Latency of a call is the time of its chunk divided by its size
+        latencies = []
+        started = time.perf_counter()
+        for offset in range(0, iterations, batch_size):
+            size = min(batch_size, iterations - offset)
+            chunk_started = time.perf_counter()
+            for result in js.run_many(workload.func, [fargs] * size, size):
+                if isinstance(result, Exception):
+                    raise result
+            latencies.extend(
+                [(time.perf_counter() - chunk_started) / size] * size)
+        elapsed = time.perf_counter() - started
+    finally:
+        _close(js)
+    return summarize(latencies, iterations, elapsed)
+
+
+_MODE_RUNNERS = {
+    'cold': _bench_cold,
+    'warm': _bench_warm,
+    'batched': _bench_batched,
+}
+
+
+def available_backends(backends=BACKENDS):
+    """
+    Return names of the backends which can run JS code
+    :param iterable backends: backend names to check
+    :return: (available names, {skipped name: reason})
+    """
+    available, skipped = [], OrderedDict()
+    for backend in backends:
+        try:
+            js = JSRunWrapper.factory(
+                backend=backend, js_code='function probe() { return 1; }')
+            try:
+                if js.run(func='probe') != 1:
+                    raise RuntimeError('unexpected result')
+            finally:
+                _close(js)
+        except Exception as e:
+            skipped[backend] = '%s: %s' % (type(e).__name__, e)
+        else:
+            available.append(backend)
+    return available, skipped
+
+
+def run_suite(backends=BACKENDS, workloads=None, modes=MODES,
+              iterations=200, cold_iterations=20, warmup=5, batch_size=50,
+              progress=None):
+    """
+    Run the benchmarks and return the report
+    :param iterable backends: (optional) backend names
+    :param iterable workloads: (optional) workload names, default is all
+    :param iterable modes: (optional) modes ('cold', 'warm', 'batched')
+    :param int iterations: (optional) measured calls of warm and batched
+        modes
+    :param int cold_iterations: (optional) measured calls of cold mode
+    :param int warmup: (optional) not measured calls before measuring
+    :param int batch_size: (optional) calls per `run_many()` chunk
+    :param callable progress: (optional) called with every result row
+    :rtype: OrderedDict
+    """
+    workloads = list(workloads or WORKLOADS)
+    for name in workloads:
+        if name not in WORKLOADS:
+            raise ValueError('Unknown workload: %s' % name)
+    for mode in modes:
+        if mode not in _MODE_RUNNERS:
+            raise ValueError('Unknown mode: %s' % mode)
+
+    available, skipped = available_backends(backends)
+    results = []
+    for backend in available:
+        for name in workloads:
+            workload = WORKLOADS[name]
+            data = workload.setup()
+            for mode in modes:
+                row = OrderedDict((
+                    ('backend', backend), ('workload', name),
+                    ('mode', mode)))
+                if data is None:
+                    row['skipped'] = 'workload data is not available'
+                else:
+                    count = cold_iterations if mode == 'cold' else iterations
+                    try:
+                        row.update(_MODE_RUNNERS[mode](
+                            backend, workload, data, count, warmup,
+                            batch_size))
+                    except Exception as e:
+                        row['error'] = '%s: %s' % (type(e).__name__, e)
+                    row['peak_rss'] = peak_rss()
+                results.append(row)
+                if progress is not None:
+                    progress(row)
+
+    return OrderedDict((
+        ('version', 1),
+        ('created', time.strftime('%Y-%m-%dT%H:%M:%S')),
+        ('python', platform.python_version()),
+        ('platform', platform.platform()),
+        ('settings', OrderedDict((
+            ('iterations', iterations), ('cold_iterations', cold_iterations),
+            ('warmup', warmup), ('batch_size', batch_size)))),
+        ('skipped_backends', skipped),
+        ('import_ms', _import_times(available)),
+        ('results', results),
+    ))
+
+
+def compare(report, baseline):
+    """
+    Compare two reports, return rows with p50 and throughput ratios
+        (current / baseline) of the cases present in both reports
+    :param dict report: current report
+    :param dict baseline: baseline report
+    :rtype: list
+    """
+    key = lambda row: (row['backend'], row['workload'], row['mode'])
+    base_rows = dict((key(row), row) for row in baseline['results'])
+    rows = []
+    for row in report['results']:
+        base = base_rows.get(key(row))
+        if base is None or 'p50_ms' not in row or 'p50_ms' not in base:
+            continue
+        ratio = lambda field: (
+            round(row[field] / base[field], 3) if base[field] else None)
+        rows.append(OrderedDict((
+            ('backend', row['backend']), ('workload', row['workload']),
+            ('mode', row['mode']),
+            ('p50_ms', row['p50_ms']), ('base_p50_ms', base['p50_ms']),
+            ('p50_ratio', ratio('p50_ms')),
+            ('throughput_ratio', ratio('throughput')),
+        )))
+    return rows
+
+
+def _format_row(row):
+    case = '%-9s %-12s %-8s' % (row['backend'], row['workload'], row['mode'])
+    if 'skipped' in row:
+        return '%s skipped: %s' % (case, row['skipped'])
+    if 'error' in row:
+        return '%s error: %s' % (case, row['error'])
+    return '%s p50 %9.3f  p95 %9.3f  p99 %9.3f ms  %10.1f calls/s' % (
+        case, row['p50_ms'], row['p95_ms'], row['p99_ms'], row['throughput'])
+
+
+def _split(value):
+    return [item for item in value.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m runjs.bench', description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--backends', type=_split, default=list(BACKENDS),
+        help='comma separated backends (default: %s)' % ','.join(BACKENDS))
+    parser.add_argument(
+        '--workloads', type=_split, default=list(WORKLOADS),
+        help='comma separated workloads (default: %s)' % ','.join(WORKLOADS))
+    parser.add_argument(
+        '--modes', type=_split, default=list(MODES),
+        help='comma separated modes (default: %s)' % ','.join(MODES))
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--cold-iterations', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument(
+        '--json', metavar='PATH', help="write JSON report ('-' for stdout)")
+    parser.add_argument(
+        '--compare', metavar='PATH', help='baseline JSON report')
+    args = parser.parse_args(argv)
+
+    log = sys.stderr if args.json == '-' else sys.stdout
+    report = run_suite(
+        args.backends, args.workloads, args.modes, args.iterations,
+        args.cold_iterations, args.warmup, args.batch_size,
+        progress=lambda row: print(_format_row(row), file=log, flush=True))
+    for backend, reason in report['skipped_backends'].items():
+        print('%-9s skipped: %s' % (backend, reason), file=log)
+    print('\nImport time: %s' % ', '.join(
+        '%s %.1f ms' % item for item in report['import_ms'].items()),
+        file=log)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            rows = compare(report, json.load(baseline_file))
+        report['compare'] = rows
+        print('\nCompared with %s (current / baseline):' % args.compare,
+              file=log)
+        for row in rows:
+            print('%-9s %-12s %-8s p50 x%-7s throughput x%s' % (
+                row['backend'], row['workload'], row['mode'],
+                row['p50_ratio'], row['throughput_ratio']), file=log)
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,398 @@
+// Helpers evaluated by runjs backends in the global scope of the JS engine
+
+// Call `func` (function or name of a global function or method) with `self`
+// as `this` for every list of arguments of `chunk` (array or its JSON) and
+// return JSON array of {"result": ...} or {"error": {"message", "stack"}},
+// binary results are passed through `encode` (default is
+// `__runjs_binary_result`)
+function __runjs_batch(func, chunk, self, encode) {
+    var fn = func,
+        parts = [],
+        result;
+
+    encode = encode || __runjs_binary_result;
+    if (typeof func === 'string') {
+        var dot = func.lastIndexOf('.');
+        self = dot > 0 ? (0, eval)(func.slice(0, dot)) : undefined;
+        fn = (0, eval)(func);
+    }
+    if (typeof chunk === 'string') {
+        chunk = __runjs_parse(chunk);
+    }
+    for (var i = 0; i < chunk.length; i++) {
+        try {
+            result = fn.apply(self, chunk[i]);
+            parts.push(__runjs_binary_type(result) === null ?
+                __runjs_stringify(
+                    {result: result === undefined ? null : result}) :
+                JSON.stringify({result: encode(result)}));
+        } catch (err) {
+            parts.push(JSON.stringify({error: __runjs_error(err)}));
+        }
+    }
+    return '[' + parts.join(',') + ']';
+}
+
+// Value of the global (or script scope) name, by direct eval, so functions
+// of a Node.js script run as a module are found too
+function __runjs_lookup(__runjs_name) {
+    return eval(__runjs_name);
+}
+
+// Call the steps [func, refs, chain] of a pipeline (see pipeline.py) in turn
+// with the arguments following `steps`: a ref is an index of the arguments
+// or [step] for the result of an earlier step, a chained step gets the
+// previous result as its first argument; intermediate results stay in the
+// engine and only the result of the last step is returned
+function __runjs_pipeline(steps) {
+    var args = Array.prototype.slice.call(arguments, 1),
+        results = [];
+
+    for (var i = 0; i < steps.length; i++) {
+        var func = steps[i][0],
+            refs = steps[i][1],
+            stepArgs = steps[i][2] && i ? [results[i - 1]] : [],
+            dot = func.lastIndexOf('.'),
+            self = dot > 0 ? __runjs_lookup(func.slice(0, dot)) : undefined,
+            fn = __runjs_lookup(func);
+        if (typeof fn !== 'function') {
+            throw new TypeError(
+                'Pipeline step ' + i + ': ' + func + ' is not a function');
+        }
+        for (var j = 0; j < refs.length; j++) {
+            stepArgs.push(typeof refs[j] === 'number' ?
+                args[refs[j]] : results[refs[j][0]]);
+        }
+        results.push(fn.apply(self, stepArgs));
+    }
+    return results[results.length - 1];
+}
+
+function __runjs_error(err) {
+    if (err instanceof Error) {
+        return {message: String(err.message), stack: String(err.stack)};
+    }
+    return {message: String(err), stack: String(err)};
+}
+
+// JSON of `value` prefixed by "J" ("K" if an object has array index keys)
+// when it holds only values converted to the same Python values as by
+// the engine bindings, "C" if it is cyclic, null if it has other values or
+// is nested deeper than `maxDepth`
+function __runjs_to_json(value, maxDepth) {
+    var ancestors = [],
+        indexKeys = false,
+        indexKey = /^(0|[1-9][0-9]*)$/,
+        objectProto = Object.prototype;
+
+    function plain(v, depth) {
+        switch (typeof v) {
+        case 'string':
+        case 'boolean':
+            return true;
+        case 'number':
+            // Integral numbers out of int32 and -0 are floats in Python
+            if (v === (v | 0)) {
+                return v !== 0 || 1 / v > 0;
+            }
+            return isFinite(v) && Math.floor(v) !== v;
+        case 'object':
+            break;
+        default:
+            return false;
+        }
+        if (v === null) {
+            return true;
+        }
+        if (depth > maxDepth) {
+            return false;
+        }
+        for (var a = 0; a < ancestors.length; a++) {
+            if (ancestors[a] === v) {
+                throw ancestors;
+            }
+        }
+        var isArray = Array.isArray(v),
+            keys,
+            i;
+        if (!isArray) {
+            var proto = Object.getPrototypeOf(v);
+            if ((proto !== objectProto && proto !== null) ||
+                    typeof v.toJSON === 'function') {
+                return false;
+            }
+        }
+        ancestors.push(v);
+        if (isArray) {
+            for (i = 0; i < v.length; i++) {
+                // holes and undefined are null in both conversions
+                if (v[i] !== undefined && !plain(v[i], depth + 1)) {
+                    return false;
+                }
+            }
+        } else {
+            keys = Object.keys(v);
+            for (i = 0; i < keys.length; i++) {
+                if (!indexKeys && indexKey.test(keys[i]) &&
+                        +keys[i] < 4294967295) {
+                    indexKeys = true;
+                }
+                if (!plain(v[keys[i]], depth + 1)) {
+                    return false;
+                }
+            }
+        }
+        ancestors.pop();
+        return true;
+    }
+
+    try {
+        if (!plain(value, 0)) {
+            return null;
+        }
+    } catch (err) {
+        if (err === ancestors) {
+            return 'C';
+        }
+        throw err;
+    }
+    return (indexKeys ? 'K' : 'J') + JSON.stringify(value);
+}
+
+// ==== Binary values, see runjs/backends/binary.py
+
+var __runjs_b64 =
+    'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/';
+var __runjs_b64_codes = {};
+for (var __runjs_i = 0; __runjs_i < 64; __runjs_i++) {
+    __runjs_b64_codes[__runjs_b64.charAt(__runjs_i)] = __runjs_i;
+}
+
+function __runjs_b64_decode(str) {
+    if (typeof Buffer !== 'undefined') {
+        return new Uint8Array(Buffer.from(str, 'base64'));
+    }
+    var len = str.length,
+        pad = len && str.charAt(len - 1) === '=' ?
+            (str.charAt(len - 2) === '=' ? 2 : 1) : 0,
+        bytes = new Uint8Array(len / 4 * 3 - pad),
+        codes = __runjs_b64_codes,
+        j = 0,
+        n;
+    for (var i = 0; i < len; i += 4) {
+        n = (codes[str.charAt(i)] << 18) | (codes[str.charAt(i + 1)] << 12) |
+            ((codes[str.charAt(i + 2)] || 0) << 6) |
+            (codes[str.charAt(i + 3)] || 0);
+        bytes[j++] = n >> 16;
+        if (j < bytes.length) bytes[j++] = (n >> 8) & 255;
+        if (j < bytes.length) bytes[j++] = n & 255;
+    }
+    return bytes;
+}
+
+function __runjs_b64_encode(bytes) {
+    if (typeof Buffer !== 'undefined') {
+        return Buffer.from(
+            bytes.buffer, bytes.byteOffset, bytes.length).toString('base64');
+    }
+    var chars = __runjs_b64,
+        parts = [],
+        len = bytes.length,
+        n;
+    for (var i = 0; i < len; i += 3) {
+        n = (bytes[i] << 16) | ((i + 1 < len ? bytes[i + 1] : 0) << 8) |
+            (i + 2 < len ? bytes[i + 2] : 0);
+        parts.push(
+            chars.charAt(n >> 18) + chars.charAt((n >> 12) & 63) +
+            (i + 1 < len ? chars.charAt((n >> 6) & 63) : '=') +
+            (i + 2 < len ? chars.charAt(n & 63) : '='));
+    }
+    return parts.join('');
+}
+
+// Typed arrays of the markers by name, created on the first use
+var __runjs_typed_arrays = null;
+
+function __runjs_typed_array(type) {
+    if (__runjs_typed_arrays === null) {
+        var names = ['Int8Array', 'Uint8Array', 'Uint8ClampedArray',
+                     'Int16Array', 'Uint16Array', 'Int32Array',
+                     'Uint32Array', 'Float32Array', 'Float64Array',
+                     'BigInt64Array', 'BigUint64Array'],
+            root = (function() { return this; })();
+        __runjs_typed_arrays = {};
+        for (var i = 0; i < names.length; i++) {
+            if (typeof root[names[i]] === 'function') {
+                __runjs_typed_arrays[names[i]] = root[names[i]];
+            }
+        }
+    }
+    if (!Object.prototype.hasOwnProperty.call(__runjs_typed_arrays, type)) {
+        throw new TypeError('Unknown typed array: ' + String(type));
+    }
+    return __runjs_typed_arrays[type];
+}
+
+// Typed array of `type` over `data` (base64 string or Uint8Array)
+function __runjs_binary(type, data) {
+    var Type = __runjs_typed_array(type),
+        bytes = typeof data === 'string' ? __runjs_b64_decode(data) : data;
+    if (Type === Uint8Array && bytes instanceof Uint8Array) {
+        return bytes;
+    }
+    if (bytes.byteOffset % Type.BYTES_PER_ELEMENT) {
+        bytes = new Uint8Array(bytes);  // aligned copy
+    }
+    return new Type(bytes.buffer, bytes.byteOffset,
+                    bytes.length / Type.BYTES_PER_ELEMENT);
+}
+
+// The only key of the object if it is a marker key or its escaped version
+// ({"__runjs_binary__~": ...}, see binary.py), else null
+function __runjs_marker_key(value) {
+    if (value === null || typeof value !== 'object' || Array.isArray(value)) {
+        return null;
+    }
+    var found = null;
+    for (var key in value) {
+        if (found !== null || !Object.prototype.hasOwnProperty.call(
+                value, key)) {
+            return null;
+        }
+        found = key;
+    }
+    if (found === null ||
+            !/^__runjs_(binary|data)__~*$/.test(found)) {
+        return null;
+    }
+    return found;
+}
+
+// Typed array of the marker {"__runjs_binary__": [type, data]}, the object
+// of an escaped marker key or the value
+function __runjs_decode(value) {
+    var key = __runjs_marker_key(value),
+        unescaped;
+    if (key === '__runjs_binary__') {
+        return __runjs_binary(value[key][0], value[key][1]);
+    }
+    if (key !== null && key.charAt(key.length - 1) === '~') {
+        unescaped = {};
+        unescaped[key.slice(0, -1)] = value[key];
+        return unescaped;
+    }
+    return value;
+}
+
+function __runjs_reviver(key, value) {
+    return __runjs_decode(value);
+}
+
+// Value of the JSON, with markers decoded by `__runjs_decode()`
+function __runjs_parse(data) {
+    if (data.indexOf('"__runjs_') < 0) {
+        return JSON.parse(data);
+    }
+    return JSON.parse(data, __runjs_reviver);
+}
+
+// Object with the only marker key is escaped, so it is not decoded as
+// a marker (see binary.py)
+function __runjs_escape(value) {
+    var key = __runjs_marker_key(value),
+        escaped;
+    if (key === null) {
+        return value;
+    }
+    escaped = {};
+    escaped[key + '~'] = value[key];
+    return escaped;
+}
+
+function __runjs_escaper(key, value) {
+    return __runjs_escape(value);
+}
+
+// JSON of the value decoded by `binary.loads()`, objects taken for
+// markers are escaped
+function __runjs_stringify(value) {
+    var data = JSON.stringify(value);
+    if (data === undefined || data.indexOf('"__runjs_') < 0) {
+        return data;
+    }
+    return JSON.stringify(value, __runjs_escaper);
+}
+
+// JSON of the result of a call (see `__runjs_binary_result()`)
+function __runjs_result_json(value) {
+    if (__runjs_binary_type(value) === null) {
+        return __runjs_stringify(value);
+    }
+    return JSON.stringify(__runjs_binary_result(value));
+}
+
+// Registered data of a worker frame, {"__runjs_data__": [path, digest]}
+// (see shared_data.py)
+function __runjs_data_ref(path) {
+    this.path = path;
+}
+
+// Value of the JSON of a worker frame (see binary.py), markers
+// {"__runjs_binary__": [type, index]} are typed arrays over the frame
+// `buffers`
+function __runjs_parse_frame(data, buffers) {
+    if (data.indexOf('"__runjs_') < 0) {
+        return JSON.parse(data);
+    }
+    return JSON.parse(data, function(key, value) {
+        var marker = __runjs_marker_key(value);
+        if (marker === '__runjs_binary__' &&
+                typeof value[marker][1] === 'number') {
+            return __runjs_binary(value[marker][0], buffers[value[marker][1]]);
+        }
+        if (marker === '__runjs_data__') {
+            return new __runjs_data_ref(value[marker][0]);
+        }
+        return __runjs_decode(value);
+    });
+}
+
+// Also true for an ArrayBuffer of other realm (vm context)
+function __runjs_is_array_buffer(value) {
+    return Object.prototype.toString.call(value) === '[object ArrayBuffer]';
+}
+
+// Name of the typed array of the binary value or null
+function __runjs_binary_type(value) {
+    if (value === null || typeof value !== 'object' ||
+            typeof ArrayBuffer === 'undefined') {
+        return null;
+    }
+    if (__runjs_is_array_buffer(value)) {
+        return 'ArrayBuffer';
+    }
+    if (ArrayBuffer.isView && ArrayBuffer.isView(value)) {
+        var type = Object.prototype.toString.call(value).slice(8, -1);
+        return type === 'DataView' ? 'Uint8Array' : type;
+    }
+    return null;
+}
+
+// Uint8Array of the bytes of the binary value
+function __runjs_bytes(value) {
+    if (__runjs_is_array_buffer(value)) {
+        return new Uint8Array(value);
+    }
+    return new Uint8Array(value.buffer, value.byteOffset, value.byteLength);
+}
+
+// Marker with base64 of the binary value or the value, the object with
+// the only marker key is escaped (the engine bindings convert the result,
+// only the result itself is decoded by `binary.from_marker()`)
+function __runjs_binary_result(value) {
+    var type = __runjs_binary_type(value);
+    if (type === null) {
+        return __runjs_escape(value);
+    }
+    return {__runjs_binary__: [type, __runjs_b64_encode(__runjs_bytes(value))]};
+}
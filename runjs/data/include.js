@@ -11,6 +11,93 @@ global.include = function(fileName) {
     included_files_[fileName] = true;
 };
 
+// Run the module function `fn` of the library (its source wrapped by
+// `Module.wrap()`) as a Node.js module and copy its exports to `realm`
+// (default is the global object)
+global.__runjs_include_module = function(fileName, fn, realm) {
+    var Module = require('module'),
+        path = require('path'),
+        mod = new Module(fileName, module),
+        modRequire = function(id) { return mod.require(id); };
+    mod.filename = fileName;
+    mod.paths = Module._nodeModulePaths(path.dirname(fileName));
+    modRequire.resolve = function(request) {
+        return Module._resolveFilename(request, mod);
+    };
+    modRequire.cache = Module._cache;
+    fn.call(mod.exports, mod.exports, modRequire, mod, fileName,
+            path.dirname(fileName));
+    mod.loaded = true;
+    realm = realm || global;
+    var ev = mod.exports;
+    for (var prop in ev) {
+        realm[prop] = ev[prop];
+    }
+    included_files_[fileName] = true;
+};
+
+// Same as include(), but the module source is passed from memory
+global.include_source = function(fileName, source) {
+    var Module = require('module'),
+        vm = require('vm');
+    __runjs_include_module(fileName, vm.runInThisContext(
+        Module.wrap(source), {filename: fileName}));
+};
+
+// Compile the source with V8 code cache `cacheDir/<digest>-<node>.bin`,
+// the cache is (re)written after the first run, when it is missing or
+// rejected, so later processes skip parsing and compiling
+global.compile_cached = function(source, fileName, cacheDir, digest) {
+    var vm = require('vm'),
+        path = require('path'),
+        cacheFile = path.join(cacheDir, digest + '-' + process.version +
+                              '-' + process.arch + '.bin'),
+        cachedData;
+    try {
+        cachedData = fs.readFileSync(cacheFile);
+    } catch (err) {
+        cachedData = undefined;
+    }
+    var script = new vm.Script(
+        source, {filename: fileName, cachedData: cachedData});
+    script.saveCache = function() {
+        if (cachedData !== undefined && !script.cachedDataRejected) {
+            return;
+        }
+        try {
+            var tmpFile = cacheFile + '.' + process.pid + '.tmp';
+            fs.mkdirSync(cacheDir, {recursive: true, mode: 0o700});
+            fs.writeFileSync(tmpFile, script.createCachedData());
+            fs.renameSync(tmpFile, cacheFile);
+        } catch (err) {
+            // The cache is an optimization only
+        }
+    };
+    return script;
+};
+
+// Same as include_source(), but compiled with V8 code cache
+global.include_cached = function(fileName, source, cacheDir, digest) {
+    var Module = require('module'),
+        script = compile_cached(
+            Module.wrap(source), fileName, cacheDir, digest);
+    __runjs_include_module(fileName, script.runInThisContext());
+    // Created after the run, so lazily compiled functions are included
+    script.saveCache();
+};
+
+// Same as include(), but for a library of a bundle (see bundle.py):
+// `fn` is the module function of the library with its original name
+global.include_bundled = function(fileName, fn) {
+    __runjs_include_module(fileName, fn);
+};
+
+// Value of the data registered by `register_data()` (see shared_data.py),
+// parsed from its file instead of being sent with the script or request
+global.__runjs_load_data = function(fileName) {
+    return __runjs_parse(fs.readFileSync(fileName, 'utf8'));
+};
+
 global.include_once = function(fileName) {
     if (!included_files_[fileName]) {
         include(fileName);
@@ -0,0 +1,390 @@
+// Long-lived worker for NodeJSBackend.
+//
+// Usage: node worker.js <response fd>
+//
+// Messages in both directions are frames (see runjs/backends/binary.py):
+//     <uint32 JSON length> <uint32 buffers count> <uint32 buffer length>...
+//     <JSON> <buffer>...
+// Binary values are {"__runjs_binary__": [type, buffer index]} markers
+// (or [type, base64] in global variables), objects of user data with
+// the only key of a marker are escaped (see binary.py).
+//
+// The first frame read from stdin is the configuration:
+//     {"include": "/path/to/include.js", "code": "...",
+//      "libs": [{"name": "/path/to/lib.js", "source": "..."}, ...],
+//      "globals": "<JSON of the global variables>"}
+// (without "source" the library is included from the file, the globals
+// are set before the libraries and the code are run), with
+// "cacheDir" the libraries ("digest" of their sources) and the code
+// ("codeDigest") are compiled with V8 code cache
+// Every next frame is a request with changes of the global variables
+// since the previous request:
+//     {"id": 1, "func": "name", "args": [...], "globals": {...},
+//      "deleted": [...]}
+// (data registered by `register_data()` is {"__runjs_data__": [path,
+// digest]} in the globals and is parsed from the file),
+// or a batch request with a list of argument lists:
+//     {"id": 1, "func": "name", "batch": [[...], ...], "globals": {...},
+//      "deleted": [...]}
+// Responses are written as frames to the response fd:
+//     {"id": 1, "result": ...} or {"id": 1, "error": {"message", "stack"}}
+//     {"id": 1, "results": [{"result": ...}, {"error": ...}, ...]}
+//
+// With "tenants" in the configuration:
+//     {"include": "...", "tenants": {"maxContexts": 100,
+//      "memoryBudget": <bytes of JS heap or null>}}
+// the worker hosts the code of many backends, each in its own vm context.
+// A context is loaded by
+//     {"load": "<context key>", "id": 1, "code": "...", "libs": [...],
+//      "globals": "<JSON of the global variables>"}
+// and the requests start with its key (read without parsing the request):
+//     {"context": "<context key>", "id": 2, "func": ..., "replace": true}
+// with "replace" the globals of the request replace all globals of the
+// context. The response to a request of an unknown (evicted) context is
+// {"id": 2, "missing": true}. Least recently used contexts are evicted
+// when there are more than "maxContexts" of them or the JS heap exceeds
+// "memoryBudget" (run node with --expose-gc to free it at once).
+var fs = require('fs'),
+    path = require('path'),
+    util = require('util'),
+    v8 = require('v8'),
+    vm = require('vm'),
+    Module = require('module');
+
+var helpers = path.join(__dirname, 'helpers.js'),
+    helpersSource = fs.readFileSync(helpers, 'utf8'),
+    responseFd = parseInt(process.argv[2], 10),
+    funcCache_ = {},
+    tenants = null,  // context key: tenant, least recently used first
+    tenantOptions = {},
+    tenantRequests = 0,
+    tenantCheckInterval = 100,  // requests between memory budget checks
+    contextKey = /^\{"context": "([^"]*)"/;
+
+vm.runInThisContext(helpersSource, {filename: helpers});
+
+// Keep stdout free of user output, the Python side reads it as a log
+console.log = console.info = console.debug = function() {
+    process.stderr.write(util.format.apply(null, arguments) + '\n');
+};
+
+// With `escape` objects of the message taken for markers are escaped
+function send(message, buffers, escape) {
+    var data;
+    try {
+        data = escape ? __runjs_stringify(message) : JSON.stringify(message);
+    } catch (err) {
+        data = JSON.stringify({id: message.id, error: __runjs_error(err)});
+        buffers = [];
+    }
+    sendRaw(data, buffers);
+}
+
+function sendRaw(data, buffers) {
+    var message = Buffer.from(data),
+        count = buffers ? buffers.length : 0,
+        header = Buffer.alloc(8 + 4 * count);
+    header.writeUInt32LE(message.length, 0);
+    header.writeUInt32LE(count, 4);
+    for (var i = 0; i < count; i++) {
+        header.writeUInt32LE(buffers[i].length, 8 + 4 * i);
+    }
+    writeAll(header);
+    writeAll(message);
+    for (i = 0; i < count; i++) {
+        writeAll(buffers[i]);
+    }
+}
+
+function writeAll(buffer) {
+    var offset = 0;
+    while (offset < buffer.length) {
+        offset += fs.writeSync(responseFd, buffer, offset);
+    }
+}
+
+// Binary result is sent as a frame buffer
+function encodeResult(value, buffers) {
+    var type = __runjs_binary_type(value);
+    if (type === null) {
+        return value;
+    }
+    buffers.push(__runjs_bytes(value));
+    return {__runjs_binary__: [type, buffers.length - 1]};
+}
+
+// Value of the data registered by `register_data()` (see shared_data.py)
+function loadData(fileName, realm) {
+    return realm.__runjs_parse(fs.readFileSync(fileName, 'utf8'));
+}
+
+function setGlobals(realm, globals, deleted, names, replace) {
+    var i, name, value;
+    if (replace) {
+        for (name in names) {
+            if (!(name in globals)) {
+                delete realm[name];
+                delete names[name];
+            }
+        }
+    }
+    for (i = 0; i < deleted.length; i++) {
+        delete realm[deleted[i]];
+        if (names) {
+            delete names[deleted[i]];
+        }
+    }
+    for (name in globals) {
+        value = globals[name];
+        if (value instanceof realm.__runjs_data_ref) {
+            // Registered data is parsed from its file
+            value = loadData(value.path, realm);
+        }
+        realm[name] = value;
+        if (names) {
+            names[name] = true;
+        }
+    }
+}
+
+function resolve(func, funcs, run, realm) {
+    if (!(func in funcs)) {
+        var dot = func.lastIndexOf('.');
+        funcs[func] = {
+            self: dot > 0 ? run(func.slice(0, dot)) : realm,
+            fn: run(func)
+        };
+    }
+    return funcs[func];
+}
+
+function configure(config) {
+    require(config.include);
+    if (config.tenants) {
+        tenants = new Map();
+        tenantOptions = config.tenants;
+        return;
+    }
+    if (config.globals) {
+        setGlobals(global, __runjs_parse_frame(config.globals, []), []);
+    }
+    for (var i = 0; i < config.libs.length; i++) {
+        var lib = config.libs[i];
+        if (lib.source === undefined) {
+            include(lib.name);
+        } else if (config.cacheDir) {
+            include_cached(lib.name, lib.source, config.cacheDir, lib.digest);
+        } else {
+            include_source(lib.name, lib.source);
+        }
+    }
+    if (config.cacheDir) {
+        var script = compile_cached(
+            config.code, 'main.js', config.cacheDir, config.codeDigest);
+        script.runInThisContext();
+        script.saveCache();
+    } else {
+        vm.runInThisContext(config.code, {filename: 'main.js'});
+    }
+}
+
+// New vm context with the helpers, the libraries and the code of a tenant
+function createTenant(message) {
+    var context = vm.createContext({
+            console: console, require: require, process: process,
+            Buffer: Buffer, URL: URL, TextEncoder: TextEncoder,
+            TextDecoder: TextDecoder, setTimeout: setTimeout,
+            clearTimeout: clearTimeout, setInterval: setInterval,
+            clearInterval: clearInterval, setImmediate: setImmediate,
+            clearImmediate: clearImmediate}),
+        realm = vm.runInContext('this', context),
+        tenant = {
+            key: message.load, context: context, realm: realm, funcs: {},
+            names: {},  // names of the global variables set by requests
+            run: function(code) { return vm.runInContext(code, context); }};
+    realm.global = realm;
+    realm.include_bundled = function(fileName, fn) {
+        __runjs_include_module(fileName, fn, realm);
+    };
+    vm.runInContext(helpersSource, context, {filename: helpers});
+    if (message.globals) {
+        // Parsed in the context, so the values are its objects
+        setGlobals(realm, realm.__runjs_parse_frame(message.globals, []), [],
+                   tenant.names);
+    }
+    for (var i = 0; i < message.libs.length; i++) {
+        var lib = message.libs[i],
+            source = lib.source === undefined ?
+                fs.readFileSync(lib.name, 'utf8') : lib.source;
+        __runjs_include_module(lib.name, vm.runInContext(
+            Module.wrap(source), context, {filename: lib.name}), realm);
+    }
+    vm.runInContext(message.code, context, {filename: 'main.js'});
+    return tenant;
+}
+
+function loadTenant(message) {
+    try {
+        var tenant = createTenant(message);
+        tenants.delete(tenant.key);
+        tenants.set(tenant.key, tenant);
+        evictTenants(tenant);
+        send({id: message.id, result: true});
+    } catch (err) {
+        send({id: message.id, error: __runjs_error(err)});
+    }
+}
+
+// Evict least recently used contexts over the limits, except `current`;
+// without gc() the heap is freed later, so only one context is evicted
+// for the memory budget at a time
+function evictTenants(current) {
+    var budget = tenantOptions.memoryBudget,
+        collect = typeof gc === 'function',
+        evicted = 0;
+    while (tenants.size > 1) {
+        var over = tenants.size > tenantOptions.maxContexts;
+        if (!over && !(budget && (collect || !evicted) &&
+                       v8.getHeapStatistics().used_heap_size > budget)) {
+            break;
+        }
+        var keys = tenants.keys(),
+            key = keys.next().value;
+        if (key === current.key) {
+            key = keys.next().value;
+        }
+        tenants.delete(key);
+        evicted++;
+        if (!over && collect) {
+            gc();
+        }
+    }
+}
+
+function handleTenant(data, buffers) {
+    var match = contextKey.exec(data.slice(0, 256)),
+        tenant = match && tenants.get(match[1]),
+        message;
+    if (!tenant) {
+        message = __runjs_parse_frame(data, buffers);
+        if (message.load !== undefined) {
+            loadTenant(message);
+        } else {
+            send({id: message.id, missing: true});
+        }
+        return;
+    }
+    tenants.delete(tenant.key);
+    tenants.set(tenant.key, tenant);
+    handle(tenant.realm.__runjs_parse_frame(data, buffers), tenant);
+    if (++tenantRequests % tenantCheckInterval === 0) {
+        evictTenants(tenant);
+    }
+}
+
+function handle(request, tenant) {
+    var realm = tenant ? tenant.realm : global,
+        funcs = tenant ? tenant.funcs : funcCache_;
+    try {
+        setGlobals(realm, request.globals || {}, request.deleted || [],
+                   tenant && tenant.names, request.replace);
+        var buffers = [],
+            encode = function(value) { return encodeResult(value, buffers); };
+        if (request.batch) {
+            sendRaw('{"id": ' + request.id + ', "results": ' +
+                    realm.__runjs_batch(request.func, request.batch,
+                                        undefined, encode) + '}', buffers);
+            return;
+        }
+        var target = resolve(request.func, funcs,
+                             tenant ? tenant.run : vm.runInThisContext, realm),
+            value = target.fn.apply(target.self, request.args || []),
+            result = encode(value);
+        send({id: request.id, result: result === undefined ? null : result},
+             buffers, result === value);
+    } catch (err) {
+        // Functions defined later by user code must be found again
+        delete funcs[request.func];
+        send({id: request.id, error: realm.__runjs_error(err)});
+    }
+}
+
+var configured = false,
+    pending = [],  // chunks of stdin
+    pendingLength = 0,
+    frameSize = 0;  // size of the next frame, 0 if its header is not read
+
+function onFrame(data, buffers) {
+    if (!configured) {
+        configured = true;
+        try {
+            configure(__runjs_parse_frame(data, buffers));
+            send({id: 0, result: true});
+        } catch (err) {
+            send({id: 0, error: __runjs_error(err)});
+        }
+        return;
+    }
+    if (tenants !== null) {
+        handleTenant(data, buffers);
+        return;
+    }
+    handle(__runjs_parse_frame(data, buffers));
+}
+
+function takeInput() {
+    if (pending.length > 1) {
+        pending = [Buffer.concat(pending, pendingLength)];
+    }
+    return pending[0];
+}
+
+// Split stdin into frames, chunks are joined only when the frame is
+// complete
+process.stdin
+    .on('data', function(chunk) {
+        pending.push(chunk);
+        pendingLength += chunk.length;
+        while (true) {
+            var input, count, offset, i;
+            if (!frameSize) {
+                if (pendingLength < 8) {
+                    return;
+                }
+                input = takeInput();
+                count = input.readUInt32LE(4);
+                offset = 8 + 4 * count;
+                if (pendingLength < offset) {
+                    return;
+                }
+                frameSize = offset + input.readUInt32LE(0);
+                for (i = 0; i < count; i++) {
+                    frameSize += input.readUInt32LE(8 + 4 * i);
+                }
+            }
+            if (pendingLength < frameSize) {
+                return;
+            }
+            input = takeInput();
+            var messageLength = input.readUInt32LE(0),
+                buffers = [],
+                data;
+            count = input.readUInt32LE(4);
+            offset = 8 + 4 * count;
+            data = input.toString('utf8', offset, offset + messageLength);
+            offset += messageLength;
+            for (i = 0; i < count; i++) {
+                var length = input.readUInt32LE(8 + 4 * i);
+                buffers.push(input.subarray(offset, offset + length));
+                offset += length;
+            }
+            pending = frameSize < input.length ?
+                [input.subarray(frameSize)] : [];
+            pendingLength = input.length - frameSize;
+            frameSize = 0;
+            onFrame(data, buffers);
+        }
+    })
+    .on('end', function() {
+        process.exit(0);
+    });
@@ -0,0 +1,432 @@
+# -*- coding: utf-8 -*-
+"""
+Local runjs server: warm engines shared by many Python processes
+
+Usage:
+    python -m runjs.server [--socket PATH] [--backend nodejs]
+                           [--pool-size 4] [--option workers=2]
+
+Clients connect with `JSRunWrapper.factory(backend='remote', ...)` over
+a Unix socket (see `backends/remote_backend.py` for the protocol). The
+engines are created for every distinct code, backend and options on the
+first request and shared by all connections with the same code; global
+variables belong to the connection and are applied to an engine when it
+is checked out.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .backends import binary
+from .backends.exceptions import ArgumentError, JSException
+from .backends.remote_backend import (
+    decode_message, default_socket_path, encode_message, error_message)
+from .backends.result_cache import ResultCache
+from .wrapper import JSRunWrapper
+
+__all__ = ['RunJSServer', 'main', ]
+
+_MISSING = object()
+
+
+class _Session(object):
+    """
+    Global variables of a connection, they are updated in order of the
+    requests by the connection reader and copied on change, so a request
+    handled in a thread sees them as they were when it was read
+    """
+    ids = itertools.count(1)
+
+    def __init__(self, engines):
+        self.id = next(self.ids)
+        self.engines = engines
+        self.values = OrderedDict()
+        self.serial = {}  # name: version of the last set
+        self.deleted = {}  # name: version of the deletion
+        self.version = 0
+
+    def update(self, changed, deleted):
+        """
+        Apply changes of the globals sent with a request and return
+            the globals of the request
+        :rtype: tuple
+        :return: version, values, versions of the values and versions
+            of the deletions
+        """
+        if changed or deleted:
+            values = OrderedDict(self.values)
+            serial = dict(self.serial)
+            deleted_serial = dict(self.deleted)
+            for k in deleted:
+                values.pop(k, None)
+                serial.pop(k, None)
+                self.version += 1
+                deleted_serial[k] = self.version
+            for k, v in changed.items():
+                values[k] = v
+                self.version += 1
+                serial[k] = self.version
+                deleted_serial.pop(k, None)
+            self.values, self.serial, self.deleted = (
+                values, serial, deleted_serial)
+        return self.version, self.values, self.serial, self.deleted
+
+
+class _Engines(object):
+    """ Pool of warm backends of one code shared by the sessions """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.sessions = 0  # open sessions
+        self.owners = {}  # backend id: (session id, version applied)
+
+    def call(self, session, js_globals, method, *args, **kwargs):
+        """
+        Call method of an idle backend with the globals of the request
+            (`_Session.update()` result)
+        """
+        with self.pool.acquire() as backend:
+            self._sync(backend, session, js_globals)
+            return getattr(backend, method)(*args, **kwargs)
+
+    def _sync(self, backend, session, js_globals):
+        """
+        Apply the globals of the request to the backend, only changes are
+            applied when the backend was used by the session last time
+            with the same or older globals
+        """
+        owner, version = self.owners.get(id(backend), (None, 0))
+        current, values, serial, deleted_serial = js_globals
+        if owner != session.id or version > current:
+            version = 0
+            deleted = [k for k in backend.js_global_vars if k not in values]
+        else:
+            deleted = [k for k, item in deleted_serial.items()
+                       if item > version]
+        changed = dict(
+            (k, v) for k, v in values.items() if serial[k] > version)
+        self.owners[id(backend)] = (session.id, current)
+        backend.delete_global_vars(
+            [k for k in deleted if k in backend.js_global_vars])
+        # Values of other sessions which are the same objects (ex:
+        # registered data) are not sent to the engine again
+        backend.set_global_vars(dict(
+            (k, v) for k, v in changed.items()
+            if backend.js_global_vars.get(k, _MISSING) is not v))
+
+
+class RunJSServer(object):
+    """
+    Server of warm engines over a Unix socket, requests of a connection
+    are handled concurrently up to `max_pending`, then the connection is
+    not read until a response is sent (backpressure)
+    """
+    logger = logging.getLogger(__name__)
+
+    def __init__(self, socket_path=None, backend='nodejs', pool_size=4,
+                 pool_timeout=None, options=None, max_pending=64,
+                 max_codes=16, threads=32):
+        """
+        :param str socket_path: (optional) path of the socket, default is
+            `default_socket_path()`
+        :param str backend: (optional) default backend of the engines
+        :param int pool_size: (optional) backends per code
+        :param float pool_timeout: (optional) seconds to wait for an idle
+            backend, `None` waits forever
+        :param dict options: (optional) default backend options
+        :param int max_pending: (optional) concurrent requests of
+            a connection
+        :param int max_codes: (optional) pools of codes kept when no
+            connection uses them
+        :param int threads: (optional) threads running the calls
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.backend = backend
+        self.pool_size = pool_size
+        self.pool_timeout = pool_timeout
+        self.options = dict(options or {})
+        self.max_pending = max_pending
+        self.max_codes = max_codes
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix='runjs-server')
+        self.engines = OrderedDict()  # code key: _Engines
+        self.engines_lock = threading.Lock()
+        self.server = None
+        self.connections = 0
+        self.pending = 0
+        self.requests = 0
+
+    async def start(self):
+        """
+        Start listening, a stale socket file is removed
+        :raise ArgumentError: other server listens on the socket
+        """
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                os.unlink(self.socket_path)
+            else:
+                err = 'runjs server is already running at %s' % (
+                    self.socket_path)
+                self.logger.error(err)
+                raise ArgumentError(err)
+            finally:
+                probe.close()
+        # Only the user may connect: the clients run any JS code
+        umask = os.umask(0o077)
+        try:
+            self.server = await asyncio.start_unix_server(
+                self._serve, self.socket_path)
+        finally:
+            os.umask(umask)
+        self.logger.info('runjs server is listening at %s', self.socket_path)
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    def close(self):
+        """
+        Stop listening and close the engines
+        """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.socket_path)
+            except OSError:
+                pass
+        with self.engines_lock:
+            engines, self.engines = self.engines, OrderedDict()
+        for item in engines.values():
+            item.pool.close()
+        self.executor.shutdown(wait=False)
+
+    def stats(self):
+        """
+        Return statistics of the server
+        :rtype: dict
+        """
+        with self.engines_lock:
+            engines = list(self.engines.items())
+        return {
+            'connections': self.connections,
+            'pending': self.pending,
+            'requests': self.requests,
+            'codes': [
+                dict(key=key, sessions=item.sessions, **item.pool.stats())
+                for key, item in engines],
+        }
+
+    def _open(self, message):
+        """
+        Return engines of the code of the `open` request, they are
+            created on the first request
+        """
+        backend = message.get('backend') or self.backend
+        options = dict(self.options)
+        options.update(message.get('options') or {})
+        js_code = message.get('js_code') or ''
+        js_libs_code = message.get('js_libs_code') or {}
+        key = ResultCache.make_key(json.dumps(
+            [backend, js_code, js_libs_code, options], sort_keys=True))
+        with self.engines_lock:
+            engines = self.engines.get(key)
+            if engines is None:
+                self.logger.info(
+                    'Starting %d %s backends for code %s', self.pool_size,
+                    backend, key[:12])
+                engines = self.engines[key] = _Engines(JSRunWrapper.factory(
+                    backend, js_code, [], js_libs_code,
+                    pool_size=self.pool_size, pool_timeout=self.pool_timeout,
+                    **options))
+            self.engines.move_to_end(key)
+            engines.sessions += 1
+            unused = [k for k, item in self.engines.items()
+                      if not item.sessions]
+            for k in unused[:max(0, len(unused) - self.max_codes)]:
+                self.engines.pop(k).pool.close()
+        return engines
+
+    def _release(self, session):
+        with self.engines_lock:
+            session.engines.sessions -= 1
+
+    def _handle(self, session, js_globals, message):
+        """
+        Return result of the request (called in a thread)
+        :param tuple js_globals: globals of the request
+        """
+        op = message['op']
+        if op == 'run':
+            return session.engines.call(
+                session, js_globals, 'run', message.get('func'),
+                message.get('args') or [],
+                cache=message.get('cache', False),
+                timeout=message.get('timeout'))
+        if op == 'run_many':
+            results = session.engines.call(
+                session, js_globals, 'run_many', message['func'],
+                message['batch'], message.get('chunk_size') or 100,
+                timeout=message.get('timeout'))
+            return [{'error': error_message(item)}
+                    if isinstance(item, JSException) else {'result': item}
+                    for item in results]
+        if op == 'reset':
+            session.engines.pool.reset()
+            return True
+        if op == 'stats':
+            return self.stats()
+        raise ArgumentError('Unknown operation: %s' % op)
+
+    async def _serve(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        pending = asyncio.Semaphore(self.max_pending)
+        session = None
+        self.connections += 1
+
+        async def respond(message, js_globals=None):
+            response = {'id': message['id']}
+            try:
+                if message['op'] == 'open':
+                    nonlocal session
+                    engines = await loop.run_in_executor(
+                        self.executor, self._open, message)
+                    if session is not None:
+                        self._release(session)
+                    session = _Session(engines)
+                    response['result'] = True
+                elif session is None:
+                    raise ArgumentError('The connection is not open')
+                else:
+                    response['result'] = await loop.run_in_executor(
+                        self.executor, self._handle, session, js_globals,
+                        message)
+            except Exception as err:
+                if not isinstance(err, JSException):
+                    self.logger.exception('Request %s failed', message['op'])
+                response['error'] = error_message(err)
+            try:
+                frame = encode_message(response)
+            except (TypeError, ValueError) as err:
+                frame = encode_message({
+                    'id': message['id'], 'error': error_message(err)})
+            writer.writelines(frame)
+            await writer.drain()
+
+        async def handle(message, js_globals=None):
+            try:
+                await respond(message, js_globals)
+            except (ConnectionError, OSError):
+                pass
+            finally:
+                self.pending -= 1
+                pending.release()
+
+        tasks = set()
+        try:
+            while True:
+                await pending.acquire()
+                data, buffers = await binary.aread_frame(reader)
+                if data is None:
+                    pending.release()
+                    break
+                message = decode_message(data, buffers)
+                self.requests += 1
+                self.pending += 1
+                if message.get('op') == 'open':
+                    # The session is opened before the next requests
+                    await handle(message)
+                    continue
+                js_globals = None
+                if session is not None:
+                    # Changes of the globals are applied in order, the
+                    # request sees the globals as they are now
+                    js_globals = session.update(
+                        message.pop('globals', None) or {},
+                        message.pop('deleted', None) or [])
+                task = loop.create_task(handle(message, js_globals))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, ValueError) as err:
+            self.logger.warning('Connection is closed: %s', err)
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            self.connections -= 1
+            if session is not None:
+                self._release(session)
+            writer.close()
+
+
+def _option(value):
+    name, _, value = value.partition('=')
+    try:
+        return name, json.loads(value)
+    except ValueError:
+        return name, value
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m runjs.server', description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--socket', default=default_socket_path(),
+        help='socket path (default: %(default)s)')
+    parser.add_argument(
+        '--backend', default='nodejs',
+        help='default backend of the engines (default: %(default)s)')
+    parser.add_argument('--pool-size', type=int, default=os.cpu_count() or 4,
+                        help='backends per code (default: %(default)s)')
+    parser.add_argument('--pool-timeout', type=float)
+    parser.add_argument(
+        '--option', type=_option, action='append', default=[],
+        metavar='NAME=VALUE', help='backend option, VALUE is JSON or string')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='concurrent requests of a connection')
+    parser.add_argument('--max-codes', type=int, default=16,
+                        help='pools of unused codes kept')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=args.log_level.upper(),
+        format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    server = RunJSServer(
+        args.socket, args.backend, args.pool_size, args.pool_timeout,
+        dict(args.option), args.max_pending, args.max_codes, args.threads)
+
+    async def serve():
+        loop = asyncio.get_running_loop()
+        await server.start()
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+        await stop.wait()
+
+    try:
+        asyncio.run(serve())
+    except ArgumentError:
+        return 1
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
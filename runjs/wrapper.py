@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import logging
 
-from .backends import NodeJSBackend, PyV8Backend, PydukBackend, PyV8NewBackend
+from .backends import get_backend
+from .backends.pool import BackendPool
 
 logger = logging.getLogger(__name__)
 
@@ -12,24 +13,36 @@ class JSRunWrapper(object):
     """ Backend factory class """
 
     @staticmethod
-    def factory(backend='pyv8', js_code='', js_libs=[], js_libs_code={}):
+    def factory(backend='pyv8', js_code='', js_libs=[], js_libs_code={},
+                pool_size=None, pool_timeout=None, pool_strategy='round_robin',
+                **options):
         """
         Create instance
 
-        :param str backend: (optional) backend name ('pyv8', 'pyduk' or 'nodejs')
+        :param str backend: (optional) backend name ('pyv8', 'pyduk',
+            'nodejs', 'pyv8_new', 'auto' routing every call to the fastest
+            installed one, or registered by `register_backend()`), its
+            module is imported by the first call
         :param str js_code: (optional) main source code
         :param list js_libs: (optional) list of paths to files with libraries
         :param dict js_libs_code: (optional) dict of libraries code, key is
             library name (ex: lib.js), value is source code
+        :param int pool_size: (optional) if set, then return thread-safe
+            `BackendPool` of `pool_size` backends with the same `run()` API
+        :param float pool_timeout: (optional) seconds to wait for an idle
+            backend of the pool, `None` waits forever
+        :param str pool_strategy: (optional) 'round_robin' or 'thread'
+            (prefer the backend used last by the calling thread)
+        :param options: (optional) backend specific options,
+            ex: `workers` for 'nodejs'
 
         :raise ValueError: invalid backend
         """
-        if backend == 'nodejs':
-            return NodeJSBackend(js_code, js_libs, js_libs_code)
-        elif backend == 'pyv8':
-            return PyV8Backend(js_code, js_libs, js_libs_code)
-        elif backend == 'pyduk':
-            return PydukBackend(js_code, js_libs, js_libs_code)
-        elif backend == 'pyv8_new':
-            return PyV8NewBackend(js_code, js_libs, js_libs_code)
-        raise ValueError('Invalid backend passed to `factory()`')
+        if pool_size is not None:
+            return BackendPool(
+                lambda: JSRunWrapper.factory(
+                    backend, js_code, js_libs, js_libs_code, **options),
+                pool_size, pool_timeout, pool_strategy)
+
+        return get_backend(backend)(
+            js_code, js_libs, js_libs_code, **options)
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+import pytest
+
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.bench import compare, percentile, run_suite, summarize
+
+
+def test_percentile():
+    samples = [1, 2, 3, 4]
+    assert percentile(samples, 50) == 2
+    assert percentile(samples, 99) == 4
+    assert percentile([], 50) is None
+
+
+def test_summarize():
+    stats = summarize([0.002, 0.001], 2, 0.5)
+    assert stats['calls'] == 2
+    assert stats['p50_ms'] == 1.0
+    assert stats['throughput'] == 4.0
+
+
+def test_compare():
+    row = {'backend': 'nodejs', 'workload': 'trivial', 'mode': 'warm'}
+    report = {'results': [dict(row, p50_ms=2.0, throughput=50.0)]}
+    baseline = {'results': [dict(row, p50_ms=1.0, throughput=100.0)]}
+    [result] = compare(report, baseline)
+    assert result['p50_ratio'] == 2.0
+    assert result['throughput_ratio'] == 0.5
+
+
+def test_unknown_workload():
+    with pytest.raises(ValueError):
+        run_suite(workloads=['missing'])
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+def test_run_suite():
+    report = run_suite(
+        ['nodejs', 'missing_backend'], ['trivial'], ['warm', 'batched'],
+        iterations=4, warmup=1, batch_size=2)
+    assert list(report['skipped_backends']) == ['missing_backend']
+    rows = report['results']
+    assert [row['mode'] for row in rows] == ['warm', 'batched']
+    assert all(row['calls'] == 4 for row in rows)
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+import array
+import asyncio
+import io
+import json
+import pickle
+import shutil
+
+import pytest
+
+from runjs.backends import binary
+from runjs.backends.exceptions import ArgumentError
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.remote_backend import decode_message, encode_message
+
+# User data taken for markers
+LITERALS = [
+    {'__runjs_binary__': ['Uint8Array', 'YWJj']},
+    {'__runjs_binary__~': 1},
+    {'__runjs_data__': ['/etc/passwd', 'x']},
+    [{'a': {'__runjs_binary__': None}}],
+]
+
+
+def test_typed_array_types():
+    assert binary.typed_array_type(b'') == 'Uint8Array'
+    assert binary.typed_array_type(array.array('d')) == 'Float64Array'
+    assert binary.typed_array_type(
+        memoryview(array.array('h')).cast('B').cast('h')) == 'Int16Array'
+    with pytest.raises(ArgumentError):
+        binary.typed_array_type(array.array('u'))
+
+
+@pytest.mark.parametrize('value', [
+    b'\x00\x01\xff', array.array('d', [1.5, -2.0]), array.array('i', [7])])
+def test_marker_round_trip(value):
+    result = binary.loads(json.dumps({'a': [binary.marker(value)]}))['a'][0]
+    assert bytes(binary.byte_view(result)) == bytes(binary.byte_view(value))
+    assert binary.js_value(binary.marker_json(value)).startswith(
+        '__runjs_parse(')
+
+
+def test_buffer_markers():
+    buffers = [memoryview(b'abc')]
+    text = json.dumps([binary.marker(b'abc', 0)])
+    assert binary.loads(text, buffers) == [b'abc']
+    assert binary.loads(b'[1]') == [1]
+
+
+@pytest.mark.parametrize('value', LITERALS)
+def test_escaped_round_trip(value):
+    text = binary.dumps(value)
+    assert text != json.dumps(value)
+    assert binary.loads(text) == value
+    assert binary.dumps({'a': b''}, default=binary.marker) == json.dumps(
+        {'a': binary.marker(b'')})
+
+
+@pytest.mark.parametrize('value', LITERALS)
+def test_remote_message_round_trip(value):
+    stream = io.BytesIO(b''.join(encode_message(
+        {'args': [value, b'xy']})))
+    data, buffers = binary.read_frame(stream)
+    assert decode_message(data, buffers) == {'args': [value, b'xy']}
+
+
+def test_picklable():
+    view = memoryview(array.array('d', [1.0, 2.0]))
+    value = pickle.loads(pickle.dumps(binary.to_picklable(view)))
+    assert binary.from_picklable(value).tolist() == [1.0, 2.0]
+
+
+def test_frames():
+    buffers = [binary.byte_view(b'xy'), binary.byte_view(b'')]
+    stream = io.BytesIO(
+        b''.join(binary.encode_frame(b'{"a":1}', buffers)) +
+        b''.join(binary.encode_frame(b'[]')))
+    message, received = binary.read_frame(stream)
+    assert message == b'{"a":1}'
+    assert [bytes(buf) for buf in received] == [b'xy', b'']
+    assert binary.read_frame(stream) == (b'[]', [])
+    assert binary.read_frame(stream) == (None, None)
+
+
+def test_truncated_frame():
+    frame = b''.join(binary.encode_frame(b'{"a":1}'))
+    assert binary.read_frame(io.BytesIO(frame[:-1])) == (None, None)
+
+
+def test_async_frames():
+    async def main():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b''.join(binary.encode_frame(
+            b'{}', [binary.byte_view(b'z')])))
+        reader.feed_eof()
+        first = await binary.aread_frame(reader)
+        return first, await binary.aread_frame(reader)
+
+    (message, buffers), last = asyncio.run(main())
+    assert message == b'{}' and [bytes(buf) for buf in buffers] == [b'z']
+    assert last == (None, None)
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+@pytest.mark.parametrize('workers', [0, 1])
+def test_nodejs_typed_arrays(workers):
+    js = NodeJSBackend('''
+        function info(a) {
+            return [Object.prototype.toString.call(a), a.length];
+        }
+        function halves(n) { return new Float64Array(n).fill(0.5); }
+    ''', workers=workers)
+    try:
+        assert js.run('info', [b'abc']) == ['[object Uint8Array]', 3]
+        assert js.run('info', [array.array('d', [1, 2])]) == [
+            '[object Float64Array]', 2]
+        assert js.run('halves', [2]).tolist() == [0.5, 0.5]
+    finally:
+        js.close()
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+@pytest.mark.parametrize('workers', [0, 1])
+def test_nodejs_marker_literals(tmp_path, workers):
+    pwned = tmp_path / 'pwned'
+    code = "require('fs').writeFileSync(%s, '')" % json.dumps(str(pwned))
+    js = NodeJSBackend('''
+        function echo(a) { return a; }
+        function get(name) { return global[name]; }
+        function literal() { return {__runjs_binary__: ['Uint8Array', '']}; }
+    ''', workers=workers)
+    try:
+        evil = {'__runjs_binary__': ['(%s, Uint8Array)' % code, 'YQ==']}
+        js.set_global_var('evil', evil)
+        assert js.run('get', ['evil']) == evil
+        assert js.run('echo', [evil]) == evil
+        assert js.run_many('echo', [[evil]]) == [evil]
+        for value in LITERALS:
+            assert js.run('echo', [value]) == value
+        assert js.run('literal') == {'__runjs_binary__': ['Uint8Array', '']}
+        assert not pwned.exists()
+    finally:
+        js.close()
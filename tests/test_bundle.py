@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import shutil
+import subprocess
+
+import pytest
+
+from runjs.backends.abstract import JS_HELPERS, AbstractBackend
+from runjs.backends.bundle import build_bundle, map_traceback, strip_js
+from runjs.backends.nodejs_backend import NodeJSBackend
+
+LIBS_CODE = {'a.js': 'var a = 1;\n', 'b.js': 'var b = a + 1;\n'}
+
+
+class ScriptBackend(AbstractBackend):
+    """ Backend joining the libraries as scripts, like `PyV8NewBackend` """
+
+
+def stripped(source):
+    return '\n'.join(text for _, text in strip_js(source))
+
+
+def node_output(source):
+    node = shutil.which('nodejs') or shutil.which('node')
+    if node is None:
+        pytest.skip('Node.js is not installed')
+    return subprocess.check_output([node, '-e', source]).decode()
+
+
+def test_comments_and_whitespace():
+    source = 'var  a = 1;  // one\n\n/* two\n lines */  var b =\t2;\n'
+    assert strip_js(source) == [(1, 'var a = 1;'), (4, 'var b = 2;')]
+
+
+def test_strings_and_templates_are_kept():
+    source = 'var s = "a  // b";\nvar t = `x  ${ a  +  1 }\n  y`;\n'
+    assert stripped(source) == (
+        'var s = "a  // b";\nvar t = `x  ${ a + 1 }\n  y`;')
+
+
+@pytest.mark.parametrize('source', [
+    'var r = /a  b/g;',
+    'if (/a  b/.test(s)) {}',
+    'return /[/  ]/.test(s);',
+])
+def test_regex_is_kept(source):
+    assert stripped(source) == source
+
+
+def test_division():
+    assert stripped('var x = a  /  b;') == 'var x = a / b;'
+    assert stripped('var x = a++  /  2;') == 'var x = a++ / 2;'
+
+
+@pytest.mark.parametrize('source', [
+    'if (true) /a  b/.test(s) && console.log("match");',
+    'if (true) {} /a  b/.test(s) && console.log("match");',
+    'var x = (a) /  2; // half  of a',
+    'var x = (a) /  2; /* half\n  of  a */ var y = 1;',
+])
+def test_ambiguous_slash_is_copied(source):
+    assert stripped(source) == source
+
+
+def test_ambiguous_regex_runs():
+    source = 'var s = "a  b"; if (true) /a  b/.test(s) && console.log("match");'
+    assert node_output(source) == node_output(stripped(source)) == 'match\n'
+
+
+def test_bundle_maps_lines():
+    bundle = build_bundle(js_libs_code={
+        'a.js': '// a\nvar a = 1;\n', 'b.js': '\n\nthrow new Error("b");\n'})
+    assert bundle.code.count('var a = 1;') == 1
+    line = bundle.code.split('\n').index('throw new Error("b");') + 1
+    assert bundle.original_position(line) == ('b.js', 3)
+    assert map_traceback(
+        'Error: b\n    at /tmp/%s:%d:7' % (bundle.name, line)) == (
+        'Error: b\n    at b.js:3')
+
+
+def test_script_bundle_runs_with_helpers():
+    js = ScriptBackend(js_libs_code=LIBS_CODE, bundle=True)
+    assert 'include_bundled' not in js.bundle.code
+    source = JS_HELPERS + js.bundle.code + 'console.log(a + b);'
+    assert node_output(source) == '3\n'
+
+
+def test_nodejs_bundle_is_module():
+    js = NodeJSBackend(js_libs_code=LIBS_CODE, bundle=True)
+    assert js.bundle.code.startswith('include_bundled(')
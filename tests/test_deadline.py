@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from runjs.backends import abstract
+from runjs.backends.abstract import AbstractBackend, call_with_deadline
+from runjs.backends.exceptions import JSTimeoutError
+
+
+class BlockingBackend(AbstractBackend):
+    """ In-process backend whose calls wait for the event """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.event = threading.Event()
+        self.started = 0
+
+    def _call(self):
+        self.started += 1
+        self.event.wait()
+        return self.started
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        return call_with_deadline(self._call_timeout(timeout), self._call)
+
+
+def call_threads():
+    return sum(thread.name == 'runjs-call' and thread.is_alive()
+               for thread in threading.enumerate())
+
+
+@pytest.fixture
+def threads(monkeypatch):
+    semaphore = threading.BoundedSemaphore(2)
+    monkeypatch.setattr(abstract, '_call_threads', semaphore)
+    return semaphore
+
+
+def test_call_without_timeout_runs_inline(threads):
+    js = BlockingBackend()
+    js.event.set()
+    assert js.run() == 1
+    assert call_threads() == 0
+
+
+def test_abandoned_threads_are_capped(threads):
+    js = BlockingBackend(timeout=0.05)
+    try:
+        for _ in range(4):
+            with pytest.raises(JSTimeoutError):
+                js.run()
+        # The calls over the cap do not start threads
+        assert js.started == 2
+        assert call_threads() == 2
+    finally:
+        js.event.set()
+    # The finished calls free their threads
+    assert js.run(timeout=5) == 3
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+import json
+
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.exceptions import ArgumentError
+
+
+class Backend(AbstractBackend):
+    def run(self, *args, **kwargs):
+        return None
+
+
+def test_json_is_cached_until_change():
+    js = Backend()
+    value = {'a': [1, 2]}
+    js.set_global_var('x', value)
+    assert json.loads(js.get_global_var_json('x')) == value
+    # The serialized form is reused, in-place changes need a new set
+    value['a'].append(3)
+    assert json.loads(js.get_global_var_json('x')) == {'a': [1, 2]}
+    js.set_global_var('x', value)
+    assert json.loads(js.get_global_var_json('x')) == {'a': [1, 2, 3]}
+
+
+def test_delta():
+    js = Backend()
+    js.set_global_vars({'x': 1, 'y': 2})
+    version, changed, deleted = js.global_vars_delta(0)
+    assert changed == {'x': '1', 'y': '2'} and deleted == []
+
+    js.set_global_var('y', 3)
+    js.delete_global_var('x')
+    version, changed, deleted = js.global_vars_delta(version)
+    assert changed == {'y': '3'} and deleted == ['x']
+
+    assert js.global_vars_delta(version) == (version, {}, [])
+    js.set_global_var('x', [1])
+    assert js.global_vars_delta(version, serialized=False)[1:] == (
+        {'x': [1]}, [])
+
+
+def test_new_engine_gets_every_variable():
+    js = Backend()
+    js.set_global_var('x', 1)
+    js.delete_global_var('x')
+    js.set_global_var('y', 2)
+    assert js.global_vars_delta(0)[1:] == ({'y': '2'}, [])
+
+
+def test_invalid_arguments():
+    js = Backend()
+    with pytest.raises(ArgumentError):
+        js.set_global_vars([('x', 1)])
+    with pytest.raises(ArgumentError):
+        js.delete_global_vars('x')
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+import subprocess
+import sys
+
+
+def test_package_import_is_lazy():
+    # Backends and asyncio are imported by the first call which needs them
+    code = ('import sys, runjs; print(sorted(m for m in sys.modules if m in '
+            '("asyncio", "runjs.backends.abstract", "runjs.backends.pyduk_'
+            'backend", "runjs.backends.nodejs_backend")))')
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.strip() == b'[]'
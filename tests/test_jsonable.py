@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+import decimal
+import json
+from datetime import date
+
+from runjs.backends.jsonable import Jsonable
+
+
+class Point(Jsonable):
+    kind = 'point'
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self._hidden = True
+
+    def norm(self):
+        return abs(self.x) + abs(self.y)
+
+
+class Labeled(Point):
+    __slots__ = ('label', )
+
+    @property
+    def size(self):
+        return self.norm()
+
+
+class Order(Jsonable):
+    def __init__(self, points, price, day):
+        self.points = points
+        self.price = price
+        self.day = day
+        self.callback = lambda: None
+
+
+def test_fields():
+    assert Point(1, 2).to_dict() == {'kind': 'point', 'x': 1, 'y': 2}
+    assert dict(Point(1, 2)) == Point(1, 2).to_dict()
+
+
+def test_inherited_fields_slots_and_properties():
+    point = Labeled(1, -2)
+    assert point.to_dict() == {'kind': 'point', 'size': 3, 'x': 1, 'y': -2}
+    point.label = 'a'
+    assert point.to_dict()['label'] == 'a'
+
+
+def test_nested_values():
+    order = Order((Point(0, 1), {'a': [Point(1, 0)]}), decimal.Decimal('1.5'),
+                  date(2020, 1, 2))
+    assert order.to_dict() == {
+        'points': [{'kind': 'point', 'x': 0, 'y': 1},
+                   {'a': [{'kind': 'point', 'x': 1, 'y': 0}]}],
+        'price': '1.5',
+        'day': '2020-01-02',
+    }
+    assert json.loads(order.to_json_bytes()) == order.to_dict()
+
+
+def test_plan_reset():
+    Point(0, 0).to_dict()
+    Point.extra = 1
+    try:
+        assert 'extra' not in Point(0, 0).to_dict()
+        Point.reset_jsonable_plan()
+        assert Point(0, 0).to_dict()['extra'] == 1
+    finally:
+        del Point.extra
+        Point.reset_jsonable_plan()
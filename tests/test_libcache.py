@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from runjs.backends.libcache import LibraryCache
+
+
+def test_file_is_read_once(tmp_path):
+    cache = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    path = tmp_path / 'lib.js'
+    path.write_text('var a = 1;')
+    assert cache.read(str(path)) == 'var a = 1;'
+    assert cache.read(str(path)) == 'var a = 1;'
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_modified_file_is_read_again(tmp_path):
+    cache = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    path = tmp_path / 'lib.js'
+    path.write_text('var a = 1;')
+    cache.read(str(path))
+    path.write_text('var a = 22;')
+    assert cache.read(str(path)) == 'var a = 22;'
+
+
+def test_eviction(tmp_path):
+    cache = LibraryCache(max_bytes=15, cache_dir=str(tmp_path / 'cache'))
+    for name in ('a.js', 'b.js'):
+        (tmp_path / name).write_text('var %s = 1;' % name[0])
+        cache.read(str(tmp_path / name))
+    assert len(cache.sources) == 1
+    assert cache.size == len('var b = 1;')
+
+
+def test_materialize_writes_code_once(tmp_path):
+    cache = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    path = cache.materialize('lib.js', 'var a = 1;')
+    assert os.path.basename(path) == 'lib.js'
+    with open(path) as lib_file:
+        assert lib_file.read() == 'var a = 1;'
+    mtime = os.stat(path).st_mtime_ns
+    other = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    assert other.materialize('lib.js', 'var a = 1;') == path
+    assert os.stat(path).st_mtime_ns == mtime
+    assert cache.materialize('lib.js', 'var a = 2;') != path
+
+
+def test_default_directory_is_private():
+    cache = LibraryCache()
+    path = cache.materialize('lib.js', 'var a = 1;')
+    assert path.startswith(cache.lib_dir + os.sep)
+    assert os.stat(cache.lib_dir).st_mode & 0o077 == 0
+    other = LibraryCache()
+    assert other.materialize('lib.js', 'var a = 1;') != path
+
+
+def test_directory_writable_by_others_is_refused(tmp_path):
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    cache_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        LibraryCache(cache_dir=str(cache_dir)).materialize('lib.js', '')
+
+
+def test_planted_file_is_replaced(tmp_path):
+    cache = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    path = cache.materialize('lib.js', 'var a = 1;')
+    with open(path, 'w') as lib_file:
+        lib_file.write('evil();')
+    other = LibraryCache(cache_dir=str(tmp_path / 'cache'))
+    assert other.materialize('lib.js', 'var a = 1;') == path
+    with open(path) as lib_file:
+        assert lib_file.read() == 'var a = 1;'
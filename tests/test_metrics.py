@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.exceptions import JSRuntimeException
+from runjs.backends.metrics import (
+    NULL_CALL_METRICS, CallbackSink, Histogram, HistogramSink,
+    get_metrics_sink, set_metrics_sink)
+from runjs.backends.nodejs_backend import NodeJSBackend
+
+
+class TimedBackend(AbstractBackend):
+    """ Backend recording the phases of its calls """
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        with self._call_metrics(func) as metrics:
+            metrics.mark('args')
+            if func == 'fail':
+                raise JSRuntimeException('boom', '')
+            metrics.mark('execute')
+            return 1
+
+
+def test_no_sink_records_nothing():
+    assert get_metrics_sink() is None
+    assert TimedBackend()._call_metrics('f') is NULL_CALL_METRICS
+
+
+def test_callback_sink():
+    calls = []
+    js = TimedBackend(metrics=CallbackSink(calls.append))
+    js.run('f')
+    with pytest.raises(JSRuntimeException):
+        js.run('fail')
+    assert [(call.backend, call.func) for call in calls] == [
+        ('TimedBackend', 'f'), ('TimedBackend', 'fail')]
+    assert list(calls[0].phases) == ['args', 'execute']
+    assert calls[0].error is None
+    assert isinstance(calls[1].error, JSRuntimeException)
+    assert calls[0].as_dict()['duration'] >= 0
+
+
+def test_default_sink():
+    sink = HistogramSink()
+    set_metrics_sink(sink)
+    try:
+        TimedBackend().run('f')
+    finally:
+        set_metrics_sink(None)
+    assert sink.snapshot()['calls'][0]['count'] == 1
+
+
+def test_histogram():
+    histogram = Histogram([1, 10])
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+    assert histogram.cumulative() == [(1, 2), (10, 3), (float('inf'), 4)]
+    assert histogram.sum == 56.5
+
+
+def test_histogram_sink():
+    sink = HistogramSink(time_buckets=[0.5])
+    js = TimedBackend(metrics=sink)
+    js.run('f')
+    with pytest.raises(JSRuntimeException):
+        js.run('fail')
+    sink.observe_recycle('TimedBackend', 'calls')
+    snapshot = sink.snapshot()
+    assert [(item['status'], item['count']) for item in snapshot['calls']] == [
+        ('ok', 1), ('error', 1)]
+    assert snapshot['durations']['TimedBackend']['count'] == 2
+    text = sink.to_prometheus()
+    assert ('runjs_calls_total{backend="TimedBackend",status="ok"} 1'
+            in text)
+    assert ('runjs_call_seconds_bucket{backend="TimedBackend",le="+Inf"} 2'
+            in text)
+    assert ('runjs_recycles_total{backend="TimedBackend",reason="calls"} 1'
+            in text)
+    sink.clear()
+    assert sink.snapshot()['calls'] == []
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+def test_nodejs_phases():
+    calls = []
+    js = NodeJSBackend('function f(s) { return s + s; }',
+                       metrics=CallbackSink(calls.append))
+    js.run('f', ['ab'])
+    [call] = calls
+    assert {'libs', 'globals', 'args', 'execute', 'result'} <= set(
+        call.phases)
+    assert call.args_bytes == len('"ab"')
+    assert call.result_bytes == len('"abab"')
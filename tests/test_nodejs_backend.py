@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from runjs.backends.exceptions import (
+    JSLoadError, JSRuntimeException, JSTimeoutError)
+from runjs.backends.nodejs_backend import NodeJSBackend
+
+pytestmark = pytest.mark.skipif(
+    shutil.which(NodeJSBackend.node_bin) is None,
+    reason='Node.js is not installed')
+
+JS_CODE = '''
+function scale(a) { return a * factor; }
+function fail(msg) { throw new Error(msg); }
+function spin() { while (true) {} }
+var calls = 0;
+function count() { return ++calls; }
+'''
+
+
+@pytest.fixture
+def lib_path(tmp_path):
+    path = tmp_path / 'lib.js'
+    path.write_text('exports.factor = 3;\n')
+    return str(path)
+
+
+@pytest.mark.parametrize('use_stdin', [True, False])
+def test_one_shot_call(lib_path, use_stdin):
+    js = NodeJSBackend(JS_CODE, [lib_path], use_stdin=use_stdin)
+    assert js.run('scale', [2]) == 6
+    js.set_global_var('factor', 5)
+    assert js.run('scale', [2]) == 10
+    assert js.run_many('scale', [[1], [2]]) == [5, 10]
+
+
+def test_one_shot_call_writes_no_file(lib_path, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('temporary file is written')
+
+    monkeypatch.setattr(
+        'runjs.backends.nodejs_backend.NamedTemporaryFile', fail)
+    monkeypatch.setattr(tempfile, 'NamedTemporaryFile', fail)
+    js = NodeJSBackend(JS_CODE, [lib_path])
+    assert js.run('scale', [2]) == 6
+
+
+def test_one_shot_errors(lib_path):
+    js = NodeJSBackend(JS_CODE, [lib_path])
+    with pytest.raises(JSRuntimeException) as info:
+        js.run('fail', ['boom'])
+    assert 'boom' in info.value.traceback
+    with pytest.raises(JSTimeoutError):
+        js.run('spin', timeout=0.5)
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_load_error(workers):
+    for code in ('module.exports.x = y;', 'function f( {'):
+        js = NodeJSBackend(code + JS_CODE, workers=workers)
+        try:
+            with pytest.raises(JSLoadError):
+                js.run('fail', ['boom'])
+            with pytest.raises(JSLoadError):
+                js.run_many('fail', [['boom']])
+        finally:
+            js.close()
+    # An error of the call is not one of loading the code
+    js = NodeJSBackend('function f() { return y; }', workers=workers)
+    try:
+        with pytest.raises(JSRuntimeException) as info:
+            js.run('f')
+        assert not isinstance(info.value, JSLoadError)
+        assert 'ReferenceError' in info.value.traceback
+    finally:
+        js.close()
+
+
+@pytest.mark.parametrize('use_stdin', [True, False])
+def test_one_shot_async_call(lib_path, use_stdin):
+    js = NodeJSBackend(JS_CODE, [lib_path], use_stdin=use_stdin)
+
+    async def main():
+        # Every call runs in a new process, no state is kept
+        results = [await js.arun('count'), await js.arun('count')]
+        results.append(await js.arun_many('count', [[], []]))
+        with pytest.raises(JSRuntimeException) as info:
+            await js.arun('fail', ['boom'])
+        assert 'boom' in info.value.traceback
+        with pytest.raises(JSTimeoutError):
+            await js.arun('spin', timeout=0.5)
+        with pytest.raises(JSTimeoutError):
+            await js.arun_many('spin', [[]], timeout=0.5)
+        return results
+
+    # As the calls of `run()`, a chunk runs in one process
+    assert asyncio.run(main()) == [1, 1, [1, 2]]
+    assert js.run('count') == 1
+    assert js.run_many('count', [[], []]) == [1, 2]
+    assert js.async_worker_pool is None
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_code_cache(lib_path, tmp_path, workers):
+    cache_dir = str(tmp_path / 'code-cache')
+    for _ in range(2):
+        js = NodeJSBackend(JS_CODE, [lib_path], workers=workers,
+                           code_cache=cache_dir)
+        try:
+            assert js.run('scale', [2]) == 6
+        finally:
+            js.close()
+    assert [name for name in os.listdir(cache_dir) if name.endswith('.bin')]
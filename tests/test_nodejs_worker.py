@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import shutil
+import threading
+
+import pytest
+
+from runjs.backends.exceptions import JSRuntimeException, JSTimeoutError
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.pool import BackendPool
+
+pytestmark = pytest.mark.skipif(
+    shutil.which(NodeJSBackend.node_bin) is None,
+    reason='Node.js is not installed')
+
+JS_CODE = '''
+var calls = 0;
+function add(a, b) { calls++; return a + b; }
+function get(name) { return global[name]; }
+function count() { return calls; }
+function fail(msg) { throw new Error(msg); }
+function bytes(n) { return new Uint8Array(n); }
+function spin() { while (true) {} }
+'''
+
+
+@pytest.fixture
+def backend():
+    js = NodeJSBackend(JS_CODE, workers=1)
+    yield js
+    js.close()
+
+
+def test_call(backend):
+    assert backend.run('add', [1, 2]) == 3
+    assert backend.run('add', ['a', 'b']) == 'ab'
+    # The code is loaded once
+    assert backend.run('count') == 2
+
+
+def test_global_vars_are_sent_when_changed(backend):
+    backend.set_global_vars({'x': 1, 'y': [1, 2]})
+    assert backend.run('get', ['y']) == [1, 2]
+    backend.delete_global_var('y')
+    backend.set_global_var('x', 2)
+    assert backend.run('get', ['x']) == 2
+    assert backend.run('get', ['y']) is None
+
+
+def test_binary_values(backend):
+    assert backend.run('add', [b'', 'x']) == 'x'
+    assert backend.run('bytes', [3]) == b'\x00\x00\x00'
+
+
+def test_js_error(backend):
+    with pytest.raises(JSRuntimeException) as info:
+        backend.run('fail', ['boom'])
+    assert 'boom' in str(info.value)
+    assert backend.run('add', [1, 1]) == 2
+
+
+def test_batch(backend):
+    results = backend.run_many('add', [[i, i] for i in range(250)],
+                               chunk_size=100)
+    assert results == [i * 2 for i in range(250)]
+    errors = backend.run_many('fail', [['a'], ['b']])
+    assert all(isinstance(item, JSRuntimeException) for item in errors)
+
+
+def test_timeout_restarts_worker(backend):
+    with pytest.raises(JSTimeoutError):
+        backend.run('spin', timeout=0.5)
+    assert backend.run('count') == 0
+
+
+def test_threads_share_workers():
+    js = NodeJSBackend(JS_CODE, workers=2)
+    results = []
+
+    def call(i):
+        results.append(js.run('add', [i, 1]))
+
+    threads = [threading.Thread(target=call, args=(i, )) for i in range(40)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    js.close()
+    assert sorted(results) == list(range(1, 41))
+
+
+def test_async_calls_during_start():
+    js = NodeJSBackend(JS_CODE, workers=1)
+
+    async def call(i):
+        await asyncio.sleep(0)
+        return await js.arun('add', [i, 1])
+
+    async def main():
+        try:
+            tasks = []
+            for i in range(200):
+                tasks.append(asyncio.ensure_future(call(i)))
+                await asyncio.sleep(0)
+            return await asyncio.gather(*tasks)
+        finally:
+            await js.aclose()
+
+    assert asyncio.run(main()) == list(range(1, 201))
+
+
+def test_async_timeout():
+    js = NodeJSBackend(JS_CODE, workers=1)
+
+    async def main():
+        try:
+            with pytest.raises(JSTimeoutError):
+                await js.arun('spin', timeout=0.5)
+            return await js.arun('add', [1, 2])
+        finally:
+            await js.aclose()
+
+    assert asyncio.run(main()) == 3
+
+
+@pytest.mark.parametrize('workers', [0, 1])
+def test_run_many_timeout(workers):
+    js = NodeJSBackend(JS_CODE, workers=workers)
+    try:
+        with pytest.raises(JSTimeoutError):
+            js.run_many('spin', [[]], timeout=0.5)
+        assert js.run_many('add', [[1, 2]], timeout=5) == [3]
+    finally:
+        js.close()
+
+
+def test_async_run_many_timeout():
+    js = NodeJSBackend(JS_CODE, workers=2)
+
+    async def main():
+        try:
+            with pytest.raises(JSTimeoutError):
+                await js.arun_many('spin', [[]] * 4, chunk_size=1,
+                                   timeout=0.5)
+            return await js.arun_many('add', [[1, 2], [2, 3]], timeout=5)
+        finally:
+            await js.aclose()
+
+    assert asyncio.run(main()) == [3, 5]
+
+
+def test_pool_async_timeout():
+    pool = BackendPool(lambda: NodeJSBackend(JS_CODE, workers=1), 1)
+
+    async def main():
+        with pytest.raises(JSTimeoutError):
+            await pool.arun('spin', timeout=0.5)
+        with pytest.raises(JSTimeoutError):
+            await pool.arun_many('spin', [[]], timeout=0.5)
+        return await pool.arun('add', [1, 2], timeout=5)
+
+    try:
+        # The killed worker does not delay the next call
+        assert asyncio.run(main()) == 3
+    finally:
+        pool.close()
+
+
+async def _arun(js, func):
+    try:
+        return await js.arun(func)
+    finally:
+        await js.aclose()
+
+
+GLOBALS_CODE = 'var doubled = base * 2; function get() { return doubled; }'
+
+
+@pytest.mark.parametrize('options', [
+    {'workers': 1}, {'workers': 1, 'persistent': True},
+    {'shared_workers': 1}])
+def test_globals_set_before_code(options):
+    js = NodeJSBackend(GLOBALS_CODE, **options)
+    try:
+        js.set_global_var('base', 21)
+        assert js.run('get') == 42
+    finally:
+        js.close()
+
+
+def test_async_globals_set_before_code():
+    js = NodeJSBackend(GLOBALS_CODE, workers=1)
+    js.set_global_var('base', 5)
+    assert asyncio.run(_arun(js, 'get')) == 10
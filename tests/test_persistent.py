@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.pyduk_backend import PydukBackend, pyduk
+
+JS_CODE = '''
+var calls = 0;
+function get(name) {
+    calls++;
+    return this[name] === undefined ? null : this[name];
+}
+function count() { return calls; }
+'''
+
+
+class ContextBackend(AbstractBackend):
+    """
+    Backend with a warm context of its global variables, the changes are
+    applied as by the in-process backends
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, persistent=True, **kwargs)
+        self.contexts = 0  # contexts created
+        self.applied = []  # names of the variables set in the context
+
+    def _warm_context(self):
+        self._recycle_context()
+        if self.js_context is None:
+            self.contexts += 1
+            self.js_context = {}
+        js_vars, deleted = self._global_vars_changes(serialized=False)
+        for k in deleted:
+            del self.js_context[k]
+        for k, v in js_vars:
+            self.applied.append(k)
+            self.js_context[k] = v
+        return self.js_context
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        return self._warm_context().get(fargs[0]) if fargs else None
+
+
+def test_only_changes_are_applied():
+    js = ContextBackend()
+    js.set_global_vars({'x': 1, 'y': 2})
+    assert js.run('get', ['x']) == 1
+    js.set_global_var('y', 3)
+    assert js.run('get', ['y']) == 3
+    assert js.run('get', ['x']) == 1
+    assert js.applied == ['x', 'y', 'y']
+    assert js.contexts == 1
+
+
+def test_deleted_global_is_gone():
+    js = ContextBackend()
+    js.set_global_vars({'x': 1, 'y': 2})
+    assert js.run('get', ['y']) == 2
+    js.delete_global_var('y')
+    assert js.run('get', ['y']) is None
+    assert js.run('get', ['x']) == 1
+
+
+def test_reset_rebuilds_context():
+    js = ContextBackend()
+    js.set_global_var('x', 1)
+    context = js._warm_context()
+    context['leaked'] = True
+    js.reset()
+    assert js.run('get', ['leaked']) is None
+    # The new context receives every global variable
+    assert js.run('get', ['x']) == 1
+    assert js.contexts == 2
+    assert js.applied == ['x', 'x']
+
+
+def test_recycled_context_is_rebuilt():
+    js = ContextBackend(recycle={'max_calls': 2})
+    js.set_global_var('x', 1)
+    assert [js.run('get', ['x']) for _ in range(3)] == [1, 1, 1]
+    assert js.contexts == 2
+
+
+@pytest.mark.skipif(pyduk is None, reason='pyduk is not installed')
+def test_pyduk_persistent_context():
+    js = PydukBackend(JS_CODE, persistent=True)
+    js.set_global_vars({'x': 1, 'y': [1, 2]})
+    assert js.run('get', ['y']) == [1, 2]
+    js.delete_global_var('y')
+    js.set_global_var('x', 2)
+    assert js.run('get', ['x']) == 2
+    assert js.run('get', ['y']) is None
+    # The code is evaluated once
+    assert js.run('count') == 3
+    js.reset()
+    assert js.run('count') == 0
+    assert js.run('get', ['x']) == 2
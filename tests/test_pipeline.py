@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import shutil
+
+import pytest
+
+from runjs.backends.exceptions import ArgumentError, JSRuntimeException
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.pipeline import PIPELINE_FUNC, Pipeline
+
+JS_CODE = '''
+function parse(s) { return JSON.parse(s); }
+function scale(a, k) { return a.map(function (x) { return x * k; }); }
+function sum(a) { return a.reduce(function (x, y) { return x + y; }, 0); }
+function concat(a, b) { return a.concat(b); }
+function fail() { throw new Error('step failed'); }
+'''
+
+
+def test_call_args():
+    p = Pipeline(None).call('parse', ['[1]'], chain=False)
+    parsed = p.handle()
+    p.call('scale', [2]).call('concat', [parsed])
+    assert p._call_args() == [
+        [['parse', [0], False], ['scale', [1], True],
+         ['concat', [[0]], True]],
+        '[1]', 2]
+
+
+def test_invalid_steps():
+    p = Pipeline(None)
+    with pytest.raises(ArgumentError):
+        p.handle()
+    with pytest.raises(ArgumentError):
+        p._call_args()
+    with pytest.raises(ArgumentError):
+        p.call('parse', 'not a list')
+    p.call('parse', ['[1]'])
+    with pytest.raises(ArgumentError):
+        p.call('sum', [Pipeline(None).call('parse').handle()])
+
+
+def test_run_uses_helper():
+    class Backend(object):
+        def run(self, func, fargs, cache=False, timeout=None):
+            return func, fargs, timeout
+
+    func, fargs, timeout = Pipeline(Backend()).call('sum').run(timeout=1)
+    assert (func, fargs, timeout) == (PIPELINE_FUNC, [[['sum', [], True]]], 1)
+
+
+async def _arun(js, p):
+    try:
+        return await p.arun()
+    finally:
+        await js.aclose()
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+@pytest.mark.parametrize('workers', [0, 1])
+def test_nodejs_pipeline(workers):
+    js = NodeJSBackend(JS_CODE, workers=workers)
+    try:
+        p = js.pipeline().call('parse', ['[1, 2]'], chain=False)
+        parsed = p.handle()
+        p.call('scale', [10]).call('concat', [parsed]).call('sum')
+        assert p.run() == 33
+        assert asyncio.run(_arun(js, p)) == 33
+        with pytest.raises(JSRuntimeException) as info:
+            js.pipeline().call('parse', ['[]'], chain=False).call(
+                'fail').run()
+        assert 'step failed' in info.value.traceback
+    finally:
+        js.close()
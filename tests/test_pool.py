@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.exceptions import ArgumentError, PoolTimeout
+from runjs.backends.pool import BackendPool
+
+
+class GlobalsBackend(AbstractBackend):
+    """ Backend answering with its global variables """
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        return dict(self.js_global_vars)
+
+
+class FirstArgBackend(AbstractBackend):
+    """ Backend returning the first argument """
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        return fargs[0]
+
+
+def pool(size=2, **kwargs):
+    return BackendPool(GlobalsBackend, size, **kwargs)
+
+
+def test_invalid_arguments():
+    with pytest.raises(ArgumentError):
+        pool(0)
+    with pytest.raises(ArgumentError):
+        pool(strategy='random')
+
+
+def test_globals_are_applied_to_every_backend():
+    js = pool()
+    js.set_global_vars({'x': 1, 'y': 2})
+    js.delete_global_var('y')
+    for _ in js.backends:
+        assert js.run() == {'x': 1}
+    js.set_global_var('x', 3)
+    assert [js.run() for _ in js.backends] == [{'x': 3}, {'x': 3}]
+
+
+def test_round_robin():
+    js = pool()
+    with js.acquire() as first:
+        pass
+    with js.acquire() as second:
+        pass
+    assert first is not second
+
+
+def test_thread_strategy_prefers_last_backend():
+    js = pool(strategy='thread')
+    with js.acquire() as first:
+        pass
+    with js.acquire() as second:
+        pass
+    assert first is second
+
+
+def test_timeout():
+    js = pool(1, timeout=0.05)
+    with js.acquire():
+        with pytest.raises(PoolTimeout):
+            js.run()
+        with pytest.raises(PoolTimeout):
+            with js.acquire(block=False):
+                pass
+    assert js.stats()['timeouts'] == 2
+    assert js.run() == {}
+
+
+def test_threads_wait_for_idle_backend():
+    js = pool(2)
+    busy = []
+    lock = threading.Lock()
+    peak = []
+
+    def call():
+        with js.acquire():
+            with lock:
+                busy.append(1)
+                peak.append(len(busy))
+            threading.Event().wait(0.01)
+            with lock:
+                busy.pop()
+
+    threads = [threading.Thread(target=call) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert max(peak) <= 2
+    stats = js.stats()
+    assert stats['acquired'] == 10
+    assert stats['busy'] == 0 and stats['idle'] == 2
+
+
+def test_generator_holds_backend():
+    js = BackendPool(FirstArgBackend, 1, timeout=0)
+    results = js.run_many('f', [[1], [2], [3]], chunk_size=1,
+                          as_generator=True)
+    assert next(results) == 1
+    with pytest.raises(PoolTimeout):
+        js.run('f', [1])
+    assert list(results) == [2, 3]
+    assert js.run('f', [4]) == 4
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import os
+
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.process_pool import EngineProcessPool
+
+
+def cpus(pool):
+    return [process.cpu for process in pool.processes]
+
+
+def test_processes_are_not_pinned_by_default():
+    assert cpus(EngineProcessPool(2, AbstractBackend)) == [None, None]
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_getaffinity'),
+                    reason='CPU affinity is not supported')
+def test_pinned_pools_take_next_cpus():
+    allowed = sorted(os.sched_getaffinity(0))
+    first = cpus(EngineProcessPool(1, AbstractBackend, pin_cpus=True))
+    second = cpus(EngineProcessPool(1, AbstractBackend, pin_cpus=True))
+    assert set(first + second) <= set(allowed)
+    if len(allowed) > 1:
+        assert first != second
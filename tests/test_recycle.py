@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import time
+
+import pytest
+
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.exceptions import ArgumentError
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.recycle import RecyclePolicy, RecyclingPool, process_rss
+
+
+class Engine(object):
+    """ Engine of the pool counting its calls """
+
+    def __init__(self):
+        self.alive = False
+        self.pid = None
+        self.calls = 0
+        self.last_used = time.monotonic()
+
+    def start(self):
+        self.alive = True
+
+    def stop(self):
+        self.alive = False
+
+
+class EnginePool(RecyclingPool):
+
+    def _new_engine(self, engine):
+        return Engine()
+
+    def call(self):
+        engine = self._acquire()
+        try:
+            engine.calls += 1
+            engine.last_used = time.monotonic()
+            return engine
+        finally:
+            self._release(engine)
+
+
+def test_create():
+    policy = RecyclePolicy(max_calls=1)
+    assert RecyclePolicy.create(policy) is policy
+    assert RecyclePolicy.create(None) is None
+    assert RecyclePolicy.create({'max_calls': 2}).max_calls == 2
+    with pytest.raises(ArgumentError):
+        RecyclePolicy.create(10)
+    with pytest.raises(ArgumentError):
+        RecyclePolicy(check_interval=0)
+
+
+def test_reason():
+    assert RecyclePolicy().reason(10 ** 6, os.getpid()) is None
+    assert RecyclePolicy(max_calls=3).reason(2) is None
+    assert RecyclePolicy(max_calls=3).reason(3) == 'calls'
+    policy = RecyclePolicy(max_memory=1, check_interval=2)
+    assert policy.reason(2, os.getpid()) == 'memory'
+    assert policy.reason(3, os.getpid()) is None
+    assert policy.reason(2) is None
+    assert process_rss(os.getpid()) > 0
+
+
+def test_idle():
+    policy = RecyclePolicy(idle_timeout=10)
+    assert not policy.idle(0, 0, now=100)
+    assert not policy.idle(1, 95, now=100)
+    assert policy.idle(1, 80, now=100)
+
+
+def test_pool_replaces_engine():
+    policy = RecyclePolicy(max_calls=2)
+    engine = Engine()
+    engine.start()
+    pool = EnginePool([engine], policy, name='Test')
+    assert pool.call() is engine
+    assert pool.call() is engine
+    deadline = time.monotonic() + 5
+    while policy.stats() == [] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    new = pool.engines[0]
+    assert new is not engine and new.alive and not engine.alive
+    assert pool.call() is new
+    assert policy.stats() == [
+        {'backend': 'Test', 'reason': 'calls', 'count': 1}]
+    pool.close()
+    assert not new.alive
+
+
+def test_warm_context_is_recycled():
+    class Backend(AbstractBackend):
+        def run(self, func=None, fargs=[], cache=False, timeout=None):
+            self._recycle_context()
+            if self.js_context is None:
+                self.js_context = object()
+            return self.js_context
+
+    js = Backend(recycle={'max_calls': 2})
+    context = js.run()
+    assert js.run() is context
+    assert js.run() is not context
+    assert js.recycle.stats()[0]['reason'] == 'calls'
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+def test_nodejs_worker_is_recycled():
+    js = NodeJSBackend('function pid() { return process.pid; }', workers=1,
+                       recycle={'max_calls': 2})
+    try:
+        first = js.run('pid')
+        assert js.run('pid') == first
+        deadline = time.monotonic() + 10
+        while js.recycle.stats() == [] and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert js.run('pid') != first
+        assert js.recycle.stats() == [
+            {'backend': 'NodeJSBackend', 'reason': 'calls', 'count': 1}]
+    finally:
+        js.close()
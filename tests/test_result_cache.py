@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.result_cache import ResultCache
+
+
+class IntBackend(AbstractBackend):
+    """ Backend converting JS numbers to int, calls are counted """
+    value = 2
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        if func is not None and (cache or func in self.cached_functions):
+            return self._run_cached(func, fargs, self._run_uncached)
+        return self._run_uncached(func, fargs)
+
+    def _run_uncached(self, func, fargs):
+        self.calls += 1
+        return self.value * sum(fargs)
+
+
+class FloatBackend(IntBackend):
+    value = 2.0
+
+
+JS_CODE = 'function double(x) { return 2 * x; }'
+
+
+def test_hit():
+    cache = ResultCache()
+    js = IntBackend(JS_CODE, result_cache=cache)
+    assert js.run('double', [1], cache=True) == 2
+    assert js.run('double', [1], cache=True) == 2
+    assert js.calls == 1
+    assert js.run('double', [2], cache=True) == 4
+    assert js.calls == 2
+
+
+def test_key_depends_on_code_and_globals():
+    cache = ResultCache()
+    js = IntBackend(JS_CODE, result_cache=cache)
+    other = IntBackend(JS_CODE + '\n', result_cache=cache)
+    js.run('double', [1], cache=True)
+    other.run('double', [1], cache=True)
+    assert other.calls == 1
+    js.set_global_var('x', 1)
+    js.run('double', [1], cache=True)
+    assert js.calls == 2
+
+
+def test_backends_sharing_cache_do_not_mix_results():
+    cache = ResultCache()
+    js_int = IntBackend(JS_CODE, result_cache=cache)
+    js_float = FloatBackend(JS_CODE, result_cache=cache)
+    assert type(js_int.run('double', [1], cache=True)) is int
+    assert type(js_float.run('double', [1], cache=True)) is float
+    assert js_float.calls == 1
+    # The same backend type shares the results
+    assert IntBackend(JS_CODE, result_cache=cache).run(
+        'double', [1], cache=True) == 2
+    assert cache.hits == 1
+
+
+def test_not_serializable_args_are_not_cached():
+    js = IntBackend(JS_CODE, result_cache=ResultCache())
+    assert js._result_cache_key('double', [object()]) is None
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from runjs.backends import register_backend
+from runjs.backends.abstract import AbstractBackend
+from runjs.backends.exceptions import (
+    ArgumentError, JSFunctionNotExists, JSLoadError, JSRuntimeException)
+from runjs.backends.router import AutoBackend
+
+
+class FakeBackend(AbstractBackend):
+    """ Backend answering with its name, calls are counted """
+    can_run_str = True
+    error = None
+
+    def __init__(self, *args, **kwargs):
+        kwargs.pop('recycle', None)
+        super().__init__(*args, **kwargs)
+        self.calls = 0
+
+    def run(self, func=None, fargs=[], cache=False, timeout=None):
+        self.calls += 1
+        for arg in fargs:
+            if not isinstance(arg, (int, str)):
+                raise TypeError('%r is not JSON serializable' % arg)
+        if self.error is not None:
+            raise self.error
+        return type(self).__name__
+
+
+class BrokenEngine(FakeBackend):
+    error = OSError('engine process died')
+
+
+class FailingCall(FakeBackend):
+    error = JSRuntimeException(
+        'boom', 'Error: boom\n    at f (main.js:1:20)')
+
+
+class MissingLibrary(FakeBackend):
+    error = JSLoadError(
+        'module is not defined',
+        'ReferenceError: module is not defined\n    at lib.js:3:1')
+
+
+class FailingReference(FakeBackend):
+    error = JSRuntimeException(
+        'x is not defined',
+        'ReferenceError: x is not defined\n    at f (main.js:1:20)')
+
+
+class NotExists(FakeBackend):
+    error = JSFunctionNotExists('f')
+
+
+class Working(FakeBackend):
+    pass
+
+
+for cls in (BrokenEngine, FailingCall, FailingReference, MissingLibrary,
+            NotExists, Working):
+    register_backend('test_' + cls.__name__, cls)
+
+
+def auto(*names, **kwargs):
+    return AutoBackend(
+        'function f() {}', backends=['test_' + name for name in names],
+        **kwargs)
+
+
+def test_engine_failure_drops_backend():
+    js = auto('BrokenEngine', 'Working')
+    assert js.run('f', [1]) == 'Working'
+    assert list(js.engines) == ['test_Working']
+    assert 'test_BrokenEngine' in js.unavailable
+
+
+def test_invalid_arguments_do_not_drop_backends():
+    js = auto('Working')
+    with pytest.raises(TypeError):
+        js.run('f', [object(), 1])
+    assert list(js.engines) == ['test_Working']
+    assert js.run('f', [1]) == 'Working'
+
+
+def test_argument_error_is_raised():
+    class Invalid(FakeBackend):
+        error = ArgumentError('invalid')
+
+    register_backend('test_Invalid', Invalid)
+    js = auto('Invalid', 'Working')
+    with pytest.raises(ArgumentError):
+        js.run('f')
+    assert js.engines['test_Working'].calls == 0
+    assert 'test_Invalid' in js.engines
+
+
+@pytest.mark.parametrize('name', ['FailingCall', 'FailingReference'])
+def test_runtime_error_is_not_retried(name):
+    js = auto(name, 'Working')
+    with pytest.raises(JSRuntimeException):
+        js.run('f')
+    assert js.engines['test_Working'].calls == 0
+
+
+def test_runtime_error_is_retried_with_fallback():
+    js = auto('FailingCall', 'Working', fallback=True)
+    assert js.run('f') == 'Working'
+
+
+@pytest.mark.parametrize('name', ['MissingLibrary', 'NotExists'])
+def test_definition_error_is_retried(name):
+    js = auto(name, 'Working')
+    assert js.run('f') == 'Working'
+    assert js.run('f') == 'Working'
+    # The failed backend is tried last for the function
+    assert js.stats()['errors'][0]['backend'] == 'test_' + name
+
+
+def test_definition_error_of_every_backend_is_raised():
+    js = auto('MissingLibrary', 'NotExists')
+    with pytest.raises(JSRuntimeException):
+        js.run('f')
+    assert set(js.engines) == {'test_MissingLibrary', 'test_NotExists'}
+
+
+def test_no_backend():
+    with pytest.raises(ArgumentError):
+        AutoBackend(backends=['test_missing_backend'])
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import os
+import shutil
+import threading
+
+import pytest
+
+from runjs.backends.exceptions import JSRuntimeException
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.server import RunJSServer
+from runjs.wrapper import JSRunWrapper
+
+pytestmark = pytest.mark.skipif(
+    shutil.which(NodeJSBackend.node_bin) is None,
+    reason='Node.js is not installed')
+
+JS_CODE = '''
+function add(a, b) { return a + b; }
+function get(name) { return global[name]; }
+function fail(msg) { throw new Error(msg); }
+'''
+
+
+@pytest.fixture
+def socket_path(tmp_path):
+    path = os.path.join(str(tmp_path), 'runjs.sock')
+    server = RunJSServer(path, 'nodejs', pool_size=2,
+                         options={'workers': 1})
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+
+    def serve():
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(server.start())
+        started.set()
+        loop.run_forever()
+        server.close()
+        tasks = asyncio.all_tasks(loop)
+        for task in tasks:
+            task.cancel()
+        loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        loop.close()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    started.wait(10)
+    yield path
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+
+
+def remote(socket_path):
+    return JSRunWrapper.factory(
+        backend='remote', js_code=JS_CODE, socket_path=socket_path)
+
+
+def test_round_trip(socket_path):
+    js = remote(socket_path)
+    assert js.run('add', [1, 2]) == 3
+    assert js.run('add', [b'', 'x']) == 'x'
+    assert js.run_many('add', [[i, i] for i in range(10)]) == [
+        i * 2 for i in range(10)]
+    with pytest.raises(JSRuntimeException) as info:
+        js.run('fail', ['boom'])
+    assert 'boom' in str(info.value)
+
+
+def test_session_globals(socket_path):
+    js = remote(socket_path)
+    other = remote(socket_path)
+    js.set_global_var('x', 1)
+    other.set_global_var('x', 2)
+    assert js.run('get', ['x']) == 1
+    assert other.run('get', ['x']) == 2
+    js.delete_global_var('x')
+    assert js.run('get', ['x']) is None
+    assert other.run('get', ['x']) == 2
+
+
+def test_requests_see_globals_in_order(socket_path):
+    js = remote(socket_path)
+
+    async def main():
+        tasks = []
+        for i in range(50):
+            js.set_global_var('x', i)
+            tasks.append(asyncio.ensure_future(js.arun('get', ['x'])))
+            # The request is sent with the current globals
+            await asyncio.sleep(0)
+        return await asyncio.gather(*tasks)
+
+    assert asyncio.run(main()) == list(range(50))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+import pickle
+import shutil
+
+import pytest
+
+from runjs.backends import abstract, shared_data as shared_data_module
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.shared_data import DATA_MARKER, SharedData
+
+
+@pytest.fixture
+def registry(tmp_path, monkeypatch):
+    registry = SharedData(data_dir=str(tmp_path / 'data'))
+    monkeypatch.setattr(shared_data_module, 'shared_data', registry)
+    monkeypatch.setattr(abstract, 'shared_data', registry)
+    return registry
+
+
+def test_equal_values_share_handle(registry):
+    handle = registry.register({'a': [1, 2]})
+    assert registry.register({'a': [1, 2]}) is handle
+    assert registry.register(handle) is handle
+    assert registry.register({'a': [1, 3]}) != handle
+    with open(handle.path) as data_file:
+        assert data_file.read() == handle.json == '{"a": [1, 2]}'
+
+
+def test_handle_pickled_as_file(registry, monkeypatch):
+    handle = registry.register([1, 2])
+    assert pickle.loads(pickle.dumps(handle)) is handle
+    # Other process maps the file
+    monkeypatch.setattr(shared_data_module, 'shared_data',
+                        SharedData(registry.data_dir))
+    copy = pickle.loads(pickle.dumps(handle))
+    assert copy == handle and copy._json is None
+    assert copy.json == '[1, 2]'
+
+
+def test_default_directory_is_private():
+    handle = SharedData().register([1])
+    info = os.stat(os.path.dirname(handle.path))
+    assert info.st_uid == os.getuid() and info.st_mode & 0o077 == 0
+
+
+def test_directory_writable_by_others_is_refused(tmp_path):
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    data_dir.chmod(0o777)
+    with pytest.raises(PermissionError):
+        SharedData(str(data_dir)).register([1])
+
+
+def test_planted_file_is_replaced(registry):
+    path = registry._write('0' * 40, '[1]')
+    with open(path, 'w') as data_file:
+        data_file.write('[2]')
+    assert SharedData(registry.data_dir)._write('0' * 40, '[1]') == path
+    with open(path) as data_file:
+        assert data_file.read() == '[1]'
+
+
+def test_removed_file_is_written_again(registry):
+    handle = registry.register([1])
+    os.remove(handle.path)
+    assert handle.ref() == {DATA_MARKER: [handle.path, handle.digest]}
+    assert os.path.isfile(handle.path)
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+@pytest.mark.parametrize('workers', [0, 1])
+def test_nodejs_register_data(registry, workers):
+    js = NodeJSBackend('function price(k) { return tariffs[k]; }',
+                       workers=workers)
+    try:
+        handle = js.register_data('tariffs', {'A': 1.5})
+        assert js.run('price', ['A']) == 1.5
+        version = js.js_global_vars_version
+        assert js.register_data('tariffs', {'A': 1.5}) is handle
+        assert js.js_global_vars_version == version
+        js.register_data('tariffs', {'A': 2})
+        assert js.run('price', ['A']) == 2
+    finally:
+        js.close()
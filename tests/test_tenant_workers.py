@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+import shutil
+
+import pytest
+
+from runjs.backends import nodejs_worker
+from runjs.backends.nodejs_backend import NodeJSBackend
+
+pytestmark = pytest.mark.skipif(
+    shutil.which(NodeJSBackend.node_bin) is None,
+    reason='Node.js is not installed')
+
+JS_CODE = '''
+var calls = 0;
+function get(name) { calls++; return global[name]; }
+function count() { return calls; }
+'''
+
+
+@pytest.fixture(autouse=True)
+def tenant_pools(monkeypatch):
+    pools = {}
+    monkeypatch.setattr(nodejs_worker, '_tenant_pools', pools)
+    yield pools
+    for pool in pools.values():
+        pool.close()
+
+
+def test_backends_share_workers(tenant_pools):
+    first = NodeJSBackend(JS_CODE, shared_workers=1)
+    second = NodeJSBackend(JS_CODE, shared_workers=1)
+    other = NodeJSBackend(JS_CODE + 'var extra = 1;', shared_workers=1)
+    first.set_global_var('x', 1)
+    second.set_global_var('x', 2)
+    assert first.run('get', ['x']) == 1
+    assert second.run('get', ['x']) == 2
+    assert first.run('get', ['x']) == 1
+    # The same code shares its context, other code has its own one
+    assert first.run('count') == 3
+    assert other.run('count') == 0
+    assert other.run('get', ['x']) is None
+    [pool] = tenant_pools.values()
+    [worker] = pool.workers
+    assert len(worker.contexts) == 2
+
+
+def test_reset_starts_new_context():
+    js = NodeJSBackend(JS_CODE, shared_workers=1)
+    js.run('get', ['x'])
+    assert js.run('count') == 1
+    js.reset()
+    assert js.run('count') == 0
+
+
+def test_evicted_context_is_loaded_again():
+    first = NodeJSBackend(JS_CODE, shared_workers=1, max_contexts=1)
+    second = NodeJSBackend(JS_CODE + 'var extra = 1;', shared_workers=1,
+                           max_contexts=1)
+    first.set_global_var('x', 5)
+    assert first.run('get', ['x']) == 5
+    assert second.run('count') == 0
+    # Reloaded with the globals of the backend
+    assert first.run('get', ['x']) == 5
+    assert first.run('count') == 1
+
+
+def test_equal_recycle_options_share_pool(tenant_pools):
+    first = NodeJSBackend(JS_CODE, shared_workers=1,
+                          recycle={'max_calls': 100})
+    second = NodeJSBackend(JS_CODE, shared_workers=1,
+                           recycle={'max_calls': 100})
+    other = NodeJSBackend(JS_CODE, shared_workers=1,
+                          recycle={'max_calls': 200})
+    for js in (first, second, other):
+        assert js.run('get', ['x']) is None
+    assert first.worker_pool is second.worker_pool
+    assert other.worker_pool is not first.worker_pool
+    assert len(tenant_pools) == 2
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import json
+import shutil
+import subprocess
+
+import pytest
+
+from runjs.backends.abstract import JS_HELPERS
+from runjs.backends.exceptions import JSConversionException
+from runjs.backends.nodejs_backend import NodeJSBackend
+from runjs.backends.pyv8_backend import PyV8Backend, _index_keys_dict
+
+try:
+    import PyV8
+except ImportError:
+    PyV8 = None
+
+# Values converted by `__runjs_to_json()` with max depth 3
+VALUES = '''[
+    [1, 'a', true, null, 1.5],
+    {a: {b: [1, {c: 2}]}},
+    {0: 'a', 10: 'b', x: 1},
+    [[[[[1]]]]],
+    [4294967296, -0, 1e21],
+    [NaN],
+    [undefined, , 1],
+    [function () {}],
+    [new Date(0)],
+    (function () { var a = [1]; a.push({a: a}); return a; })(),
+    (function () { var b = {}; return [b, b]; })(),
+]'''
+
+
+@pytest.mark.skipif(shutil.which(NodeJSBackend.node_bin) is None,
+                    reason='Node.js is not installed')
+def test_to_json():
+    script = JS_HELPERS + '''
+    process.stdout.write(JSON.stringify(%s.map(function (value) {
+        return __runjs_to_json(value, 3);
+    })));
+    ''' % VALUES
+    output = subprocess.check_output(
+        [NodeJSBackend.node_bin, '-'], input=script.encode())
+    assert json.loads(output) == [
+        'J[1,"a",true,null,1.5]',
+        'J{"a":{"b":[1,{"c":2}]}}',
+        'K{"0":"a","10":"b","x":1}',
+        # Too deep
+        None,
+        # Floats in Python
+        None,
+        None,
+        'J[null,null,1]',
+        None,
+        None,
+        'C',
+        # A repeated object is not a cycle
+        'J[{},{}]',
+    ]
+
+
+def test_index_keys_dict():
+    assert _index_keys_dict([
+        ('0', 'a'), ('10', 'b'), ('01', 'c'), ('4294967295', 'd'),
+        ('x', 'e'), ('١', 'f')]) == {
+            0: 'a', 10: 'b', '01': 'c', '4294967295': 'd', 'x': 'e',
+            '١': 'f'}
+
+
+@pytest.mark.skipif(PyV8 is None, reason='PyV8 is not installed')
+def test_pyv8_conversion():
+    js = PyV8Backend('''
+        function echo(value) { return value; }
+        function cyclic() { var a = []; a.push(a); return a; }
+        function sparse() { return {0: 'a', x: [1.5, null]}; }
+    ''')
+    value = {'a': [1, 'b', None, {'c': True}], 'd': 2.5}
+    assert js.run('echo', [value]) == value
+    assert js.run('sparse') == {0: 'a', 'x': [1.5, None]}
+    with pytest.raises(JSConversionException):
+        js.run('cyclic')